@@ -1,5 +1,7 @@
 # streamlit_dashboard.py
 
+import os
+
 import streamlit as st
 import pandas as pd
 import seaborn as sns
@@ -9,8 +11,21 @@ from wordcloud import WordCloud
 st.set_page_config(layout="wide")
 st.title("📊 Reddit Digital Currency Dashboard")
 
-# Load CSV
-df = pd.read_csv("output/reddit/output_processed.csv")
+comment_cols = [f'comment_{i}_summary' for i in range(1, 6)]
+
+# Load the Parquet dataset written by post_process.py (only the columns used
+# here), falling back to the CSV
+PARQUET_POSTS = "output/reddit/output_processed_parquet/posts.parquet"
+if os.path.exists(PARQUET_POSTS):
+    df = pd.read_parquet(
+        PARQUET_POSTS,
+        columns=['post_date', 'post_upvotes', 'total_comments', 'post_summary'] + comment_cols,
+    )
+    # summaries are stored as [sentiment, misinformation, summary] lists
+    for col in ['post_summary'] + comment_cols:
+        df[col] = df[col].map(lambda v: " | ".join(v) if v is not None else None)
+else:
+    df = pd.read_csv("output/reddit/output_processed.csv")
 df['post_date'] = pd.to_datetime(df['post_date'], errors='coerce')
 df['post_month'] = df['post_date'].dt.to_period('M')
 
@@ -20,8 +35,6 @@ df.rename(columns={
     'total_comments': 'post_total_comments'
 }, inplace=True)
 
-comment_cols = [f'comment_{i}_summary' for i in range(1, 6)]
-
 # 1. Post Upvotes Over Time
 st.subheader("1. 📈 Post Upvotes Over Time")
 fig1, ax1 = plt.subplots(figsize=(8, 4))
@@ -0,0 +1,159 @@
+"""
+Append-only checkpoint log for post_process.py.
+
+Every relevance decision and every post's summaries are appended as one JSON
+line as soon as they are known, so a run that crashes or is killed can be
+resumed (--resume) without paying for the finished rows again, and an
+--incremental run can skip the posts decided before. Entries hold the content
+hash of the post they were made for and are only reused while it matches. The
+first line records the run's settings; a resumed run must use the same keywords.
+
+    {"type": "run", "keywords": [...], "started_at": ...}
+    {"type": "relevance", "post_url": ..., "content_hash": ..., "relevant": true}
+    {"type": "summaries", "post_url": ..., "content_hash": ..., "summaries": {"post_summary": [...], ...}}
+"""
+
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+
+# lines written between fsyncs; every line is flushed to the OS right away
+FSYNC_EVERY = 20
+
+
+def checkpoint_path_for(output_file):
+    """Default log next to the output: output_processed.csv.checkpoint.jsonl."""
+    return Path(f"{str(output_file).rstrip('/')}.checkpoint.jsonl")
+
+
+class CheckpointLog:
+    """
+    Attributes:
+        relevance (dict): post_url -> (content hash, bool), from the log and this run
+        summaries (dict): post_url -> (content hash, summary columns)
+    """
+
+    def __init__(self, path, keywords, resume=False):
+        self.path = Path(path)
+        self.keywords = list(keywords)
+        self.relevance = {}
+        self.summaries = {}
+        self.loaded = False
+        self._unsynced = 0
+        if resume and self.path.exists():
+            self._load()
+            self.loaded = True
+            self.file = open(self.path, "a", encoding="utf-8")
+        else:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.file = open(self.path, "w", encoding="utf-8")
+            self._append(self._run_record())
+
+    def _run_record(self):
+        return {
+            "type": "run",
+            "keywords": self.keywords,
+            "started_at": datetime.now().isoformat(),
+        }
+
+    def _load(self):
+        with open(self.path, encoding="utf-8") as f:
+            for line_number, line in enumerate(f, start=1):
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # a line cut short by the crash
+                    print(f"⚠️ Skipping unreadable line {line_number} of {self.path}")
+                    continue
+                kind = record.get("type")
+                if kind == "run" and record.get("keywords") != self.keywords:
+                    raise ValueError(
+                        f"{self.path} was written for the keywords {record.get('keywords')}; "
+                        "use the same --keywords or start a new run without --resume/--incremental"
+                    )
+                if kind == "relevance":
+                    self.relevance[record["post_url"]] = (
+                        record.get("content_hash"),
+                        record["relevant"],
+                    )
+                elif kind == "summaries":
+                    self.summaries[record["post_url"]] = (
+                        record.get("content_hash"),
+                        record["summaries"],
+                    )
+
+    def _append(self, record):
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.file.flush()
+        self._unsynced += 1
+        if self._unsynced >= FSYNC_EVERY:
+            self.sync()
+
+    def sync(self):
+        os.fsync(self.file.fileno())
+        self._unsynced = 0
+
+    def relevance_for(self, post_url, content_hash):
+        """Logged relevance of the post with this content, or None."""
+        logged_hash, relevant = self.relevance.get(post_url, (None, None))
+        return relevant if logged_hash == content_hash else None
+
+    def summaries_for(self, post_url, content_hash):
+        """Logged summaries of the post with this content, or None."""
+        logged_hash, summaries = self.summaries.get(post_url, (None, None))
+        return summaries if logged_hash == content_hash else None
+
+    def record_relevance(self, post_url, content_hash, relevant):
+        self.relevance[post_url] = (content_hash, relevant)
+        self._append(
+            {
+                "type": "relevance",
+                "post_url": post_url,
+                "content_hash": content_hash,
+                "relevant": relevant,
+            }
+        )
+
+    def record_summaries(self, post_url, content_hash, summaries):
+        self.summaries[post_url] = (content_hash, summaries)
+        self._append(
+            {
+                "type": "summaries",
+                "post_url": post_url,
+                "content_hash": content_hash,
+                "summaries": summaries,
+            }
+        )
+
+    def compact(self):
+        """Rewrite the log with only the latest entry per post."""
+        tmp_path = self.path.with_name(f"{self.path.name}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps(self._run_record(), ensure_ascii=False) + "\n")
+            for post_url, (content_hash, relevant) in self.relevance.items():
+                record = {
+                    "type": "relevance",
+                    "post_url": post_url,
+                    "content_hash": content_hash,
+                    "relevant": relevant,
+                }
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            for post_url, (content_hash, summaries) in self.summaries.items():
+                record = {
+                    "type": "summaries",
+                    "post_url": post_url,
+                    "content_hash": content_hash,
+                    "summaries": summaries,
+                }
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def close(self):
+        self.sync()
+        self.file.close()
+        # resumed and incremental runs append to an older log
+        if self.loaded:
+            self.compact()
@@ -0,0 +1,287 @@
+"""
+Columnar (Parquet) storage for scraped and processed posts.
+
+A dataset is a directory with two tables:
+    posts.parquet     one row per post (no comment blobs); summary columns
+                      (post_summary, comment_N_summary) are lists of strings
+    comments.parquet  one row per comment of the kept top comments and their
+                      replies: post_id, comment_id, parent_id, depth, rank
+                      (1..5, the comment_N thread it belongs to), upvote, body,
+                      permalink, in document order
+
+Readers load only the requested columns and never parse Python repr strings.
+
+Convert an existing CSV using: python ./scrapers/reddit/columnar.py --input_file output/reddit/output_processed.csv
+"""
+
+import argparse
+import ast
+import os
+import time
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from storage import get_post_id, to_int
+
+POSTS_FILE = "posts.parquet"
+COMMENTS_FILE = "comments.parquet"
+COMMENT_COLUMNS = [f"comment_{rank}" for rank in range(1, 6)]
+SUMMARY_COLUMNS = ["post_summary"] + [f"{column}_summary" for column in COMMENT_COLUMNS]
+INT_COLUMNS = ["post_upvotes", "total_comments"]
+
+COMMENTS_SCHEMA = pa.schema(
+    [
+        ("post_id", pa.string()),
+        ("comment_id", pa.string()),
+        ("parent_id", pa.string()),
+        ("depth", pa.int16()),
+        ("rank", pa.int8()),
+        ("upvote", pa.int64()),
+        ("body", pa.string()),
+        ("permalink", pa.string()),
+    ]
+)
+
+
+def dataset_dir_for(csv_path):
+    """Default dataset directory next to a CSV: output.csv -> output_parquet/."""
+    csv_path = Path(csv_path)
+    return csv_path.with_name(f"{csv_path.stem}_parquet")
+
+
+def is_dataset(path):
+    return (Path(path) / POSTS_FILE).exists()
+
+
+def posts_schema(columns):
+    """Schema of the posts table for the (non comment) columns of an input."""
+    fields = [("post_id", pa.string())]
+    for column in columns:
+        if column in COMMENT_COLUMNS or column == "post_id":
+            continue
+        if column in INT_COLUMNS:
+            fields.append((column, pa.int64()))
+        elif column in SUMMARY_COLUMNS:
+            fields.append((column, pa.list_(pa.string())))
+        else:
+            fields.append((column, pa.string()))
+    return pa.schema(fields)
+
+
+def parse_cell(value):
+    """A comment_N / *_summary cell: already parsed, or a Python repr string from a CSV."""
+    if value is None or isinstance(value, (dict, list)):
+        return value
+    if isinstance(value, float) and pd.isna(value):
+        return None
+    if isinstance(value, str):
+        if not value:
+            return None
+        try:
+            return ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            return value
+    return value
+
+
+def _as_string_list(value):
+    value = parse_cell(value)
+    if value is None:
+        return None
+    if isinstance(value, (list, tuple)):
+        return [str(item) for item in value]
+    # e.g. "Error: ..." written when a summary failed
+    return [str(value)]
+
+
+def flatten_comments(post_id, comments):
+    """
+    Flatten comment trees into comments table rows.
+
+    Args:
+        post_id (str): reddit post id
+        comments (list): comment_1..comment_5 values (dicts, repr strings or None)
+
+    Returns:
+        list: row dicts in document order
+    """
+    rows = []
+    for rank, comment in enumerate(comments, start=1):
+        comment = parse_cell(comment)
+        if not isinstance(comment, dict):
+            continue
+        stack = [comment]
+        while stack:
+            current = stack.pop()
+            rows.append(
+                {
+                    "post_id": post_id,
+                    "comment_id": current.get("comment_id"),
+                    "parent_id": current.get("parent_id") or None,
+                    "depth": to_int(current.get("depth")),
+                    "rank": rank,
+                    "upvote": to_int(current.get("upvote")),
+                    "body": current.get("comment_body"),
+                    "permalink": current.get("permalink"),
+                }
+            )
+            stack.extend(reversed(current.get("replies") or []))
+    return rows
+
+
+def split_posts(df, schema):
+    """
+    Split a posts DataFrame (comment_N columns holding dicts or repr strings)
+    into posts and comments tables.
+
+    Returns:
+        tuple: (posts pa.Table, comments pa.Table)
+    """
+    post_ids = [get_post_id(url) for url in df["post_url"]]
+    comment_columns = [c for c in COMMENT_COLUMNS if c in df.columns]
+    comment_rows = []
+    if comment_columns:
+        for post_id, comments in zip(post_ids, df[comment_columns].itertuples(index=False)):
+            comment_rows.extend(flatten_comments(post_id, comments))
+
+    columns = {"post_id": post_ids}
+    for field in schema:
+        if field.name == "post_id":
+            continue
+        values = df[field.name] if field.name in df.columns else [None] * len(df)
+        if field.name in INT_COLUMNS:
+            columns[field.name] = [to_int(v) for v in values]
+        elif field.name in SUMMARY_COLUMNS:
+            columns[field.name] = [_as_string_list(v) for v in values]
+        else:
+            columns[field.name] = [None if pd.isna(v) else str(v) for v in values]
+    posts = pa.Table.from_pydict(columns, schema=schema)
+    comments = pa.Table.from_pylist(comment_rows, schema=COMMENTS_SCHEMA)
+    return posts, comments
+
+
+def write_dataset(df, dataset_dir, comments=None):
+    """
+    Write a posts DataFrame as a dataset.
+
+    Args:
+        df (DataFrame): posts, optionally with comment_N columns
+        dataset_dir (str): output directory
+        comments (DataFrame): comments table to write instead of flattening
+            the comment_N columns (e.g. read with read_comments)
+
+    Returns:
+        tuple: (posts written, comments written)
+    """
+    dataset_dir = Path(dataset_dir)
+    dataset_dir.mkdir(parents=True, exist_ok=True)
+    posts, flat_comments = split_posts(df, posts_schema(df.columns))
+    if comments is not None:
+        flat_comments = pa.Table.from_pandas(
+            comments, schema=COMMENTS_SCHEMA, preserve_index=False
+        )
+    pq.write_table(posts, dataset_dir / POSTS_FILE)
+    pq.write_table(flat_comments, dataset_dir / COMMENTS_FILE)
+    return posts.num_rows, flat_comments.num_rows
+
+
+def csv_to_dataset(csv_path, dataset_dir=None, chunksize=5_000):
+    """
+    Convert a spider or post_process CSV to a dataset, streaming it in chunks.
+    Header lines repeated by appended runs are skipped.
+
+    Returns:
+        tuple: (posts written, comments written)
+    """
+    dataset_dir = Path(dataset_dir or dataset_dir_for(csv_path))
+    dataset_dir.mkdir(parents=True, exist_ok=True)
+    header = pd.read_csv(csv_path, nrows=0).columns.tolist()
+    schema = posts_schema(header)
+
+    posts_tmp = dataset_dir / f"{POSTS_FILE}.tmp"
+    comments_tmp = dataset_dir / f"{COMMENTS_FILE}.tmp"
+    written_posts = written_comments = 0
+    with pq.ParquetWriter(posts_tmp, schema) as posts_writer, pq.ParquetWriter(
+        comments_tmp, COMMENTS_SCHEMA
+    ) as comments_writer:
+        for chunk in pd.read_csv(
+            csv_path, dtype=str, chunksize=chunksize, keep_default_na=False
+        ):
+            chunk = chunk[chunk["post_url"] != "post_url"]
+            chunk = chunk.where(chunk != "", None)
+            posts, comments = split_posts(chunk, schema)
+            posts_writer.write_table(posts)
+            comments_writer.write_table(comments)
+            written_posts += posts.num_rows
+            written_comments += comments.num_rows
+    os.replace(posts_tmp, dataset_dir / POSTS_FILE)
+    os.replace(comments_tmp, dataset_dir / COMMENTS_FILE)
+    return written_posts, written_comments
+
+
+# ────────────────────────────────────────────────────────────────
+# Readers
+# ────────────────────────────────────────────────────────────────
+def read_posts(dataset_dir, columns=None):
+    """Posts table as a DataFrame, optionally only some columns."""
+    return pd.read_parquet(Path(dataset_dir) / POSTS_FILE, columns=columns)
+
+
+def read_comments(dataset_dir, columns=None, max_depth=None):
+    """
+    Comments table as a DataFrame.
+
+    Args:
+        columns (list): columns to load (default: all)
+        max_depth (int): only comments up to this depth (0: top comments only)
+    """
+    filters = [("depth", "<=", max_depth)] if max_depth is not None else None
+    return pd.read_parquet(
+        Path(dataset_dir) / COMMENTS_FILE, columns=columns, filters=filters
+    )
+
+
+def top_comments(dataset_dir):
+    """
+    The comment_1..comment_5 top comments of every post, without replies, as
+    the dicts get_comment returns for generate_comment_summary_async.
+
+    Returns:
+        dict: {post_id: {"comment_1": {...}, ...}}
+    """
+    roots = read_comments(
+        dataset_dir,
+        columns=["post_id", "comment_id", "rank", "upvote", "body"],
+        max_depth=0,
+    )
+    by_post = {}
+    for post_id, comment_id, rank, upvote, body in roots.itertuples(index=False):
+        by_post.setdefault(post_id, {})[f"comment_{rank}"] = {
+            "comment_id": comment_id,
+            "upvote": upvote,
+            "comment_body": body,
+        }
+    return by_post
+
+
+def main():
+    # fmt:off
+    p = argparse.ArgumentParser(description="Convert a posts CSV to a Parquet dataset.")
+    p.add_argument("--input_file", required=True, help="output.csv or output_processed.csv")
+    p.add_argument("--outdir", help="Dataset directory (default: <input>_parquet next to the input)")
+    args = p.parse_args()
+    # fmt:on
+
+    start_time = time.time()
+    dataset_dir = args.outdir or dataset_dir_for(args.input_file)
+    posts, comments = csv_to_dataset(args.input_file, dataset_dir)
+    elapsed_time = time.time() - start_time
+    print(
+        f"Wrote {posts} posts and {comments} comments to {dataset_dir} (Time: {elapsed_time:.2f}s)"
+    )
+
+
+if __name__ == "__main__":
+    main()
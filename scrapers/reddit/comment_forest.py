@@ -0,0 +1,374 @@
+"""
+Array-backed comment forest: a compact alternative to the nested comment dicts.
+
+Comments are stored in preorder (every comment is followed by its whole
+subtree) in parallel numpy arrays, so a subtree is a contiguous slice and tree
+analytics (reply counts, top comments by score, per-depth stats) are vectorised.
+Comment ids, permalinks and bodies live in utf-8 buffers with offset arrays.
+"""
+
+import io
+from array import array
+
+import numpy as np
+from comment_tree import CommentText, CommentTreeBuilder
+
+
+class StringColumn:
+    """Strings packed into one utf-8 buffer plus an offsets array."""
+
+    def __init__(self, data=b"", offsets=None):
+        self.data = data
+        self.offsets = (
+            np.zeros(1, dtype=np.int64)
+            if offsets is None
+            else np.asarray(offsets, dtype=np.int64)
+        )
+
+    @classmethod
+    def from_strings(cls, strings):
+        encoded = [(s or "").encode("utf-8") for s in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        return cls(b"".join(encoded), offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def take(self, indices):
+        """The strings at indices, as a new column."""
+        return StringColumn.from_strings(self[i] for i in indices)
+
+    def __getitem__(self, i):
+        return self.data[self.offsets[i] : self.offsets[i + 1]].decode("utf-8")
+
+    @property
+    def nbytes(self):
+        return len(self.data) + self.offsets.nbytes
+
+
+class CommentForest:
+    """
+    Attributes (one entry per comment, in preorder):
+        parent (int32): index of the parent comment, -1 for top-level comments
+        depth (int16), score (int32)
+        subtree_size (int32): number of comments in the subtree, itself included
+        ids, permalinks, bodies (StringColumn)
+        total_comments (str): totalComments of the comment tree
+    """
+
+    def __init__(
+        self, ids, parent, depth, score, permalinks, bodies, total_comments="0"
+    ):
+        self.ids = ids
+        self.parent = np.asarray(parent, dtype=np.int32)
+        self.depth = np.asarray(depth, dtype=np.int16)
+        self.score = np.asarray(score, dtype=np.int32)
+        self.permalinks = permalinks
+        self.bodies = bodies
+        self.total_comments = total_comments
+        self.subtree_size = self._subtree_sizes()
+
+    def __len__(self):
+        return len(self.parent)
+
+    @classmethod
+    def from_flat(cls, comments, total_comments="0"):
+        """
+        Build a forest from flat comment dicts in document order (as built by
+        CommentTreeBuilder), linking replies through parent_id. Like
+        parse_comments_structure, replies whose parent is missing are dropped.
+        """
+        index_by_id = {c["comment_id"]: i for i, c in enumerate(comments)}
+        children = [[] for _ in comments]
+        roots = []
+        for i, comment in enumerate(comments):
+            if comment["depth"] == 0:
+                roots.append(i)
+            elif comment["depth"] > 0:
+                parent = index_by_id.get(comment["parent_id"])
+                if parent is not None:
+                    children[parent].append(i)
+
+        # preorder: every comment followed by its replies, in document order
+        order = []
+        parent_pos = []
+        stack = [(i, -1) for i in reversed(roots)]
+        while stack:
+            i, parent = stack.pop()
+            position = len(order)
+            order.append(i)
+            parent_pos.append(parent)
+            stack.extend((child, position) for child in reversed(children[i]))
+
+        return cls(
+            StringColumn.from_strings(comments[i]["comment_id"] for i in order),
+            parent_pos,
+            [comments[i]["depth"] for i in order],
+            [comments[i]["upvote"] for i in order],
+            StringColumn.from_strings(comments[i]["permalink"] for i in order),
+            StringColumn.from_strings(comments[i]["comment_body"] for i in order),
+            total_comments,
+        )
+
+    @classmethod
+    def from_comments(cls, comments_data):
+        """Build a forest from parse_comments_structure's nested dicts."""
+        flat = []
+        stack = list(reversed(comments_data.get("comments", [])))
+        while stack:
+            comment = stack.pop()
+            flat.append(comment)
+            stack.extend(reversed(comment.get("replies", [])))
+        return cls.from_flat(flat, comments_data.get("total_comments", "0"))
+
+    def _subtree_sizes(self):
+        size = np.ones(len(self), dtype=np.int32)
+        if not len(self):
+            return size
+        # add each level's sizes to its parents, deepest level first
+        levels = self._levels()
+        for level in reversed(levels[1:]):
+            np.add.at(size, self.parent[level], size[level])
+        return size
+
+    def _levels(self):
+        """Indices of comments by distance from their top-level comment."""
+        level = np.zeros(len(self), dtype=np.int32)
+        has_parent = self.parent >= 0
+        # preorder: parents come before their replies
+        for i in np.flatnonzero(has_parent):
+            level[i] = level[self.parent[i]] + 1
+        return [np.flatnonzero(level == d) for d in range(level.max() + 1)]
+
+    # ────────────────────────────────────────────────────────────────
+    # Queries
+    # ────────────────────────────────────────────────────────────────
+    def roots(self):
+        return np.flatnonzero(self.parent < 0)
+
+    def subtree(self, i):
+        """Indices of comment i and all its replies (a contiguous range)."""
+        return np.arange(i, i + self.subtree_size[i])
+
+    def children(self, i):
+        subtree = self.subtree(i)[1:]
+        return subtree[self.parent[subtree] == i]
+
+    def reply_counts(self, direct=False):
+        """
+        Returns:
+            np.ndarray: replies per comment; direct replies only with direct=True,
+                otherwise every comment in the subtree below it
+        """
+        if direct:
+            has_parent = self.parent >= 0
+            return np.bincount(self.parent[has_parent], minlength=len(self)).astype(
+                np.int32
+            )
+        return self.subtree_size - 1
+
+    def top_k(self, k, roots_only=False):
+        """Indices of the k best scored comments (or top-level comments), best first."""
+        candidates = self.roots() if roots_only else np.arange(len(self))
+        if len(candidates) > k:
+            candidates = candidates[
+                np.argpartition(-self.score[candidates], k - 1)[:k]
+            ]
+        # stable: ties keep document order
+        return candidates[np.argsort(-self.score[candidates], kind="stable")]
+
+    def comment(self, i, replies=True):
+        """Comment i as the dict used by parse_comments_structure."""
+        return {
+            "comment_id": self.ids[i],
+            "upvote": int(self.score[i]),
+            "depth": int(self.depth[i]),
+            "permalink": self.permalinks[i],
+            "parent_id": self.ids[self.parent[i]] if self.parent[i] >= 0 else "",
+            "comment_body": self.bodies[i],
+            "replies": (
+                [self.comment(c) for c in self.children(i)] if replies else []
+            ),
+        }
+
+    def to_comments(self):
+        """The nested structure returned by parse_comments_structure."""
+        return {
+            "total_comments": self.total_comments,
+            "comments": [self.comment(i) for i in self.roots()],
+        }
+
+    @property
+    def nbytes(self):
+        arrays = (self.parent, self.depth, self.score, self.subtree_size)
+        return sum(a.nbytes for a in arrays) + sum(
+            column.nbytes for column in (self.ids, self.permalinks, self.bodies)
+        )
+
+    # ────────────────────────────────────────────────────────────────
+    # Serialisation
+    # ────────────────────────────────────────────────────────────────
+    def to_bytes(self):
+        """Uncompressed .npz bytes; see from_bytes."""
+        buffer = io.BytesIO()
+        arrays = {"parent": self.parent, "depth": self.depth, "score": self.score}
+        for name in ("ids", "permalinks", "bodies"):
+            column = getattr(self, name)
+            arrays[f"{name}_data"] = np.frombuffer(column.data, dtype=np.uint8)
+            arrays[f"{name}_offsets"] = column.offsets
+        arrays["total_comments"] = np.array(str(self.total_comments))
+        np.savez(buffer, **arrays)
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data):
+        arrays = np.load(io.BytesIO(data))
+        columns = {
+            name: StringColumn(
+                arrays[f"{name}_data"].tobytes(), arrays[f"{name}_offsets"]
+            )
+            for name in ("ids", "permalinks", "bodies")
+        }
+        return cls(
+            columns["ids"],
+            arrays["parent"],
+            arrays["depth"],
+            arrays["score"],
+            columns["permalinks"],
+            columns["bodies"],
+            str(arrays["total_comments"]),
+        )
+
+
+class _StringBuffer:
+    """A StringColumn being appended to, one string at a time."""
+
+    def __init__(self):
+        self.data = bytearray()
+        self.offsets = array("q", [0])
+
+    def append(self, string):
+        self.data += (string or "").encode("utf-8")
+        self.offsets.append(len(self.data))
+
+    def column(self):
+        return StringColumn(bytes(self.data), np.frombuffer(self.offsets, dtype=np.int64))
+
+
+# parent of a comment that is left out of the forest (see CommentForest.from_flat)
+_DROPPED = -2
+
+
+def _preorder(parent):
+    """
+    Args:
+        parent (list): parent index of each comment in document order, -1 for
+            top-level comments and _DROPPED for comments left out
+
+    Returns:
+        list: preorder of the comments kept, or None if the document order
+            already is the preorder and no comment is left out
+    """
+    ancestors = []
+    for i, p in enumerate(parent):
+        while ancestors and ancestors[-1] != p:
+            ancestors.pop()
+        if p == _DROPPED or (p >= 0 and not ancestors):
+            break
+        ancestors.append(i)
+    else:
+        return None
+
+    children = [[] for _ in parent]
+    roots = []
+    for i, p in enumerate(parent):
+        if p == -1:
+            roots.append(i)
+        elif p >= 0:
+            children[p].append(i)
+    order = []
+    stack = list(reversed(roots))
+    while stack:
+        i = stack.pop()
+        order.append(i)
+        stack.extend(reversed(children[i]))
+    return order
+
+
+class CommentForestBuilder(CommentTreeBuilder):
+    """
+    CommentTreeBuilder for the parsers' single-pass walk that appends every
+    comment straight to the forest arrays, without keeping a dict per comment,
+    and packs them into a CommentForest (.forest) when the walk is over.
+
+    Replies are linked like CommentTreeBuilder links them: to the latest
+    comment with their parentid, or to the first one opened after them.
+    """
+
+    def __init__(self, total_comments="0"):
+        super().__init__(link=False)
+        self.total_comments = total_comments
+        self.forest = None
+        self._parent = array("i")
+        self._depth = array("h")
+        self._score = array("i")
+        self._ids = _StringBuffer()
+        self._permalinks = _StringBuffer()
+
+    def _add(self, data):
+        index = len(self._parent)
+        comment_id = data["comment_id"]
+        depth = data["depth"]
+        if depth == 0:
+            parent = -1
+        elif depth > 0 and data["parent_id"] in self._by_id:
+            parent = self._by_id[data["parent_id"]]
+        else:
+            parent = _DROPPED
+            if depth > 0:
+                self._orphans[data["parent_id"]].append(index)
+        for orphan in self._orphans.pop(comment_id, []):
+            self._parent[orphan] = index
+        self._by_id[comment_id] = index
+
+        self._parent.append(parent)
+        self._depth.append(depth)
+        self._score.append(data["upvote"])
+        self._ids.append(comment_id)
+        self._permalinks.append(data["permalink"])
+        text = CommentText(index)
+        self._texts.append(text)
+        return text
+
+    def finish(self):
+        bodies = _StringBuffer()
+        for text in self._texts:
+            bodies.append(text.body())
+        self._texts = []
+
+        ids = self._ids.column()
+        permalinks = self._permalinks.column()
+        bodies = bodies.column()
+        parent = np.array(self._parent, dtype=np.int32)
+        depth = np.array(self._depth, dtype=np.int16)
+        score = np.array(self._score, dtype=np.int32)
+        order = _preorder(self._parent)
+        if order is not None:
+            # replies opened before their parent, or left out: reorder
+            order = np.asarray(order, dtype=np.int64)
+            position = np.full(len(parent), -1, dtype=np.int32)
+            position[order] = np.arange(len(order), dtype=np.int32)
+            parent = parent[order]
+            parent = np.where(parent >= 0, position[np.maximum(parent, 0)], -1)
+            depth, score = depth[order], score[order]
+            ids, permalinks, bodies = (
+                column.take(order) for column in (ids, permalinks, bodies)
+            )
+
+        self.forest = CommentForest(
+            ids, parent, depth, score, permalinks, bodies, self.total_comments
+        )
+        self._by_id = {}
+        self._orphans.clear()
+        return self
@@ -0,0 +1,140 @@
+"""
+Single-pass comment tree building shared by the BeautifulSoup and lxml parsers.
+
+The parsers walk the page once, in document order, and call
+CommentTreeBuilder.open_comment() for every shreddit-comment and
+CommentText.see_div() for every div that belongs to that comment (divs inside
+nested replies belong to the reply). Replies are linked to their parent through
+parentid as they are opened, so a thread is parsed in time linear in its size.
+"""
+
+from collections import defaultdict
+
+COMMENT_TEXT_CLASS = "py-0 xs:mx-xs mx-2xs inline-block max-w-full scalable-text"
+COMMENT_MD_CLASS = "md text-14-scalable"
+
+
+def matches_class(classes, wanted):
+    """BeautifulSoup class_ matching: one class token or the whole class string."""
+    return wanted in classes or " ".join(classes) == wanted
+
+
+class CommentText:
+    """
+    Collects the text of one comment from its own content divs, in the order
+    of preference of the original parser: the first scalable-text div, then
+    the first div whose id contains "post-rtjson-content", then the
+    scalable-text div inside the first "md text-14-scalable" div.
+    """
+
+    __slots__ = ("data", "text", "rtjson_text", "md_text", "md_seen")
+
+    def __init__(self, data):
+        self.data = data
+        self.text = None
+        self.rtjson_text = None
+        self.md_text = None
+        self.md_seen = False
+
+    def see_div(self, classes, div_id, in_md, get_text):
+        """
+        Args:
+            classes (list): class tokens of the div
+            div_id (str): id attribute of the div
+            in_md (bool): whether the div is inside this comment's md div
+            get_text (callable): returns the div's get_text(strip=True)
+
+        Returns:
+            bool: True if this div is the comment's md div, so its
+                descendants should be visited with in_md=True
+        """
+        text = None
+        if matches_class(classes, COMMENT_TEXT_CLASS) and (
+            self.text is None or (in_md and self.md_text is None)
+        ):
+            text = get_text()
+            if self.text is None:
+                self.text = text
+            if in_md and self.md_text is None:
+                self.md_text = text
+        if self.rtjson_text is None and "post-rtjson-content" in div_id:
+            self.rtjson_text = get_text() if text is None else text
+        if not self.md_seen and matches_class(classes, COMMENT_MD_CLASS):
+            self.md_seen = True
+            return True
+        return False
+
+    def body(self):
+        return self.text or self.rtjson_text or self.md_text or ""
+
+
+class CommentTreeBuilder:
+    """
+    Args:
+        link (bool): attach replies to their parents and collect root comments;
+            False only collects the flat list (for continuation fragments,
+            which merge_comment_fragment links into an existing tree)
+    """
+
+    def __init__(self, link=True):
+        self.link = link
+        self.comments = []
+        self.roots = []
+        self._texts = []
+        self._by_id = {}
+        # replies seen before their parent, by parent id
+        self._orphans = defaultdict(list)
+
+    def open_comment(self, get_attr):
+        """
+        Start a comment from its shreddit-comment attributes.
+
+        Args:
+            get_attr (callable): attribute getter of the element, get(name, default)
+
+        Returns:
+            CommentText: collector for the comment's own divs, or None if the
+                attributes cannot be parsed (the comment is skipped)
+        """
+        try:
+            data = {
+                "comment_id": get_attr("thingid", ""),
+                "upvote": int(get_attr("score", 0)),
+                "depth": int(get_attr("depth", 0)),
+                "permalink": get_attr("permalink", ""),
+                "parent_id": get_attr("parentid", ""),
+                "comment_body": "",
+                "replies": [],
+            }
+        except Exception as e:
+            print(f"Error extracting comment data: {e}")
+            return None
+        return self._add(data)
+
+    def _add(self, data):
+        self.comments.append(data)
+        if self.link:
+            self._link(data)
+        text = CommentText(data)
+        self._texts.append(text)
+        return text
+
+    def _link(self, comment):
+        comment_id = comment["comment_id"]
+        self._by_id[comment_id] = comment
+        comment["replies"].extend(self._orphans.pop(comment_id, []))
+        if comment["depth"] == 0:
+            self.roots.append(comment)
+        elif comment["depth"] > 0:
+            parent = self._by_id.get(comment["parent_id"])
+            if parent is not None:
+                parent["replies"].append(comment)
+            else:
+                self._orphans[comment["parent_id"]].append(comment)
+
+    def finish(self):
+        """Fill in the comment bodies once the walk is over."""
+        for text in self._texts:
+            text.data["comment_body"] = text.body()
+        self._texts = []
+        return self
@@ -0,0 +1,120 @@
+"""
+Run the reddit spider as several processes, one per shard of the keyword x
+search filter combinations, then merge the shard outputs into <outdir>/output.csv
+(one row per post_url).
+
+Each shard gets its own session file (copied from the main one when it exists)
+and its own output under <outdir>/shards/, while all shards share
+<outdir>/crawl_state.sqlite so a post scraped by one shard is skipped by the others.
+
+Run using: python ./scrapers/reddit/crawl_sharded.py --shards 4 --username abcd --password 123456 --storage_state './tmp/sessions/' --outdir ./output/reddit/ --keywords ""
+"""
+
+import argparse
+import shutil
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from storage import CrawlState, merge_outputs
+
+SPIDER_SCRIPT = Path(__file__).parent / "posts_and_comments.py"
+
+
+def prepare_shard(args, shard_index):
+    """Create the shard's session dir and output dir; return the spider command."""
+    storage_state = Path(args.storage_state) / f"shard_{shard_index}"
+    storage_state.mkdir(parents=True, exist_ok=True)
+    session_file = Path(args.storage_state) / f"{args.username}.json"
+    shard_session = storage_state / f"{args.username}.json"
+    if session_file.exists() and not shard_session.exists():
+        shutil.copy(session_file, shard_session)
+
+    outdir = Path(args.outdir) / "shards" / f"shard_{shard_index}"
+    outdir.mkdir(parents=True, exist_ok=True)
+
+    cmd = [
+        sys.executable,
+        str(SPIDER_SCRIPT),
+        "--username",
+        args.username,
+        "--password",
+        args.password,
+        "--storage_state",
+        str(storage_state),
+        "--outdir",
+        str(outdir),
+        "--keywords",
+        args.keywords,
+        "--shard_index",
+        str(shard_index),
+        "--shard_count",
+        str(args.shards),
+        "--state_db",
+        str(Path(args.outdir) / "crawl_state.sqlite"),
+        "--parse_workers",
+        str(args.parse_workers),
+    ]
+    if args.restart_searches:
+        cmd.append("--restart_searches")
+    if args.two_request_posts:
+        cmd.append("--two_request_posts")
+    return cmd, outdir / "output.csv"
+
+
+def main():
+    # fmt:off
+    p = argparse.ArgumentParser(description="Run the reddit spider in parallel shards.")
+    p.add_argument("--shards", type=int, default=4, help="Number of spider processes")
+    p.add_argument("--username", required=True)
+    p.add_argument("--password", required=True)
+    p.add_argument("--storage_state", required=True)
+    p.add_argument("--outdir", default="./tmp/output", help="Output directory")
+    p.add_argument("--keywords", required=True, help="Keywords separated by comma to search in reddit")
+    p.add_argument("--restart_searches", action="store_true")
+    p.add_argument("--two_request_posts", action="store_true")
+    p.add_argument("--parse_workers", type=int, default=1, help="Parser processes per shard")
+    args = p.parse_args()
+    # fmt:on
+
+    outdir = Path(args.outdir)
+    outdir.mkdir(parents=True, exist_ok=True)
+    output_csv = outdir / "output.csv"
+
+    # index the canonical output once, before the shards open the shared db
+    state_db = outdir / "crawl_state.sqlite"
+    if not state_db.exists() and output_csv.exists():
+        state = CrawlState(state_db)
+        print(f"Indexed {state.import_csv(output_csv)} existing posts")
+        state.close()
+    else:
+        CrawlState(state_db).close()
+
+    start_time = time.time()
+    shards = [prepare_shard(args, i) for i in range(args.shards)]
+    procs = [subprocess.Popen(cmd) for cmd, _ in shards]
+    print(f"Started {len(procs)} spider processes")
+
+    failed = 0
+    for i, proc in enumerate(procs):
+        if proc.wait() != 0:
+            failed += 1
+            print(f"❌ Shard {i} exited with code {proc.returncode}")
+
+    shard_outputs = [str(path) for _, path in shards if path.exists()]
+    written = merge_outputs(shard_outputs, str(output_csv))
+    # merged rows now live in the canonical output
+    for path in shard_outputs:
+        Path(path).unlink()
+
+    elapsed_time = time.time() - start_time
+    print(
+        f"Merged {len(shard_outputs)} shard outputs into {output_csv}: {written} posts (Time: {elapsed_time:.2f}s)"
+    )
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,61 @@
 import ast
+import asyncio
+import hashlib
 import json
 import os
 import re
 import subprocess
 import sys
+from functools import partial
 from pathlib import Path
 
 import pandas as pd
 import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, Tag
 from dotenv import load_dotenv
 from google import genai
 from google.genai import types
 
+from comment_forest import CommentForestBuilder
+from comment_tree import CommentTreeBuilder
+from gemini_scheduler import GeminiScheduler, GeminiThrottled, estimate_tokens
+from llm_cache import llm_cache_key
+from prompt_budget import PromptBudget
+
+try:
+    import lxml_parsers
+except ImportError:  # lxml not installed, BeautifulSoup only
+    lxml_parsers = None
+
 load_dotenv()
 
 client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
 
+# "lxml" (fast, default) or "bs4"; BeautifulSoup is also the fallback whenever
+# lxml is unavailable or cannot parse a page
+PARSER_BACKEND = os.getenv("REDDIT_PARSER_BACKEND", "lxml")
+
+GEMINI_MODEL = "gemini-2.0-flash"  # or "gemini-2.5-flash"
+# Bump a template's version when its prompt changes so cached responses to the
+# old prompt are no longer used
+PROMPT_VERSIONS = {
+    "relevance": 1,
+    "relevance_batch": 1,
+    "post_summary": 1,
+    "comment_summary": 1,
+    "row_summaries": 1,
+}
+SUMMARY_COMMENT_COLUMNS = [f"comment_{rank}" for rank in range(1, 6)]
+# titles per batched relevance prompt, and a rough budget for its size
+RELEVANCE_BATCH_SIZE = 50
+RELEVANCE_BATCH_TOKENS = 4000
+# LLMCache for Gemini responses, see set_llm_cache (post_process.py sets it up)
+llm_cache = None
+# every Gemini request waits for its requests/tokens per minute quota here
+gemini_scheduler = GeminiScheduler()
+# trims post bodies and comments in summary prompts, see set_prompt_budget
+prompt_budget = PromptBudget()
+
 
 # ────────────────────────────────────────────────────────────────
 # Session management
@@ -88,6 +127,31 @@ def retry_login_and_reload(self):
 # ────────────────────────────────────────────────────────────────
 # Scraping helper functions
 # ────────────────────────────────────────────────────────────────
+def _lxml_document(html, backend):
+    """Parsed lxml tree when the lxml backend is selected and usable, else None."""
+    if (backend or PARSER_BACKEND) != "lxml" or lxml_parsers is None:
+        return None
+    return lxml_parsers.parse_document(html)
+
+
+def _lxml_parse(html, backend, parser):
+    """
+    lxml_parsers.<parser>(root) on the page's lxml tree.
+
+    Returns:
+        the parsed result, or None when the caller should parse the page with
+        BeautifulSoup: lxml is not selected or usable, or the parser raised
+    """
+    root = _lxml_document(html, backend)
+    if root is None:
+        return None
+    try:
+        return getattr(lxml_parsers, parser)(root)
+    except Exception as e:
+        print(f"Error parsing with lxml, falling back to BeautifulSoup: {e}")
+        return None
+
+
 def get_cursor_token(html):
     # Look for faceplate-partial src attribute containing 'cursor='
     match = re.search(r'src="[^"]*cursor=([^"&]*)', html)
@@ -96,7 +160,11 @@ def get_cursor_token(html):
     return None
 
 
-def get_posts(response_html):
+def get_posts(response_html, backend=None):
+    posts_data = _lxml_parse(response_html, backend, "get_posts")
+    if posts_data is not None:
+        return posts_data
+
     soup = BeautifulSoup(response_html, "html.parser")
 
     posts_data = []
@@ -196,9 +264,16 @@ def get_posts(response_html):
     return posts_data
 
 
-def parse_post_details(response_html):
+def parse_post_details(response_html, backend=None):
+    details = _lxml_parse(response_html, backend, "parse_post_details")
+    if details is not None:
+        return details
+
     soup = BeautifulSoup(response_html, "html.parser")
+    return _post_details_from_soup(soup)
 
+
+def _post_details_from_soup(soup):
     score = None
     comment_count = None
     body = None
@@ -239,18 +314,73 @@ def parse_post_details(response_html):
     return score, comment_count, body
 
 
-def parse_comments_structure(html_content):
+def parse_comments_structure(html_content, backend=None):
     """
     Parse Reddit comments and create a hierarchical structure.
 
     Args:
         html_content (str): HTML content from Reddit comments page
+        backend (str): "lxml" or "bs4", defaults to PARSER_BACKEND
 
     Returns:
         dict: Hierarchical structure with total comments count and comment list
     """
+    comments_data = _lxml_parse(html_content, backend, "parse_comments_structure")
+    if comments_data is not None:
+        return comments_data
+
     soup = BeautifulSoup(html_content, "html.parser")
+    return _comments_from_soup(soup)
 
+
+def parse_comment_forest(html_content, backend=None):
+    """
+    Parse Reddit comments into a CommentForest: the same comments as
+    parse_comments_structure in parallel arrays, for large threads and tree
+    analytics (subtrees, reply counts, top comments by score).
+
+    Args:
+        html_content (str): HTML content from a Reddit comments or post page
+        backend (str): "lxml" or "bs4", defaults to PARSER_BACKEND
+
+    Returns:
+        CommentForest: empty if the page has no comment tree
+    """
+    forest = _lxml_parse(html_content, backend, "parse_comment_forest")
+    if forest is not None:
+        return forest
+
+    soup = BeautifulSoup(html_content, "html.parser")
+    comment_tree = soup.find("shreddit-comment-tree")
+    if not comment_tree:
+        return CommentForestBuilder().finish().forest
+    builder = CommentForestBuilder(comment_tree.get("totalComments", "0"))
+    return _build_comment_tree(comment_tree, builder=builder).forest
+
+
+def parse_post_page_with_comments(response_html, backend=None):
+    """
+    Parse a full post page once for both the post details and the comment
+    tree that reddit embeds in it.
+
+    Args:
+        response_html (str): HTML of the post page
+        backend (str): "lxml" or "bs4", defaults to PARSER_BACKEND
+
+    Returns:
+        tuple: (score, comment_count, body, comments_data) where comments_data
+            has the same shape as parse_comments_structure's result
+    """
+    parsed = _lxml_parse(response_html, backend, "parse_post_page_with_comments")
+    if parsed is not None:
+        return parsed
+
+    soup = BeautifulSoup(response_html, "html.parser")
+    score, comment_count, body = _post_details_from_soup(soup)
+    return score, comment_count, body, _comments_from_soup(soup)
+
+
+def _comments_from_soup(soup):
     # Find the main comment tree
     comment_tree = soup.find("shreddit-comment-tree")
     if not comment_tree:
@@ -259,36 +389,48 @@ def parse_comments_structure(html_content):
     # Get total comments count
     total_comments = comment_tree.get("totalComments", "0")
 
-    # Find all comment elements
-    comment_elements = comment_tree.find_all("shreddit-comment")
+    # One walk over the tree extracts every comment and links replies to
+    # their parents through parentid
+    builder = _build_comment_tree(comment_tree)
+    return {"total_comments": total_comments, "comments": builder.roots}
 
-    # Create a flat list of all comments
-    all_comments = []
-    for comment_elem in comment_elements:
-        comment_data = extract_comment_data(comment_elem)
-        if comment_data:
-            all_comments.append(comment_data)
 
-    # Build proper hierarchical structure using parentId
-    comments_by_id = {comment["comment_id"]: comment for comment in all_comments}
-    root_comments = []
-
-    # First, find all root comments (depth 0)
-    for comment in all_comments:
-        if comment["depth"] == 0:
-            root_comments.append(comment)
+def _build_comment_tree(root, link=True, builder=None):
+    """
+    Visit every element under root once, in document order, opening a comment
+    at each shreddit-comment and reading its text from its own content divs
+    (divs inside nested replies belong to the reply).
 
-    # Then, assign replies to their proper parents using parentId
-    for comment in all_comments:
-        if comment["depth"] > 0 and "parent_id" in comment:
-            parent_id = comment["parent_id"]
-            if parent_id in comments_by_id:
-                parent_comment = comments_by_id[parent_id]
-                if "replies" not in parent_comment:
-                    parent_comment["replies"] = []
-                parent_comment["replies"].append(comment)
+    Args:
+        root: BeautifulSoup element to walk
+        link (bool): link replies to their parents, see CommentTreeBuilder
+        builder: builder to fill instead of a new CommentTreeBuilder(link)
 
-    return {"total_comments": total_comments, "comments": root_comments}
+    Returns:
+        CommentTreeBuilder: with .comments (flat, document order) and .roots
+    """
+    if builder is None:
+        builder = CommentTreeBuilder(link=link)
+    stack = [(root, None, False)]
+    while stack:
+        node, owner, in_md = stack.pop()
+        if node.name == "shreddit-comment":
+            owner = builder.open_comment(node.get)
+            in_md = False
+        elif node.name == "div" and owner is not None:
+            if owner.see_div(
+                node.get("class") or [],
+                node.get("id", ""),
+                in_md,
+                partial(node.get_text, strip=True),
+            ):
+                in_md = True
+        stack.extend(
+            (child, owner, in_md)
+            for child in reversed(node.contents)
+            if isinstance(child, Tag)
+        )
+    return builder.finish()
 
 
 def extract_comment_data(comment_elem):
@@ -299,89 +441,114 @@ def extract_comment_data(comment_elem):
         comment_elem: BeautifulSoup element for a single comment
 
     Returns:
-        dict: Comment data including text, upvotes, author, and replies
+        dict: Comment data (id, upvotes, depth, permalink, parent id and the
+            text of the comment itself, not of its replies) or None
     """
-    try:
-        # Extract basic comment attributes
-        comment_id = comment_elem.get("thingid", "")  # Note: lowercase 'thingid'
-        author = comment_elem.get("author", "")
-        score = int(comment_elem.get("score", 0))
-        depth = int(comment_elem.get("depth", 0))
-        permalink = comment_elem.get("permalink", "")
-
-        # Extract parent ID for replies
-        parent_id = comment_elem.get("parentid", "")  # Note: lowercase 'parentid'
-
-        # Also extract post ID
-        post_id = comment_elem.get("postid", "")  # Note: lowercase 'postid'
-
-        # If post_id is empty, try to extract from permalink
-        if not post_id and permalink:
-            # Permalink format: /r/subreddit/comments/post_id/comment/comment_id/
-            parts = permalink.split("/")
-            if len(parts) >= 4:
-                post_id = parts[3]  # Extract post_id from permalink
-
-        # Extract comment text
-        comment_text = ""
-
-        # Method 1: Look for div with scalable-text class (most reliable)
-        scalable_divs = comment_elem.find_all(
-            "div", class_="py-0 xs:mx-xs mx-2xs inline-block max-w-full scalable-text"
-        )
-        if scalable_divs:
-            comment_text = scalable_divs[0].get_text(strip=True)
-
-        # Method 2: Look for any div with post-rtjson-content in ID
-        if not comment_text:
-            all_divs = comment_elem.find_all("div")
-            for div in all_divs:
-                div_id = div.get("id", "")
-                if "post-rtjson-content" in div_id:
-                    comment_text = div.get_text(strip=True)
-                    break
-
-        # Method 3: Fallback to md text-14-scalable div
-        if not comment_text:
-            comment_content_div = comment_elem.find("div", class_="md text-14-scalable")
-            if comment_content_div:
-                content_div = comment_content_div.find(
-                    "div",
-                    class_="py-0 xs:mx-xs mx-2xs inline-block max-w-full scalable-text",
-                )
-                if content_div:
-                    comment_text = content_div.get_text(strip=True)
-
-        # Extract timestamp
-        timestamp = ""
-        time_elem = comment_elem.find("time")
-        if time_elem:
-            timestamp = time_elem.get("datetime", "")
-
-        # Extract relative time text (e.g., "1mo ago")
-        relative_time = ""
-        if time_elem:
-            relative_time = time_elem.get_text(strip=True)
-
-        comment_data = {
-            "comment_id": comment_id,
-            # "author": author,
-            "upvote": score,
-            "depth": depth,
-            "permalink": permalink,
-            "parent_id": parent_id,  # Add parent_id for hierarchical structure
-            "comment_body": comment_text,
-            # "comment_date": timestamp,
-            # "comment_relative_time": relative_time,
-            # "post_id": post_id,
-            "replies": [],  # Will be populated by the hierarchical structure
+    comments = _build_comment_tree(comment_elem, link=False).comments
+    if comments and comments[0]["comment_id"] == comment_elem.get("thingid", ""):
+        return comments[0]
+    return None
+
+
+def get_comment_continuations(html_content):
+    """
+    Find the "more replies" / "more comments" partials in a comments page.
+
+    Args:
+        html_content (str): HTML of a post page, comments partial or fragment
+
+    Returns:
+        list: dicts with the partial's "src", "method", hidden input "formdata",
+            and the "parent_id", "parent_depth" and "parent_score" of the
+            comment it expands ("" / -1 / None for top-level continuations)
+    """
+    soup = BeautifulSoup(html_content, "html.parser")
+    return _continuations_from_soup(soup)
+
+
+def _continuations_from_soup(soup):
+    continuations = []
+    for partial in soup.find_all("faceplate-partial"):
+        src = partial.get("src", "")
+        if (
+            "/svc/shreddit/more-comments/" not in src
+            and "/svc/shreddit/comments/" not in src
+        ):
+            continue
+        parent = partial.find_parent("shreddit-comment")
+        try:
+            parent_depth = int(parent.get("depth", 0)) if parent else -1
+            parent_score = int(parent.get("score", 0)) if parent else None
+        except (ValueError, TypeError):
+            parent_depth, parent_score = 0, 0
+        formdata = {
+            field.get("name"): field.get("value", "")
+            for field in partial.find_all("input", attrs={"type": "hidden"})
+            if field.get("name")
         }
+        continuations.append(
+            {
+                "src": src,
+                "method": (partial.get("method") or "GET").upper(),
+                "formdata": formdata,
+                "parent_id": parent.get("thingid", "") if parent else "",
+                "parent_depth": parent_depth,
+                "parent_score": parent_score,
+            }
+        )
+    return continuations
 
-        return comment_data
 
-    except Exception as e:
-        print(f"Error extracting comment data: {e}")
-        return None
+def parse_comment_fragment(html_content):
+    """
+    Parse a continuation partial, which holds comments without the
+    shreddit-comment-tree wrapper of the first comments page.
+
+    Args:
+        html_content (str): HTML of a more-comments / more-replies partial
+
+    Returns:
+        dict: {"comments": flat list of comment dicts in document order,
+            "continuations": further partials, see get_comment_continuations}
+    """
+    soup = BeautifulSoup(html_content, "html.parser")
+    comments = _build_comment_tree(soup, link=False).comments
+    return {"comments": comments, "continuations": _continuations_from_soup(soup)}
+
+
+def merge_comment_fragment(comments_data, new_comments):
+    """
+    Attach comments from a continuation partial to an existing comment tree
+    (as returned by parse_comments_structure), linking them through parent_id.
+
+    Args:
+        comments_data (dict): comment tree, updated in place
+        new_comments (list): flat comment dicts from parse_comment_fragment
+
+    Returns:
+        int: number of comments added
+    """
+    comments_by_id = {}
+    stack = list(comments_data.setdefault("comments", []))
+    while stack:
+        comment = stack.pop()
+        comments_by_id[comment["comment_id"]] = comment
+        stack.extend(comment.get("replies", []))
+
+    added = 0
+    for comment in new_comments:
+        if comment["comment_id"] in comments_by_id:
+            continue
+        parent = comments_by_id.get(comment.get("parent_id"))
+        if comment["depth"] == 0:
+            comments_data["comments"].append(comment)
+        elif parent is not None:
+            parent.setdefault("replies", []).append(comment)
+        else:
+            continue
+        comments_by_id[comment["comment_id"]] = comment
+        added += 1
+    return added
 
 
 def save_comments_to_json(comments_data, filename="parsed_comments.json"):
@@ -437,132 +604,469 @@ def print_comments_summary(comments_data):
                 )
 
 
-def is_post_relevant(post_title, keywords):
-    prompt = f"Is this post title '{post_title}' related to any of the topics of these keywords: {keywords}? Answer yes or no."
-    response = client.models.generate_content(
-        # model="gemini-2.5-flash",
-        model="gemini-2.0-flash",
-        contents=prompt,
-        config=types.GenerateContentConfig(
-            thinking_config=types.ThinkingConfig(thinking_budget=0)  # Disables thinking
+# ────────────────────────────────────────────────────────────────
+# Gemini
+# ────────────────────────────────────────────────────────────────
+def set_llm_cache(cache):
+    """Answer generate_text_async from this LLMCache (None disables caching)."""
+    global llm_cache
+    llm_cache = cache
+
+
+def set_gemini_scheduler(scheduler):
+    """Send every Gemini request through this GeminiScheduler."""
+    global gemini_scheduler
+    gemini_scheduler = scheduler
+
+
+def set_prompt_budget(budget):
+    """Fit summary prompts to this PromptBudget (None sends the full texts)."""
+    global prompt_budget
+    prompt_budget = budget
+
+
+def _cached_response(prompt, template):
+    """
+    Returns:
+        tuple: (cache key or None without a cache, cached response text or None)
+    """
+    if llm_cache is None:
+        return None, None
+    key = llm_cache_key(GEMINI_MODEL, template, PROMPT_VERSIONS[template], prompt)
+    return key, llm_cache.get(key)
+
+
+def _store_response(key, template, text):
+    if llm_cache is not None and text is not None:
+        llm_cache.put(key, template, text)
+
+
+def _generate_config(json_output):
+    return types.GenerateContentConfig(
+        thinking_config=types.ThinkingConfig(thinking_budget=0),  # Disables thinking
+        response_mime_type="application/json" if json_output else None,
+    )
+
+
+async def generate_text_async(prompt, template, json_output=False, texts=()):
+    """
+    Gemini response text for a prompt from the asyncio client, or from the
+    LLM cache when the same model, template version and prompt were answered
+    before. Requests go through the quota scheduler and raise GeminiThrottled
+    if they stay rate limited or unreachable.
+
+    Args:
+        prompt (str): full prompt
+        template (str): PROMPT_VERSIONS key of the template the prompt was built from
+        json_output (bool): ask for a JSON response
+        texts (list): (original, trimmed) texts of the prompt, recorded in
+            the prompt budget when the request is sent
+
+    Returns:
+        str: response text
+    """
+    key, cached = _cached_response(prompt, template)
+    if cached is not None:
+        return cached
+
+    if prompt_budget is not None and texts:
+        prompt_budget.record(texts)
+    response = await gemini_scheduler.call_async(
+        lambda: client.aio.models.generate_content(
+            model=GEMINI_MODEL, contents=prompt, config=_generate_config(json_output)
         ),
+        prompt,
     )
-    if "yes" in response.text.lower():
-        return True
-    else:
-        return False
+    _store_response(key, template, response.text)
+    return response.text
+
+
+# The checks and summaries below run on the asyncio Gemini client, from
+# post_process.py's pipeline.
+
 
+def _relevance_prompt(post_title, keywords):
+    return f"Is this post title '{post_title}' related to any of the topics of these keywords: {keywords}? Answer yes or no."
 
-def generate_comment_summary(row, comment_column):
+
+async def is_post_relevant_async(post_title, keywords):
+    response_text = await generate_text_async(
+        _relevance_prompt(post_title, keywords), "relevance"
+    )
+    return "yes" in response_text.lower()
+
+
+def relevance_batches(post_titles, batch_size=None, max_tokens=None):
     """
-    Use Gemini API to generate summary for a comment:
-    - Sentiment (one word) [element 0]
-    - Misinformation (very short, or 'None') [element 1]
-    - Very short summary [element 2]
-    Returns: [sentiment, misinformation, summary]
+    Group titles for are_posts_relevant_async: at most batch_size titles and
+    about max_tokens of titles per batch.
+
+    Returns:
+        list: lists of indices into post_titles
+    """
+    batch_size = batch_size or RELEVANCE_BATCH_SIZE
+    max_tokens = max_tokens or RELEVANCE_BATCH_TOKENS
+    batches = []
+    batch = []
+    tokens = 0
+    for idx, title in enumerate(post_titles):
+        title_tokens = estimate_tokens(str(title))
+        if batch and (len(batch) >= batch_size or tokens + title_tokens > max_tokens):
+            batches.append(batch)
+            batch = []
+            tokens = 0
+        batch.append(idx)
+        tokens += title_tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def _relevance_batch_prompt(post_titles, keywords):
+    numbered = "\n".join(f"{idx}: {title}" for idx, title in enumerate(post_titles))
+    return (
+        f"For each numbered Reddit post title below, is it related to any of the topics of these keywords: {keywords}?\n\n"
+        f"{numbered}\n\n"
+        'Answer with a JSON object mapping every number to "yes" or "no", e.g. {"0": "yes", "1": "no"}.'
+    )
+
+
+def _parse_relevance_answer(response_text, count):
+    """
+    Returns:
+        list: a bool per title, or None if the answer is not a JSON object
+            with a yes/no for every index 0..count-1
     """
     try:
-        # Check if the comment column is None or empty
-        if (
-            pd.isna(row[comment_column])
-            or row[comment_column] is None
-            or row[comment_column] == ""
-        ):
-            return ["None", "None", "None"]
-
-        # Parse the JSON string from the comment column
-        comment_data = ast.literal_eval(row[comment_column])
-        comment_body = comment_data.get("comment_body", "")
-
-        if not comment_body:
-            return ["None", "None", "None"]
-
-        prompt = (
-            f"Given the following Reddit comment:\n"
-            f"Comment: {comment_body}\n\n"
-            "Provide three items separated by '|' (pipe symbol):\n"
-            "1. What is the overall sentiment of the comment? Respond with a single word (e.g., Positive, Negative, Neutral, Angry, Hopeful, etc.).\n"
-            "2. Is there any misinformation in the comment? If yes, describe it very briefly (max 15 words). If none, respond 'None'.\n"
-            "3. Give a very short summary of the comment (max 15 words).\n"
-            "Format: sentiment|misinformation|summary"
-        )
+        answer = json.loads(response_text)
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(answer, dict):
+        return None
+    results = []
+    for idx in range(count):
+        value = answer.get(str(idx))
+        if isinstance(value, bool):
+            results.append(value)
+        elif isinstance(value, str) and value.strip().lower() in ("yes", "no"):
+            results.append(value.strip().lower() == "yes")
+        else:
+            return None
+    return results
+
+
+async def are_posts_relevant_async(post_titles, keywords):
+    """
+    Classify a batch of titles (see relevance_batches) with one Gemini call.
+    Batches whose answer is malformed (or whose call fails) are split in half
+    and retried; a single title falls back to is_post_relevant_async.
 
-        response = client.models.generate_content(
-            # model="gemini-2.5-flash",
-            model="gemini-2.0-flash",
-            contents=prompt,
-            config=types.GenerateContentConfig(
-                thinking_config=types.ThinkingConfig(thinking_budget=0)
+    Args:
+        post_titles (list): titles to classify
+        keywords (list): topics the posts should be about
+
+    Returns:
+        list: a bool per title, None for a title whose call failed (it is
+            undecided, not irrelevant)
+    """
+    if not post_titles:
+        return []
+    if len(post_titles) == 1:
+        try:
+            return [await is_post_relevant_async(post_titles[0], keywords)]
+        except GeminiThrottled:
+            raise
+        except Exception as e:
+            print(f"Error checking relevance for '{post_titles[0]}': {e}")
+            return [None]
+
+    try:
+        results = _parse_relevance_answer(
+            await generate_text_async(
+                _relevance_batch_prompt(post_titles, keywords),
+                "relevance_batch",
+                json_output=True,
             ),
+            len(post_titles),
         )
+    except GeminiThrottled:
+        raise
+    except Exception as e:
+        print(f"Error checking relevance for a batch of {len(post_titles)} posts: {e}")
+        results = None
+    if results is not None:
+        return results
 
-        # Clean the response text
-        response_text = response.text.strip()
+    half = len(post_titles) // 2
+    return await are_posts_relevant_async(
+        post_titles[:half], keywords
+    ) + await are_posts_relevant_async(post_titles[half:], keywords)
 
-        # Split by pipe symbol to get the three components
-        parts = response_text.split("|")
-        if len(parts) >= 3:
-            return [parts[0].strip(), parts[1].strip(), parts[2].strip()]
 
-        # Fallback: try to extract lines if pipe splitting fails
-        lines = [
-            line.strip("-• \n") for line in response_text.splitlines() if line.strip()
-        ]
-        if len(lines) >= 3:
-            return lines[:3]
+def get_comment(row, comment_column):
+    """
+    A row's comment_N top comment as a dict, None if the post has no such
+    comment. Raises if a CSV cell cannot be parsed.
+    """
+    comment_data = row[comment_column]
+    # Comments read from the Parquet dataset are already dicts
+    if not isinstance(comment_data, dict):
+        # Check if the comment column is None or empty
+        if pd.isna(comment_data) or comment_data is None or comment_data == "":
+            return None
 
-        return ["None", "None", "None"]
+        # Parse the Python repr string from the CSV comment column
+        comment_data = ast.literal_eval(comment_data)
+    return comment_data
+
+
+def get_comment_body(row, comment_column):
+    """Body of a row's comment_N top comment, "" if the post has no such comment."""
+    comment_data = get_comment(row, comment_column)
+    return comment_data.get("comment_body", "") if comment_data else ""
+
+
+def _comment_to_summarise(row, comment_column):
+    """get_comment_body, "" for a comment the prompt budget leaves out."""
+    comment_data = get_comment(row, comment_column)
+    if not comment_data or not comment_data.get("comment_body"):
+        return ""
+    if prompt_budget is not None and not prompt_budget.keep_comment(comment_data):
+        return ""
+    return comment_data["comment_body"]
+
+
+def _budget_comment_body(comment_body, texts):
+    """The comment to put into a prompt; appends (original, trimmed) to texts."""
+    if prompt_budget is None:
+        return comment_body
+    fitted = prompt_budget.comment_body(comment_body)
+    texts.append((comment_body, fitted))
+    return fitted
+
+
+def _budget_post_body(post_body, texts):
+    # a missing body (NaN or None) is sent as it is
+    if prompt_budget is None or not isinstance(post_body, str):
+        return post_body
+    fitted = prompt_budget.post_body(post_body)
+    texts.append((post_body, fitted))
+    return fitted
+
+
+def post_content_hash(row):
+    """
+    Hash of what the relevance check and summaries read: title, body and the
+    comment_1..comment_5 bodies (not the vote counts, which change every day).
+    The same post hashes the same from a CSV row or a Parquet dataset row.
+    """
+
+    def text(value):
+        # a missing value is NaN in a CSV row and None in a dataset row
+        return "" if value is None or pd.isna(value) else str(value)
+
+    parts = [text(row.get("post_title")), text(row.get("post_body"))]
+    for column in SUMMARY_COMMENT_COLUMNS:
+        try:
+            parts.append(text(get_comment_body(row, column)))
+        except Exception:
+            parts.append(text(row.get(column)))
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()[:16]
+
+
+def _comment_summary_prompt(comment_body):
+    """
+    Returns:
+        tuple: (prompt, its (original, trimmed) texts for the prompt budget)
+    """
+    texts = []
+    prompt = (
+        f"Given the following Reddit comment:\n"
+        f"Comment: {_budget_comment_body(comment_body, texts)}\n\n"
+        "Provide three items separated by '|' (pipe symbol):\n"
+        "1. What is the overall sentiment of the comment? Respond with a single word (e.g., Positive, Negative, Neutral, Angry, Hopeful, etc.).\n"
+        "2. Is there any misinformation in the comment? If yes, describe it very briefly (max 15 words). If none, respond 'None'.\n"
+        "3. Give a very short summary of the comment (max 15 words).\n"
+        "Format: sentiment|misinformation|summary"
+    )
+    return prompt, texts
+
+
+def _post_summary_prompt(row):
+    """
+    Returns:
+        tuple: (prompt, its (original, trimmed) texts for the prompt budget)
+    """
+    texts = []
+    prompt = (
+        f"Given the following Reddit post information:\n"
+        f"Title: {row['post_title']}\n"
+        f"Upvotes: {row['post_upvotes']}\n"
+        f"Total Comments: {row['total_comments']}\n"
+        f"Body: {_budget_post_body(row['post_body'], texts)}\n\n"
+        "Provide three items separated by '|' (pipe symbol):\n"
+        "1. What is the overall sentiment of the post? Respond with a single word (e.g., Positive, Negative, Neutral, Angry, Hopeful, etc.).\n"
+        "2. Is there any misinformation in the post? If yes, describe it very briefly (max 15 words). If none, respond 'None'.\n"
+        "3. Give a very short summary of the post (max 15 words).\n"
+        "Format: sentiment|misinformation|summary"
+    )
+    return prompt, texts
+
+
+def _parse_summary(response_text):
+    """[sentiment, misinformation, summary] from a 'sentiment|misinformation|summary' answer."""
+    # Clean the response text (None when the answer was blocked)
+    response_text = (response_text or "").strip()
+
+    # Split by pipe symbol to get the three components
+    parts = response_text.split("|")
+    if len(parts) >= 3:
+        return [parts[0].strip(), parts[1].strip(), parts[2].strip()]
+
+    # Fallback: try to extract lines if pipe splitting fails
+    lines = [line.strip("-• \n") for line in response_text.splitlines() if line.strip()]
+    if len(lines) >= 3:
+        return lines[:3]
+
+    return ["None", "None", "None"]
+
+
+async def generate_comment_summary_async(row, comment_column):
+    """
+    Use Gemini API to generate summary for a comment:
+    - Sentiment (one word) [element 0]
+    - Misinformation (very short, or 'None') [element 1]
+    - Very short summary [element 2]
+    Returns: [sentiment, misinformation, summary]
+    Raises if the Gemini call fails, so the row is not taken as summarised.
+    """
+    try:
+        comment_body = _comment_to_summarise(row, comment_column)
     except Exception as e:
         print(f"Error generating summary for {comment_column}: {e}")
         return ["None", "None", "None"]
+    if not comment_body:
+        return ["None", "None", "None"]
+    prompt, texts = _comment_summary_prompt(comment_body)
+    response_text = await generate_text_async(prompt, "comment_summary", texts=texts)
+    return _parse_summary(response_text)
 
 
-def generate_post_summary(row):
+async def generate_post_summary_async(row):
     """
     Use Gemini API to generate:
     - Sentiment (one word) [element 0]
     - Misinformation (very short, or 'None') [element 1]
     - Very short summary [element 2]
     Returns: [sentiment, misinformation, summary]
+    Raises if the Gemini call fails, so the row is not taken as summarised.
     """
+    prompt, texts = _post_summary_prompt(row)
+    return _parse_summary(
+        await generate_text_async(prompt, "post_summary", texts=texts)
+    )
+
+
+def _summary_triple(value):
+    """[sentiment, misinformation, summary] from one entry of a JSON answer, or None."""
+    if not isinstance(value, dict):
+        return None
+    triple = [value.get(key) for key in ("sentiment", "misinformation", "summary")]
+    if not all(isinstance(item, str) and item.strip() for item in triple):
+        return None
+    return [item.strip() for item in triple]
+
+
+def _row_summaries_request(row):
+    """
+    Returns:
+        tuple: (summaries of the empty comment columns, {column: comment body}
+            of the others, combined prompt, its (original, trimmed) texts)
+    """
+    texts = []
+    summaries = {}
+    comments = {}
+    for column in SUMMARY_COMMENT_COLUMNS:
+        try:
+            comment_body = _comment_to_summarise(row, column)
+        except Exception as e:
+            print(f"Error generating summary for {column}: {e}")
+            comment_body = ""
+        if comment_body:
+            comments[column] = comment_body
+        else:
+            summaries[f"{column}_summary"] = ["None", "None", "None"]
+
+    comment_text = "".join(
+        f"{column}: {_budget_comment_body(comment_body, texts)}\n"
+        for column, comment_body in comments.items()
+    )
+    keys = ", ".join(['"post"'] + [f'"{column}"' for column in comments])
     prompt = (
         f"Given the following Reddit post information:\n"
         f"Title: {row['post_title']}\n"
         f"Upvotes: {row['post_upvotes']}\n"
         f"Total Comments: {row['total_comments']}\n"
-        f"Body: {row['post_body']}\n\n"
-        "Provide three items separated by '|' (pipe symbol):\n"
-        "1. What is the overall sentiment of the post? Respond with a single word (e.g., Positive, Negative, Neutral, Angry, Hopeful, etc.).\n"
-        "2. Is there any misinformation in the post? If yes, describe it very briefly (max 15 words). If none, respond 'None'.\n"
-        "3. Give a very short summary of the post (max 15 words).\n"
-        "Format: sentiment|misinformation|summary"
+        f"Body: {_budget_post_body(row['post_body'], texts)}\n\n"
+        f"And its top comments:\n{comment_text or 'None'}\n"
+        "For the post and for each comment provide:\n"
+        "- sentiment: the overall sentiment as a single word (e.g., Positive, Negative, Neutral, Angry, Hopeful, etc.)\n"
+        "- misinformation: any misinformation, described very briefly (max 15 words), or 'None'\n"
+        "- summary: a very short summary (max 15 words)\n"
+        f"Answer with a JSON object with the keys {keys}, each an object with the keys "
+        '"sentiment", "misinformation" and "summary".'
     )
-    try:
-        response = client.models.generate_content(
-            # model="gemini-2.5-flash",
-            model="gemini-2.0-flash",
-            contents=prompt,
-            config=types.GenerateContentConfig(
-                thinking_config=types.ThinkingConfig(thinking_budget=0)
-            ),
-        )
+    return summaries, comments, prompt, texts
 
-        # Clean the response text
-        response_text = response.text.strip()
 
-        # Split by pipe symbol to get the three components
-        parts = response_text.split("|")
-        if len(parts) >= 3:
-            return [parts[0].strip(), parts[1].strip(), parts[2].strip()]
+def _parse_row_answer(response_text):
+    answer = json.loads(response_text)
+    return answer if isinstance(answer, dict) else {}
 
-        # Fallback: try to extract lines if pipe splitting fails
-        lines = [
-            line.strip("-• \n") for line in response_text.splitlines() if line.strip()
-        ]
-        if len(lines) >= 3:
-            return lines[:3]
 
-        return ["None", "None", "None"]
-    except Exception as e:
-        print(f"Error generating summary for post: {e}")
-        return ["None", "None", "None"]
+async def generate_row_summaries_async(row):
+    """
+    Summarise a post and its top comments with one Gemini call that answers
+    in JSON. Entries missing from the answer (or all of them, if it is not
+    JSON) fall back to generate_post_summary_async /
+    generate_comment_summary_async. Raises if a Gemini call fails.
+
+    Returns:
+        dict: {"post_summary": [sentiment, misinformation, summary],
+               "comment_1_summary": [...], ... "comment_5_summary": [...]}
+    """
+    summaries, comments, prompt, texts = _row_summaries_request(row)
+    response_text = await generate_text_async(
+        prompt, "row_summaries", json_output=True, texts=texts
+    )
+    answer = {}
+    try:
+        answer = _parse_row_answer(response_text)
+    except (TypeError, ValueError) as e:
+        print(f"Error generating combined summaries, summarising separately: {e}")
+
+    summaries["post_summary"] = _summary_triple(
+        answer.get("post")
+    ) or await generate_post_summary_async(row)
+    for column in comments:
+        summaries[f"{column}_summary"] = _summary_triple(
+            answer.get(column)
+        ) or await generate_comment_summary_async(row, column)
+    return summaries
+
+
+async def generate_separate_summaries_async(row):
+    """The post and comment_1..comment_5 summaries with one call each, concurrently."""
+    results = await asyncio.gather(
+        generate_post_summary_async(row),
+        *(
+            generate_comment_summary_async(row, column)
+            for column in SUMMARY_COMMENT_COLUMNS
+        ),
+    )
+    return dict(
+        zip(
+            ["post_summary"] + [f"{c}_summary" for c in SUMMARY_COMMENT_COLUMNS],
+            results,
+        )
+    )
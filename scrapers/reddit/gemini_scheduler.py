@@ -0,0 +1,210 @@
+"""
+Quota-aware scheduling of Gemini requests.
+
+Every request first reserves one request from a requests-per-minute bucket
+and its estimated tokens (prompt plus expected answer) from a tokens-per-minute
+bucket, and waits until both allow it. Rate limited (429) and overloaded (5xx)
+answers are retried after the server's Retry-After / RetryInfo delay, or an
+exponential backoff with jitter, and a 429 pauses every request until then.
+Transport errors (timeouts, refused or dropped connections) are retried with
+the same backoff.
+"""
+
+import asyncio
+import random
+import re
+import threading
+import time
+
+import httpx
+from google.genai import errors
+
+# set these to your project's Gemini quota (post_process.py --rpm / --tpm)
+DEFAULT_RPM = 1000
+DEFAULT_TPM = 1_000_000
+# tokens expected in an answer, reserved on top of the prompt
+ANSWER_TOKENS = 200
+# seconds of quota that may be spent at once
+BURST_SECONDS = 10
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# failures to reach Gemini at all, worth retrying like a 5xx
+TRANSIENT_ERRORS = (httpx.TransportError, ConnectionError, TimeoutError)
+
+
+class GeminiThrottled(Exception):
+    """A request was still rate limited or failing after every retry."""
+
+
+def estimate_tokens(text):
+    """Rough token count of a prompt (about 4 characters per token)."""
+    return len(text) // 4 + 1
+
+
+class TokenBucket:
+    """
+    Refills at rate_per_minute, holding at most BURST_SECONDS worth. Callers
+    reserve ahead and may overdraw it: the returned wait keeps them in order.
+    """
+
+    def __init__(self, rate_per_minute):
+        self.rate = rate_per_minute / 60
+        self.capacity = max(1.0, self.rate * BURST_SECONDS)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount):
+        """
+        Returns:
+            float: seconds to wait before the reserved amount may be used
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.level = min(
+                self.capacity, self.level + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            self.level -= amount
+            return max(0.0, -self.level / self.rate)
+
+    def refund(self, amount):
+        with self._lock:
+            self.level = min(self.capacity, self.level + amount)
+
+
+def retry_after(error):
+    """Seconds the server asked to wait (Retry-After header or RetryInfo), or None."""
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if headers is not None:
+        value = headers.get("retry-after")
+        if value:
+            try:
+                return float(value)
+            except ValueError:
+                pass
+    details = getattr(error, "details", None)
+    if isinstance(details, dict):
+        for detail in details.get("error", {}).get("details", []) or []:
+            delay = isinstance(detail, dict) and detail.get("retryDelay")
+            if delay:
+                match = re.fullmatch(r"([\d.]+)s", str(delay))
+                if match:
+                    return float(match.group(1))
+    return None
+
+
+class GeminiScheduler:
+    """
+    Attributes:
+        requests, retries, throttled (int): requests sent, retried, and
+            answered with 429
+        failed (int): requests given up after max_retries
+        waited (float): seconds spent waiting for the quota
+    """
+
+    def __init__(
+        self,
+        rpm=DEFAULT_RPM,
+        tpm=DEFAULT_TPM,
+        max_retries=8,
+        base_delay=2.0,
+        max_delay=60.0,
+    ):
+        self.request_bucket = TokenBucket(rpm)
+        self.token_bucket = TokenBucket(tpm)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.requests = 0
+        self.retries = 0
+        self.throttled = 0
+        self.failed = 0
+        self.waited = 0.0
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _reserve(self, tokens):
+        wait = max(
+            self.request_bucket.reserve(1),
+            self.token_bucket.reserve(tokens),
+            self._paused_until - time.monotonic(),
+        )
+        with self._lock:
+            self.requests += 1
+            self.waited += max(0.0, wait)
+        return max(0.0, wait)
+
+    def _record_usage(self, response, reserved):
+        """Give back tokens reserved beyond what the request actually used."""
+        usage = getattr(response, "usage_metadata", None)
+        used = getattr(usage, "total_token_count", None)
+        if isinstance(used, int) and used < reserved:
+            self.token_bucket.refund(reserved - used)
+
+    def _retry_delay(self, error, attempt):
+        """
+        Returns:
+            float: seconds to wait before retrying
+
+        Raises:
+            the error itself when it is not retryable, GeminiThrottled once
+            max_retries is reached
+        """
+        code = getattr(error, "code", None)
+        retryable = (
+            isinstance(error, errors.APIError) and code in RETRY_STATUSES
+        ) or isinstance(error, TRANSIENT_ERRORS)
+        if not retryable:
+            raise error
+        if attempt >= self.max_retries:
+            with self._lock:
+                self.failed += 1
+            raise GeminiThrottled(
+                f"Gemini request failed after {attempt + 1} attempts: {error}"
+            ) from error
+
+        backoff = min(self.max_delay, self.base_delay * 2**attempt)
+        delay = retry_after(error)
+        if delay is None:
+            delay = backoff
+        # jitter so that requests throttled together do not retry together
+        delay += random.uniform(0, backoff / 2)
+        with self._lock:
+            self.retries += 1
+            if code == 429:
+                self.throttled += 1
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        return delay
+
+    async def call_async(self, send, prompt):
+        """
+        Send a request, waiting for the quota and retrying as needed.
+
+        Args:
+            send (callable): returns an awaitable that sends the request
+            prompt (str): the request's prompt, to estimate its tokens
+
+        Returns:
+            the response awaited from send()
+        """
+        tokens = estimate_tokens(prompt) + ANSWER_TOKENS
+        attempt = 0
+        while True:
+            await asyncio.sleep(self._reserve(tokens))
+            try:
+                response = await send()
+            except Exception as e:
+                await asyncio.sleep(self._retry_delay(e, attempt))
+                attempt += 1
+                continue
+            self._record_usage(response, tokens)
+            return response
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "throttled": self.throttled,
+            "retries": self.retries,
+            "failed": self.failed,
+            "waited": self.waited,
+        }
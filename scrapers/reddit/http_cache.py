@@ -0,0 +1,313 @@
+"""
+On-disk cache of reddit responses for the spider, with record/replay.
+
+Bodies are gzip-compressed and stored once per content hash under
+<cache_dir>/blobs/; an SQLite index maps the canonical request url (which
+includes the search cursor) and a hash of the request body (the form data of
+comment continuation POSTs) to its blob. Entries expire with a TTL per endpoint
+and the least recently used ones are evicted when the cache grows past its size
+limit.
+
+Record: the spider serves fresh entries from the cache and stores new responses.
+Replay: every response comes from the cache (stale entries included) and
+uncached requests are dropped, so the parsers run with zero network.
+"""
+
+import gzip
+import hashlib
+import json
+import sqlite3
+import time
+from pathlib import Path
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from middlewares import get_endpoint
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+
+# seconds; 0 keeps entries forever
+DEFAULT_TTLS = {
+    "search": 6 * 3600,
+    "post": 24 * 3600,
+    "comments": 24 * 3600,
+    "other": 3600,
+}
+DEFAULT_MAX_BYTES = 2 * 1024**3
+
+
+def canonical_url(url):
+    """Lowercase scheme/host, sort query parameters and drop the fragment."""
+    parts = urlsplit(url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit(
+        (parts.scheme.lower(), parts.netloc.lower(), parts.path, query, "")
+    )
+
+
+def cache_key(url, method="GET", body=b""):
+    """Requests without a body keep the key they had before bodies were hashed."""
+    request = f"{method} {canonical_url(url)}"
+    if body:
+        request += f" {hashlib.sha256(body).hexdigest()}"
+    return hashlib.sha256(request.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES, ttls=None):
+        self.cache_dir = Path(cache_dir)
+        self.blob_dir = self.cache_dir / "blobs"
+        self.blob_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.ttls = {**DEFAULT_TTLS, **(ttls or {})}
+        self.conn = sqlite3.connect(str(self.cache_dir / "index.sqlite"), timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                url TEXT,
+                endpoint TEXT,
+                status INTEGER,
+                response_url TEXT,
+                headers TEXT,
+                body_hash TEXT,
+                stored_at REAL,
+                accessed_at REAL
+            )
+            """
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS blobs (hash TEXT PRIMARY KEY, size INTEGER, refs INTEGER)"
+        )
+        self.conn.commit()
+        self._puts_since_evict = 0
+
+    def _blob_path(self, body_hash):
+        return self.blob_dir / body_hash[:2] / f"{body_hash}.gz"
+
+    def get(self, url, method="GET", ignore_ttl=False, body=b""):
+        """
+        Returns:
+            dict: {"url", "status", "response_url", "headers", "body"} or None
+                if the url is not cached (or expired)
+        """
+        key = cache_key(url, method, body)
+        row = self.conn.execute(
+            "SELECT url, endpoint, status, response_url, headers, body_hash, stored_at FROM entries WHERE key = ?",
+            (key,),
+        ).fetchone()
+        if row is None:
+            return None
+        cached_url, endpoint, status, response_url, headers, body_hash, stored_at = row
+        ttl = self.ttls.get(endpoint, 0)
+        if not ignore_ttl and 0 < ttl < time.time() - stored_at:
+            return None
+        try:
+            with gzip.open(self._blob_path(body_hash), "rb") as f:
+                body = f.read()
+        except FileNotFoundError:
+            return None
+        self.conn.execute(
+            "UPDATE entries SET accessed_at = ? WHERE key = ?", (time.time(), key)
+        )
+        self.conn.commit()
+        return {
+            "url": cached_url,
+            "status": status,
+            "response_url": response_url,
+            "headers": json.loads(headers),
+            "body": body,
+        }
+
+    def put(
+        self,
+        url,
+        status,
+        headers,
+        body,
+        response_url=None,
+        method="GET",
+        request_body=b"",
+    ):
+        key = cache_key(url, method, request_body)
+        body_hash = hashlib.sha256(body).hexdigest()
+        blob_path = self._blob_path(body_hash)
+        if not blob_path.exists():
+            blob_path.parent.mkdir(exist_ok=True)
+            tmp_path = blob_path.with_suffix(".tmp")
+            with gzip.open(tmp_path, "wb") as f:
+                f.write(body)
+            tmp_path.replace(blob_path)
+
+        old = self.conn.execute(
+            "SELECT body_hash FROM entries WHERE key = ?", (key,)
+        ).fetchone()
+        # take the new reference first: the old entry may share the blob
+        self.conn.execute(
+            "INSERT INTO blobs (hash, size, refs) VALUES (?, ?, 1) ON CONFLICT(hash) DO UPDATE SET refs = refs + 1",
+            (body_hash, blob_path.stat().st_size),
+        )
+        if old is not None:
+            self._release_blob(old[0])
+        now = time.time()
+        self.conn.execute(
+            "INSERT OR REPLACE INTO entries (key, url, endpoint, status, response_url, headers, body_hash, stored_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                key,
+                url,
+                get_endpoint(url) or "other",
+                status,
+                response_url or url,
+                json.dumps(headers),
+                body_hash,
+                now,
+                now,
+            ),
+        )
+        self.conn.commit()
+
+        self._puts_since_evict += 1
+        if self._puts_since_evict >= 500:
+            self.evict()
+
+    def _release_blob(self, body_hash):
+        """
+        Returns:
+            int: bytes freed (the blob's size once no entry refers to it, else 0)
+        """
+        self.conn.execute("UPDATE blobs SET refs = refs - 1 WHERE hash = ?", (body_hash,))
+        row = self.conn.execute(
+            "SELECT refs, size FROM blobs WHERE hash = ?", (body_hash,)
+        ).fetchone()
+        if row is not None and row[0] <= 0:
+            self.conn.execute("DELETE FROM blobs WHERE hash = ?", (body_hash,))
+            self._blob_path(body_hash).unlink(missing_ok=True)
+            return row[1]
+        return 0
+
+    def size(self):
+        return self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+
+    def evict(self):
+        """
+        Drop expired entries, then least recently used ones until the cache
+        fits in max_bytes.
+
+        Returns:
+            int: number of entries evicted
+        """
+        self._puts_since_evict = 0
+        evicted = 0
+        now = time.time()
+        for endpoint, ttl in self.ttls.items():
+            if ttl <= 0:
+                continue
+            rows = self.conn.execute(
+                "SELECT key, body_hash FROM entries WHERE endpoint = ? AND stored_at < ?",
+                (endpoint, now - ttl),
+            ).fetchall()
+            for key, body_hash in rows:
+                self.conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self._release_blob(body_hash)
+                evicted += 1
+
+        total = self.size()
+        if total > self.max_bytes:
+            rows = self.conn.execute(
+                "SELECT key, body_hash FROM entries ORDER BY accessed_at ASC"
+            )
+            for key, body_hash in rows.fetchall():
+                if total <= self.max_bytes:
+                    break
+                self.conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                total -= self._release_blob(body_hash)
+                evicted += 1
+        self.conn.commit()
+        return evicted
+
+    def iter_pages(self, endpoint=None):
+        """Yield (url, html) for every cached page, optionally for one endpoint."""
+        query = "SELECT url, body_hash FROM entries"
+        params = ()
+        if endpoint:
+            query += " WHERE endpoint = ?"
+            params = (endpoint,)
+        for url, body_hash in self.conn.execute(query, params).fetchall():
+            try:
+                with gzip.open(self._blob_path(body_hash), "rb") as f:
+                    yield url, f.read().decode("utf-8", errors="replace")
+            except FileNotFoundError:
+                continue
+
+    def close(self):
+        self.conn.close()
+
+
+def iter_cached_pages(cache_dir, endpoint=None):
+    """Yield (url, html) pairs from a recorded cache, e.g. to re-run the parsers offline."""
+    cache = ResponseCache(cache_dir)
+    try:
+        yield from cache.iter_pages(endpoint)
+    finally:
+        cache.close()
+
+
+class RedditCacheStorage:
+    """
+    Scrapy HTTPCACHE_STORAGE backed by ResponseCache.
+
+    Settings:
+        HTTPCACHE_DIR: cache directory
+        HTTPCACHE_IGNORE_MISSING: replay mode (serve stale entries, drop misses)
+        REDDIT_CACHE_MAX_BYTES: size limit before LRU eviction
+        REDDIT_CACHE_TTLS: {endpoint: seconds} for search/post/comments/other
+    """
+
+    def __init__(self, settings):
+        self.cache_dir = settings.get("HTTPCACHE_DIR")
+        self.replay = settings.getbool("HTTPCACHE_IGNORE_MISSING")
+        self.max_bytes = settings.getint("REDDIT_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES)
+        self.ttls = settings.getdict("REDDIT_CACHE_TTLS")
+        self.cache = None
+
+    def open_spider(self, spider):
+        self.cache = ResponseCache(self.cache_dir, self.max_bytes, self.ttls)
+        mode = "Replaying" if self.replay else "Recording"
+        print(f"{mode} HTTP cache in {self.cache_dir}")
+
+    def close_spider(self, spider):
+        if not self.replay:
+            self.cache.evict()
+        self.cache.close()
+
+    def retrieve_response(self, spider, request):
+        cached = self.cache.get(
+            request.url, request.method, ignore_ttl=self.replay, body=request.body
+        )
+        if cached is None:
+            return None
+        headers = Headers(cached["headers"])
+        respcls = responsetypes.from_args(
+            headers=headers, url=cached["response_url"], body=cached["body"]
+        )
+        return respcls(
+            url=cached["response_url"],
+            headers=headers,
+            status=cached["status"],
+            body=cached["body"],
+        )
+
+    def store_response(self, spider, request, response):
+        headers = {
+            key.decode("latin-1"): [value.decode("latin-1") for value in values]
+            for key, values in response.headers.items()
+        }
+        self.cache.put(
+            request.url,
+            response.status,
+            headers,
+            response.body,
+            response_url=response.url,
+            method=request.method,
+            request_body=request.body,
+        )
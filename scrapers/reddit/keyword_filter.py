@@ -0,0 +1,175 @@
+"""
+Local keyword pre-filter for post_process.py's relevance check.
+
+Titles and bodies are normalised (case, unicode forms, "₹" spelled "rupee",
+hyphens inside words dropped) so that e.g. "e₹", "eRupee", "e-Rupee" and
+"E-RUPEE" all read "erupee", then matched against every keyword at once with
+an Aho-Corasick automaton. A post is
+    relevant      when a whole keyword is in its title,
+    not relevant  when it has a body and not even a word of a keyword is in
+                  its title or body,
+    ambiguous     otherwise, and only those are sent to Gemini. A title alone
+                  is too short to rule a post out: "RBI expands CBDC pilot"
+                  shares no word with "digital rupee" but is about it.
+Names of the same thing in KEYWORD_ALIASES (e.g. "CBDC" for "digital rupee")
+never decide a post locally: they only keep it from being rejected.
+"""
+
+import re
+import unicodedata
+from collections import deque
+
+# keyword words too common to say anything about a post on their own
+# fmt:off
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "in", "is",
+    "it", "of", "on", "or", "the", "to", "with",
+}
+# fmt:on
+MIN_TERM_LENGTH = 3
+
+# names of the same topic: a post naming one of them is never rejected for a
+# keyword naming another (it is sent to Gemini instead)
+# fmt:off
+KEYWORD_ALIASES = [
+    {
+        "cbdc", "central bank digital currency", "digital rupee", "e-rupee",
+        "e₹", "digital inr", "e-inr",
+    },
+]
+# fmt:on
+
+_INNER_PUNCTUATION = re.compile(r"(?<=\w)[-‐‑–'’.](?=\w)")
+_NON_WORD = re.compile(r"[\W_]+")
+
+
+def normalise_text(text):
+    """Lowercase words separated by single spaces, padded with a space on both sides."""
+    text = unicodedata.normalize("NFKC", str(text)).casefold()
+    text = text.replace("₹", "rupee")
+    text = _INNER_PUNCTUATION.sub("", text)
+    return f" {_NON_WORD.sub(' ', text).strip()} "
+
+
+def keyword_variants(keyword):
+    """
+    Normalised patterns of a keyword: the phrase, its plural and each
+    parenthesised alias, e.g. "Central Bank Digital Currency (CBDC)" gives
+    "central bank digital currency", "cbdc" and their plurals.
+    """
+    aliases = re.findall(r"\(([^)]*)\)", keyword)
+    phrases = [re.sub(r"\([^)]*\)", " ", keyword)] + aliases
+    variants = set()
+    for phrase in phrases:
+        normalised = normalise_text(phrase)
+        if normalised.strip():
+            variants.add(normalised)
+            variants.add(f"{normalised[:-1]}s ")
+    return variants
+
+
+def keyword_aliases(phrases):
+    """
+    Normalised KEYWORD_ALIASES (and their plurals) of the groups that one of
+    the normalised keyword phrases belongs to.
+    """
+    aliases = set()
+    for group in KEYWORD_ALIASES:
+        variants = set().union(*(keyword_variants(alias) for alias in group))
+        if variants & phrases:
+            aliases |= variants
+    return aliases
+
+
+class AhoCorasick:
+    """Multi-pattern substring matcher: one pass over the text for all patterns."""
+
+    def __init__(self, patterns):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [set()]
+        for pattern in patterns:
+            state = 0
+            for char in pattern:
+                if char not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append(set())
+                    self.goto[state][char] = len(self.goto) - 1
+                state = self.goto[state][char]
+            self.output[state].add(pattern)
+
+        # breadth first, so the fail state of a node is already complete
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                if self.fail[child] == child:
+                    self.fail[child] = 0
+                self.output[child] |= self.output[self.fail[child]]
+
+    def find(self, text):
+        """
+        Returns:
+            set: patterns occurring in text
+        """
+        found = set()
+        state = 0
+        goto, fail, output = self.goto, self.fail, self.output
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                found |= output[state]
+        return found
+
+
+class KeywordPrefilter:
+    """
+    Attributes:
+        accepted, rejected, ambiguous (int): posts classified so far
+    """
+
+    def __init__(self, keywords):
+        phrases = set()
+        for keyword in keywords:
+            phrases |= keyword_variants(keyword)
+        terms = {
+            f" {word} "
+            for phrase in phrases
+            for word in phrase.split()
+            if len(word) >= MIN_TERM_LENGTH and word not in STOPWORDS
+        }
+        self.phrases = AhoCorasick(phrases)
+        self.terms = AhoCorasick(terms | phrases | keyword_aliases(phrases))
+        self.accepted = 0
+        self.rejected = 0
+        self.ambiguous = 0
+
+    def classify(self, title, body=""):
+        """
+        Returns:
+            bool: True/False when the match is decisive, None when the post
+                should be checked by the model
+        """
+        title = normalise_text(title)
+        if self.phrases.find(title):
+            self.accepted += 1
+            return True
+        # missing body (None or NaN), or a link/image post
+        has_body = isinstance(body, str) and body.strip()
+        if (
+            has_body
+            and not self.terms.find(title)
+            and not self.terms.find(normalise_text(body))
+        ):
+            self.rejected += 1
+            return False
+        self.ambiguous += 1
+        return None
@@ -0,0 +1,140 @@
+"""
+Persistent cache of Gemini responses for post_process.py.
+
+Entries are keyed by model, prompt template name and version and a hash of
+the prompt (which holds the post or comment text), so an unchanged input is
+answered from the cache and editing a template only requires bumping its
+version. Responses are stored in an SQLite file; entries older than max_age
+are dropped and the least recently used ones are evicted when the stored
+responses grow past max_bytes.
+"""
+
+import hashlib
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+DEFAULT_MAX_BYTES = 256 * 1024**2
+# seconds; 0 keeps entries forever
+DEFAULT_MAX_AGE = 90 * 24 * 3600
+
+
+def llm_cache_key(model, template, version, prompt):
+    prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+    return f"{model}:{template}:v{version}:{prompt_hash}"
+
+
+class LLMCache:
+    """
+    Safe to share between threads; post_process uses it from its asyncio loop.
+
+    Attributes:
+        hits, misses (int): lookups answered from / missing in the cache
+    """
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES, max_age=DEFAULT_MAX_AGE):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._puts_since_evict = 0
+        self.conn = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                template TEXT,
+                response TEXT,
+                size INTEGER,
+                stored_at REAL,
+                accessed_at REAL
+            )
+            """
+        )
+        self.conn.commit()
+
+    def get(self, key):
+        """
+        Returns:
+            str: the cached response text, or None if missing or expired
+        """
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT response, stored_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            now = time.time()
+            if row is None or 0 < self.max_age < now - row[1]:
+                self.misses += 1
+                return None
+            self.conn.execute(
+                "UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+            self.conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, template, response):
+        with self._lock:
+            now = time.time()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, template, response, size, stored_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, template, response, len(response.encode("utf-8")), now, now),
+            )
+            self.conn.commit()
+            self._puts_since_evict += 1
+        if self._puts_since_evict >= 500:
+            self.evict()
+
+    def size(self):
+        with self._lock:
+            return self.conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()[0]
+
+    def evict(self):
+        """
+        Drop entries older than max_age, then least recently used ones until
+        the responses fit in max_bytes.
+
+        Returns:
+            int: number of entries evicted
+        """
+        with self._lock:
+            self._puts_since_evict = 0
+            evicted = 0
+            if self.max_age > 0:
+                evicted += self.conn.execute(
+                    "DELETE FROM responses WHERE stored_at < ?",
+                    (time.time() - self.max_age,),
+                ).rowcount
+
+            total = self.conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()[0]
+            if total > self.max_bytes:
+                rows = self.conn.execute(
+                    "SELECT key, size FROM responses ORDER BY accessed_at ASC"
+                ).fetchall()
+                for key, size in rows:
+                    if total <= self.max_bytes:
+                        break
+                    self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    total -= size
+                    evicted += 1
+            self.conn.commit()
+            return evicted
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups if lookups else 0.0
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": hit_rate}
+
+    def close(self):
+        self.evict()
+        with self._lock:
+            self.conn.close()
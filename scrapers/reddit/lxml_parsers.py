@@ -0,0 +1,279 @@
+"""
+lxml implementations of the page parsers in functions.py.
+
+Each function mirrors its BeautifulSoup ("html.parser") counterpart and returns
+exactly the same data; functions.py picks the backend (REDDIT_PARSER_BACKEND)
+and falls back to BeautifulSoup when lxml is missing or cannot parse a page.
+Use parser_parity.py to compare both backends on recorded pages.
+"""
+
+import re
+from functools import partial
+
+from comment_forest import CommentForestBuilder
+from comment_tree import CommentTreeBuilder, matches_class
+from lxml import etree
+
+# BeautifulSoup stores strings inside these tags as Script/Stylesheet/... types,
+# which get_text() leaves out
+_NON_TEXT_CONTAINERS = {"script", "style", "template", "rt", "rp"}
+
+_AGO_RE = re.compile(r"ago$")
+_DIGITS_RE = re.compile(r"(\d[\d,]*)")
+
+
+def parse_document(html):
+    """Parse html into an lxml tree, or None if lxml cannot parse it."""
+    if not html or not html.strip():
+        return None
+    try:
+        # plain etree elements: lxml.html's python-level class lookup costs
+        # more than the parsing itself on large comment threads
+        return etree.fromstring(html, etree.HTMLParser())
+    except (etree.ParserError, ValueError):
+        return None
+
+
+# ────────────────────────────────────────────────────────────────
+# BeautifulSoup-compatible helpers
+# ────────────────────────────────────────────────────────────────
+def _is_element(node):
+    return isinstance(node.tag, str)
+
+
+def _iter_strings(el):
+    """Yield the text nodes under el in document order, like Tag._all_strings."""
+    inside_root = next(el.iterancestors(*_NON_TEXT_CONTAINERS), None) is not None
+    if not inside_root and next(el.iter(*_NON_TEXT_CONTAINERS), None) is None:
+        # nothing to leave out: let lxml walk the subtree
+        yield from el.itertext()
+        return
+    stack = [("node", el, inside_root)]
+    while stack:
+        kind, value, inside = stack.pop()
+        if kind == "text":
+            if not inside:
+                yield value
+            continue
+        inside = inside or value.tag in _NON_TEXT_CONTAINERS
+        items = []
+        if value.text:
+            items.append(("text", value.text, inside))
+        for child in value:
+            if _is_element(child):
+                items.append(("node", child, inside))
+            # comments and processing instructions only contribute their tail
+            if child.tail:
+                items.append(("text", child.tail, inside))
+        stack.extend(reversed(items))
+
+
+def get_text(el, strip=False):
+    """Equivalent of BeautifulSoup's Tag.get_text() / get_text(strip=True)."""
+    if strip:
+        return "".join(s.strip() for s in _iter_strings(el) if s.strip())
+    return "".join(_iter_strings(el))
+
+
+def _bs_string(el):
+    """Equivalent of BeautifulSoup's Tag.string (None unless one child string)."""
+    children = []
+    if el.text:
+        children.append(el.text)
+    for child in el:
+        children.append(child)
+        if child.tail:
+            children.append(child.tail)
+    if len(children) != 1:
+        return None
+    child = children[0]
+    if isinstance(child, str):
+        return child
+    if not _is_element(child):
+        # a lone comment is a NavigableString in BeautifulSoup
+        return child.text
+    return _bs_string(child)
+
+
+def has_class(el, wanted):
+    """BeautifulSoup class_ matching: one class token or the whole class string."""
+    return matches_class((el.get("class") or "").split(), wanted)
+
+
+def find(el, tag, class_=None, include_self=False, **attrs):
+    """First descendant (like BeautifulSoup's find) matching tag, class and attrs."""
+    nodes = el.iter(tag) if include_self else el.iterdescendants(tag)
+    for node in nodes:
+        if class_ is not None and not has_class(node, class_):
+            continue
+        if all(node.get(name) == value for name, value in attrs.items()):
+            return node
+    return None
+
+
+def find_all(el, tag, class_=None, **attrs):
+    return [
+        node
+        for node in el.iterdescendants(tag)
+        if (class_ is None or has_class(node, class_))
+        and all(node.get(name) == value for name, value in attrs.items())
+    ]
+
+
+# ────────────────────────────────────────────────────────────────
+# Page parsers
+# ────────────────────────────────────────────────────────────────
+def get_posts(root):
+    posts_data = []
+    for post in find_all(
+        root, "search-telemetry-tracker", **{"data-testid": "search-sdui-post"}
+    ):
+        post_data = {}
+
+        title_tag = find(post, "a", **{"data-testid": "post-title"})
+        if title_tag is None:
+            title_tag = find(post, "a", **{"data-testid": "post-title-text"})
+        if title_tag is not None:
+            post_data["post_title"] = title_tag.get("aria-label") or get_text(
+                title_tag, strip=True
+            )
+            post_data["post_url"] = "https://www.reddit.com" + title_tag.get("href")
+        else:
+            post_data["post_title"] = None
+            post_data["post_url"] = None
+
+        subreddit_span = find(post, "span", class_="truncate")
+        if subreddit_span is not None:
+            post_data["subreddit"] = get_text(subreddit_span, strip=True)
+        else:
+            post_data["subreddit"] = None
+
+        timeago = find(post, "faceplate-timeago")
+        if timeago is not None:
+            ts = timeago.get("ts")
+            if ts:
+                post_data["post_date"] = ts
+            else:
+                post_data["post_date"] = timeago.get("title")
+        else:
+            time_span = None
+            for span in post.iterdescendants("span"):
+                string = _bs_string(span)
+                if string is not None and _AGO_RE.search(string):
+                    time_span = span
+                    break
+            post_data["post_date"] = (
+                get_text(time_span, strip=True) if time_span is not None else None
+            )
+
+        counter_row = find(post, "div", **{"data-testid": "search-counter-row"})
+        spans = find_all(counter_row, "span") if counter_row is not None else []
+        post_data["post_upvotes"] = _counter_value(spans, 0)
+        post_data["total_comments"] = _counter_value(spans, 2)
+
+        required_fields = [
+            "post_title",
+            "post_url",
+            "subreddit",
+            "post_date",
+            "post_upvotes",
+            "total_comments",
+        ]
+        if all(post_data.get(field) not in [None, ""] for field in required_fields):
+            posts_data.append(post_data)
+
+    return posts_data
+
+
+def _counter_value(spans, index):
+    if len(spans) <= index:
+        return None
+    faceplate = find(spans[index], "faceplate-number")
+    if faceplate is not None and faceplate.get("number") is not None:
+        return faceplate.get("number")
+    m = _DIGITS_RE.search(get_text(spans[index]))
+    if m:
+        return m.group(1).replace(",", "")
+    return None
+
+
+def parse_post_details(root):
+    score = None
+    comment_count = None
+    body = None
+
+    shreddit_post = find(root, "shreddit-post", include_self=True)
+    if shreddit_post is not None:
+        score_attr = shreddit_post.get("score")
+        if score_attr:
+            try:
+                score = int(score_attr)
+            except (ValueError, TypeError):
+                score = 0
+
+        comment_count_attr = shreddit_post.get("comment-count")
+        if comment_count_attr:
+            try:
+                comment_count = int(comment_count_attr)
+            except (ValueError, TypeError):
+                comment_count = 0
+
+    text_body_div = find(
+        root, "div", class_="text-neutral-content", include_self=True, slot="text-body"
+    )
+    if text_body_div is not None:
+        content_div = find(text_body_div, "div", class_="md text-14-scalable")
+        if content_div is not None:
+            body = get_text(content_div, strip=True)
+    else:
+        body = "None"
+
+    return score, comment_count, body
+
+
+def parse_comments_structure(root):
+    comment_tree = find(root, "shreddit-comment-tree", include_self=True)
+    if comment_tree is None:
+        return {"total_comments": "0", "comments": []}
+
+    total_comments = comment_tree.get("totalComments", "0")
+    builder = build_comment_tree(comment_tree)
+    return {"total_comments": total_comments, "comments": builder.roots}
+
+
+def parse_post_page_with_comments(root):
+    score, comment_count, body = parse_post_details(root)
+    return score, comment_count, body, parse_comments_structure(root)
+
+
+def parse_comment_forest(root):
+    comment_tree = find(root, "shreddit-comment-tree", include_self=True)
+    if comment_tree is None:
+        return CommentForestBuilder().finish().forest
+
+    builder = CommentForestBuilder(comment_tree.get("totalComments", "0"))
+    return build_comment_tree(comment_tree, builder=builder).forest
+
+
+def build_comment_tree(root, link=True, builder=None):
+    """lxml version of functions._build_comment_tree: one walk in document order."""
+    if builder is None:
+        builder = CommentTreeBuilder(link=link)
+    stack = [(root, None, False)]
+    while stack:
+        node, owner, in_md = stack.pop()
+        if node.tag == "shreddit-comment":
+            owner = builder.open_comment(node.get)
+            in_md = False
+        elif node.tag == "div" and owner is not None:
+            if owner.see_div(
+                (node.get("class") or "").split(),
+                node.get("id", ""),
+                in_md,
+                partial(get_text, node, strip=True),
+            ):
+                in_md = True
+        stack.extend(
+            (child, owner, in_md) for child in reversed(node) if _is_element(child)
+        )
+    return builder.finish()
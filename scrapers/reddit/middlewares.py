@@ -0,0 +1,311 @@
+"""
+Downloader middlewares for the reddit spider.
+
+AdaptiveRateMiddleware keeps a token bucket and a concurrency window per reddit
+endpoint (search pages, post pages, svc/shreddit/comments partials) and tunes
+both with AIMD: additive increase while responses are fast, multiplicative
+decrease on slow responses and on 429/5xx. Throttled requests are retried after
+Retry-After (or an exponential backoff) instead of failing the crawl.
+
+Requests waiting for a slot queue up per endpoint and are woken by a single
+timer, and EndpointPriorityQueue (SCHEDULER_PRIORITY_QUEUE) keeps the backlog of
+a saturated endpoint in the scheduler, so it cannot take up the downloader's
+CONCURRENT_REQUESTS while the other endpoints have free slots.
+"""
+
+import random
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+
+from scrapy.pqueues import DownloaderAwarePriorityQueue
+from scrapy.utils.defer import maybe_deferred_to_future
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred
+
+THROTTLE_STATUSES = {429, 500, 502, 503, 504, 522, 524}
+
+
+def get_endpoint(url):
+    """Map a request url to the rate-limited endpoint it belongs to (or None)."""
+    if "/svc/shreddit/comments/" in url:
+        return "comments"
+    if "/search/" in url:
+        return "search"
+    if "/comments/" in url:
+        return "post"
+    return None
+
+
+def parse_retry_after(value):
+    """
+    Parse a Retry-After header value (seconds or HTTP date).
+
+    Returns:
+        float: seconds to wait, or None if missing/unparseable
+    """
+    if not value:
+        return None
+    if isinstance(value, bytes):
+        value = value.decode("latin-1")
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class EndpointLimiter:
+    """Token bucket plus AIMD-controlled concurrency window for one endpoint."""
+
+    def __init__(
+        self,
+        name,
+        rate=2.0,
+        concurrency=4,
+        min_rate=0.2,
+        max_rate=20.0,
+        max_concurrency=16,
+    ):
+        self.name = name
+        self.rate = rate  # tokens (requests) per second
+        self.concurrency = float(concurrency)
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.max_concurrency = max_concurrency
+        self.tokens = 1.0
+        self.last_refill = time.monotonic()
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.last_decrease = 0.0
+        # requests waiting for a slot, oldest first, and the timer that wakes
+        # them when the next token is due or a 429 pause ends
+        self.waiting = deque()
+        self._wakeup = None
+
+    def _take(self):
+        """
+        Take a slot if one is free.
+
+        Returns:
+            float: 0 when a slot was taken, else seconds until the next token
+                or the end of a 429 pause; None when the concurrency window is
+                full (release() frees a slot)
+        """
+        now = time.monotonic()
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self.tokens = min(
+            max(1.0, self.rate), self.tokens + (now - self.last_refill) * self.rate
+        )
+        self.last_refill = now
+        if self.in_flight >= int(self.concurrency):
+            return None
+        if self.tokens < 1.0:
+            return (1.0 - self.tokens) / self.rate
+        self.tokens -= 1.0
+        self.in_flight += 1
+        return 0.0
+
+    def acquire(self):
+        """
+        Returns:
+            Deferred: fires once the request has a slot, in the order the
+                requests asked for one
+        """
+        waiter = Deferred()
+        self.waiting.append(waiter)
+        self._drain()
+        return waiter
+
+    def _drain(self):
+        """Hand free slots to the waiting requests, oldest first."""
+        while self.waiting:
+            if self.waiting[0].called:
+                # cancelled while waiting
+                self.waiting.popleft()
+                continue
+            delay = self._take()
+            if delay is None:
+                return
+            if delay > 0:
+                if self._wakeup is None or not self._wakeup.active():
+                    self._wakeup = reactor.callLater(delay, self._drain)
+                return
+            self.waiting.popleft().callback(None)
+
+    def backed_up(self):
+        """Whether the requests waiting for a slot already fill the window."""
+        return len(self.waiting) >= max(1, int(self.concurrency))
+
+    def release(self):
+        self.in_flight = max(0, self.in_flight - 1)
+        self._drain()
+
+    def on_success(self, latency, target_latency):
+        if latency <= target_latency:
+            # additive increase: roughly +1 concurrency and +0.1 req/s per window
+            self.concurrency = min(
+                self.max_concurrency, self.concurrency + 1.0 / self.concurrency
+            )
+            self.rate = min(self.max_rate, self.rate + 0.1 / self.concurrency)
+        else:
+            self.concurrency = max(1.0, self.concurrency * 0.9)
+            self.rate = max(self.min_rate, self.rate * 0.9)
+
+    def on_throttle(self, retry_after):
+        now = time.monotonic()
+        # requests already in flight when the first 429 arrived belong to the
+        # same congestion event; only halve once per event
+        if now - self.last_decrease > 1.0:
+            self.concurrency = max(1.0, self.concurrency * 0.5)
+            self.rate = max(self.min_rate, self.rate * 0.5)
+            self.last_decrease = now
+        self.tokens = 0.0
+        self.blocked_until = max(self.blocked_until, now + retry_after)
+
+
+class AdaptiveRateMiddleware:
+    """
+    Settings:
+        RATECONTROL_ENDPOINTS: {endpoint: {"rate", "concurrency", "min_rate",
+            "max_rate", "max_concurrency"}} overrides per endpoint
+        RATECONTROL_TARGET_LATENCY: seconds above which a response counts as slow
+        RATECONTROL_MAX_RETRIES: retries of a throttled request before giving up
+        RATECONTROL_BACKOFF_BASE: backoff (s) when no Retry-After is sent
+    """
+
+    def __init__(self, settings, stats):
+        endpoint_settings = settings.getdict("RATECONTROL_ENDPOINTS")
+        self.limiters = {
+            name: EndpointLimiter(name, **endpoint_settings.get(name, {}))
+            for name in ("search", "post", "comments")
+        }
+        self.target_latency = settings.getfloat("RATECONTROL_TARGET_LATENCY", 3.0)
+        self.max_retries = settings.getint("RATECONTROL_MAX_RETRIES", 8)
+        self.backoff_base = settings.getfloat("RATECONTROL_BACKOFF_BASE", 2.0)
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings, crawler.stats)
+
+    async def process_request(self, request, spider):
+        endpoint = get_endpoint(request.url)
+        if endpoint is None or "ratecontrol_endpoint" in request.meta:
+            return None
+        await maybe_deferred_to_future(self.limiters[endpoint].acquire())
+        request.meta["ratecontrol_endpoint"] = endpoint
+        return None
+
+    def _release(self, request):
+        endpoint = request.meta.pop("ratecontrol_endpoint", None)
+        return self.limiters[endpoint] if endpoint else None
+
+    def process_response(self, request, response, spider):
+        limiter = self._release(request)
+        if limiter is None:
+            return response
+
+        if response.status not in THROTTLE_STATUSES:
+            latency = request.meta.get("download_latency", 0.0)
+            limiter.on_success(latency, self.target_latency)
+            limiter.release()
+            self.stats.set_value(
+                f"ratecontrol/{limiter.name}/rate", round(limiter.rate, 2)
+            )
+            self.stats.set_value(
+                f"ratecontrol/{limiter.name}/concurrency", int(limiter.concurrency)
+            )
+            return response
+
+        retries = request.meta.get("ratecontrol_retries", 0)
+        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        if retry_after is None:
+            retry_after = self.backoff_base * 2**retries
+        # jitter so throttled requests do not all come back at once
+        retry_after *= random.uniform(1.0, 1.5)
+        # pause the endpoint before its freed slot goes to a waiting request
+        limiter.on_throttle(retry_after)
+        limiter.release()
+        self.stats.inc_value(f"ratecontrol/{limiter.name}/throttled/{response.status}")
+
+        if retries >= self.max_retries:
+            spider.logger.error(
+                f"Giving up on {request.url} after {retries} throttled retries"
+            )
+            self.stats.inc_value(f"ratecontrol/{limiter.name}/gave_up")
+            return response
+
+        print(
+            f"⏳ {response.status} on {limiter.name}, retrying in {retry_after:.1f}s "
+            f"(rate {limiter.rate:.2f}/s, concurrency {int(limiter.concurrency)})"
+        )
+        self.stats.inc_value(f"ratecontrol/{limiter.name}/retries")
+        retry_request = request.copy()
+        retry_request.meta["ratecontrol_retries"] = retries + 1
+        retry_request.dont_filter = True
+        return retry_request
+
+    def process_exception(self, request, exception, spider):
+        limiter = self._release(request)
+        if limiter is not None:
+            limiter.release()
+        return None
+
+
+class EndpointPriorityQueue(DownloaderAwarePriorityQueue):
+    """
+    Scheduler priority queue with one queue per reddit endpoint: requests of
+    the endpoint with the fewest requests in flight or waiting in
+    AdaptiveRateMiddleware go first, and an endpoint whose waiting requests
+    already fill its concurrency window is held back until they get slots.
+
+    Settings:
+        SCHEDULER_PRIORITY_QUEUE: "middlewares.EndpointPriorityQueue"
+    """
+
+    def __init__(self, crawler, *args, **kwargs):
+        super().__init__(crawler, *args, **kwargs)
+        self.limiters = {}
+        for middleware in crawler.engine.downloader.middleware.middlewares:
+            if isinstance(middleware, AdaptiveRateMiddleware):
+                self.limiters = middleware.limiters
+
+    def _stats(self):
+        """(load, endpoint) of the endpoints that may hand out a request."""
+        stats = []
+        for endpoint in self.pqueues:
+            limiter = self.limiters.get(endpoint)
+            if limiter is None:
+                stats.append((0, endpoint))
+            elif not limiter.backed_up():
+                stats.append((limiter.in_flight + len(limiter.waiting), endpoint))
+        return stats
+
+    def pop(self):
+        stats = self._stats()
+        if not stats:
+            return None
+        endpoint = min(stats)[1]
+        queue = self.pqueues[endpoint]
+        request = queue.pop()
+        if len(queue) == 0:
+            del self.pqueues[endpoint]
+        return request
+
+    def push(self, request):
+        endpoint = get_endpoint(request.url) or "other"
+        if endpoint not in self.pqueues:
+            self.pqueues[endpoint] = self.pqfactory(endpoint)
+        self.pqueues[endpoint].push(request)
+
+    def peek(self):
+        stats = self._stats()
+        if not stats:
+            return None
+        return self.pqueues[min(stats)[1]].peek()
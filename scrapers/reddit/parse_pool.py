@@ -0,0 +1,140 @@
+"""
+Parse reddit pages in worker processes so the spider's reactor thread keeps
+downloading while large comment pages are parsed.
+
+ParsePool.submit() sends a page parser and the raw html to a process pool and
+returns a Deferred with the parsed result. At most `max_pending` pages are
+parsed at once; the rest wait in the reactor, where Scrapy counts their
+responses against SCRAPER_SLOT_MAX_ACTIVE_SIZE and stops downloading until
+the parsers catch up. With workers=0 pages are parsed on the reactor thread.
+"""
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from functions import (
+    get_comment_continuations,
+    get_cursor_token,
+    get_posts,
+    parse_comment_fragment,
+    parse_comments_structure,
+    parse_post_details,
+    parse_post_page_with_comments,
+)
+from twisted.internet import defer
+
+
+# ────────────────────────────────────────────────────────────────
+# Page parsers run in the workers (module level so they can be pickled)
+# ────────────────────────────────────────────────────────────────
+def parse_search(html):
+    """
+    Returns:
+        tuple: (posts, cursor_token)
+    """
+    return get_posts(html), get_cursor_token(html)
+
+
+def parse_post(html, with_comments, with_continuations):
+    """
+    Args:
+        with_comments (bool): also parse the comment tree embedded in the page
+        with_continuations (bool): also find its "more replies" partials
+
+    Returns:
+        tuple: (score, comment_count, body, comments_data, continuations);
+            comments_data is None without with_comments
+    """
+    if not with_comments:
+        score, comment_count, body = parse_post_details(html)
+        return score, comment_count, body, None, []
+    score, comment_count, body, comments_data = parse_post_page_with_comments(html)
+    continuations = get_comment_continuations(html) if with_continuations else []
+    return score, comment_count, body, comments_data, continuations
+
+
+def parse_comments(html, with_continuations):
+    """
+    Returns:
+        tuple: (comments_data, continuations)
+    """
+    comments_data = parse_comments_structure(html)
+    continuations = get_comment_continuations(html) if with_continuations else []
+    return comments_data, continuations
+
+
+def parse_fragment(html):
+    return parse_comment_fragment(html)
+
+
+class ParsePool:
+    """
+    Args:
+        workers (int): worker processes; 0 parses on the reactor thread
+        max_pending (int): pages parsed at once (default: 2 per worker)
+    """
+
+    def __init__(self, workers=2, max_pending=None):
+        self.workers = workers
+        self.max_pending = max_pending or 2 * max(1, workers)
+        self.semaphore = defer.DeferredSemaphore(self.max_pending)
+        self.executor = self._new_executor() if workers > 0 else None
+        self.parsed = 0
+        self.peak_waiting = 0
+        self.restarts = 0
+
+    def _new_executor(self):
+        # spawn: forking a process that already runs the reactor's threads is unsafe
+        return ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+        )
+
+    def submit(self, fn, *args):
+        """
+        Parse a page with fn(*args) in a worker.
+
+        Returns:
+            Deferred: fires with fn's result (or its exception)
+        """
+        self.parsed += 1
+        if self.executor is None:
+            return defer.maybeDeferred(fn, *args)
+        self.peak_waiting = max(self.peak_waiting, len(self.semaphore.waiting))
+        return self.semaphore.run(self._run, fn, *args)
+
+    def _run(self, fn, *args):
+        # imported here: importing the reactor at module level would install
+        # the default one before Scrapy installs the asyncio reactor
+        from twisted.internet import reactor
+
+        d = defer.Deferred()
+        executor = self.executor
+        future = executor.submit(fn, *args)
+        future.add_done_callback(
+            lambda f: reactor.callFromThread(self._done, d, f, executor, fn, args)
+        )
+        return d
+
+    def _done(self, d, future, executor, fn, args):
+        try:
+            result = future.result()
+        except BrokenProcessPool:
+            # a worker died (e.g. killed for memory); start a new pool and
+            # parse this page here instead of losing it
+            if self.executor is executor:
+                print("⚠️ Parser process pool broke, restarting it")
+                self.restarts += 1
+                executor.shutdown(wait=False, cancel_futures=True)
+                self.executor = self._new_executor()
+            defer.maybeDeferred(fn, *args).chainDeferred(d)
+            return
+        except Exception as e:
+            d.errback(e)
+            return
+        d.callback(result)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
@@ -0,0 +1,160 @@
+"""
+Benchmark the page parsers in functions.py on synthetic Reddit-shaped HTML
+(see synthetic_html.py) and compare against a saved baseline.
+
+For each parser backend and case it reports pages/sec, the cost per comment
+and the peak Python heap (tracemalloc; lxml's own C allocations are not
+counted). Comment cases grow in breadth and depth to show how parsing scales
+with thread size.
+
+Run using: python ./scrapers/reddit/parser_benchmark.py
+    --save_baseline   store the results as the new baseline
+    --tolerance 0.25  exit with status 1 if a case got >25% slower than the baseline
+"""
+
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import synthetic_html
+from functions import get_posts, lxml_parsers, parse_comments_structure, parse_post_details
+
+BASELINE_PATH = Path(__file__).parent / "parser_benchmark_baseline.json"
+
+# name: (parser, page builder returning (html, comments))
+CASES = {
+    "search_25": (get_posts, lambda: (synthetic_html.search_page(25), 0)),
+    "search_100": (get_posts, lambda: (synthetic_html.search_page(100), 0)),
+    "post_details": (
+        parse_post_details,
+        lambda: synthetic_html.post_page(roots=20, breadth=2, depth=3),
+    ),
+    "comments_20x2^3": (
+        parse_comments_structure,
+        lambda: synthetic_html.comments_page(roots=20, breadth=2, depth=3),
+    ),
+    "comments_50x3^3": (
+        parse_comments_structure,
+        lambda: synthetic_html.comments_page(roots=50, breadth=3, depth=3),
+    ),
+    "comments_10x2^7": (
+        parse_comments_structure,
+        lambda: synthetic_html.comments_page(roots=10, breadth=2, depth=7),
+    ),
+    "comments_200x1^1": (
+        parse_comments_structure,
+        lambda: synthetic_html.comments_page(roots=200, breadth=1, depth=1),
+    ),
+}
+
+
+def run_case(parser, html, backend, min_time):
+    """
+    Returns:
+        tuple: (pages per second, peak Python heap in bytes)
+    """
+    parser(html, backend=backend)  # warm up
+    runs = 0
+    start = time.perf_counter()
+    while True:
+        parser(html, backend=backend)
+        runs += 1
+        elapsed = time.perf_counter() - start
+        if runs >= 3 and elapsed >= min_time:
+            break
+
+    tracemalloc.start()
+    parser(html, backend=backend)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return runs / elapsed, peak
+
+
+def compare(results, baseline, tolerance):
+    """
+    Returns:
+        list: (key, baseline pages/sec, current pages/sec) for slower cases
+    """
+    regressions = []
+    for key, result in results.items():
+        base = baseline.get("results", {}).get(key)
+        if base and result["pages_per_sec"] < base["pages_per_sec"] * (1 - tolerance):
+            regressions.append((key, base["pages_per_sec"], result["pages_per_sec"]))
+    return regressions
+
+
+def main():
+    # fmt:off
+    p = argparse.ArgumentParser(description="Benchmark the reddit page parsers.")
+    p.add_argument("--backends", default="lxml,bs4", help="Parser backends, comma separated")
+    p.add_argument("--cases", help="Cases to run, comma separated (default: all)")
+    p.add_argument("--min_time", type=float, default=1.0, help="Seconds to time each case for")
+    p.add_argument("--baseline", default=str(BASELINE_PATH), help="Baseline results file")
+    p.add_argument("--save_baseline", action="store_true", help="Save these results as the baseline")
+    p.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown against the baseline")
+    args = p.parse_args()
+    # fmt:on
+
+    backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+    if "lxml" in backends and lxml_parsers is None:
+        print("lxml is not installed; skipping the lxml backend")
+        backends.remove("lxml")
+    names = args.cases.split(",") if args.cases else list(CASES)
+
+    results = {}
+    print(f"{'case':<28}{'pages/s':>10}{'µs/comment':>12}{'peak KiB':>10}")
+    for name in names:
+        parser, build = CASES[name]
+        html, comments = build()
+        for backend in backends:
+            pages_per_sec, peak = run_case(parser, html, backend, args.min_time)
+            key = f"{backend}/{name}"
+            results[key] = {
+                "pages_per_sec": round(pages_per_sec, 2),
+                "us_per_comment": (
+                    round(1e6 / pages_per_sec / comments, 2) if comments else None
+                ),
+                "peak_bytes": peak,
+                "html_bytes": len(html),
+                "comments": comments,
+            }
+            per_comment = results[key]["us_per_comment"]
+            print(
+                f"{key:<28}{pages_per_sec:>10.1f}"
+                f"{per_comment if per_comment is not None else '-':>12}"
+                f"{peak / 1024:>10.0f}"
+            )
+
+    baseline_path = Path(args.baseline)
+    if args.save_baseline:
+        baseline = {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "saved_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "results": results,
+        }
+        baseline_path.write_text(json.dumps(baseline, indent=2) + "\n", encoding="utf-8")
+        print(f"Saved baseline to {baseline_path}")
+        return
+
+    if not baseline_path.exists():
+        print(f"No baseline at {baseline_path}; run with --save_baseline to create one")
+        return
+    baseline = json.loads(baseline_path.read_text(encoding="utf-8"))
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        for key, before, after in regressions:
+            print(f"❌ {key}: {before:.1f} -> {after:.1f} pages/s")
+        sys.exit(1)
+    print(
+        f"✅ No case more than {args.tolerance:.0%} slower than the baseline "
+        f"(saved {baseline.get('saved_at')}, Python {baseline.get('python')})"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Check that the lxml and BeautifulSoup parser backends produce identical output
+on recorded pages (from the spider's --http_cache directory and/or a directory
+of saved .html files). Exits with status 1 if any page differs.
+
+Run using: python ./scrapers/reddit/parser_parity.py --cache_dir ./tmp/http_cache --html_dir ./tmp/pages
+"""
+
+import argparse
+import sys
+from collections import Counter
+from pathlib import Path
+
+from functions import (
+    get_posts,
+    lxml_parsers,
+    parse_comments_structure,
+    parse_post_details,
+    parse_post_page_with_comments,
+)
+from http_cache import iter_cached_pages
+from middlewares import get_endpoint
+
+# parsers run on each kind of page
+PARSERS = {
+    "search": [get_posts],
+    "post": [parse_post_details, parse_post_page_with_comments],
+    "comments": [parse_comments_structure],
+}
+
+
+def guess_endpoint(html):
+    """Kind of page for saved html files that have no url."""
+    if "search-telemetry-tracker" in html:
+        return "search"
+    if "<shreddit-post" in html:
+        return "post"
+    if "shreddit-comment" in html:
+        return "comments"
+    return None
+
+
+def iter_pages(cache_dir=None, html_dir=None):
+    if cache_dir:
+        for url, html in iter_cached_pages(cache_dir):
+            yield url, get_endpoint(url), html
+    if html_dir:
+        for path in sorted(Path(html_dir).rglob("*.html")):
+            html = path.read_text(encoding="utf-8", errors="replace")
+            yield str(path), guess_endpoint(html), html
+
+
+def check_page(endpoint, html):
+    """Returns the names of the parsers whose backends disagree on this page."""
+    mismatches = []
+    for parser in PARSERS.get(endpoint, []):
+        if parser(html, backend="bs4") != parser(html, backend="lxml"):
+            mismatches.append(parser.__name__)
+    return mismatches
+
+
+def main():
+    # fmt:off
+    p = argparse.ArgumentParser(description="Compare the lxml and BeautifulSoup parser backends.")
+    p.add_argument("--cache_dir", help="HTTP cache recorded with --http_cache record")
+    p.add_argument("--html_dir", help="Directory of saved .html pages")
+    args = p.parse_args()
+    # fmt:on
+
+    if lxml_parsers is None:
+        sys.exit("lxml is not installed; nothing to compare")
+    if not args.cache_dir and not args.html_dir:
+        p.error("pass --cache_dir and/or --html_dir")
+
+    checked = Counter()
+    failed = Counter()
+    for name, endpoint, html in iter_pages(args.cache_dir, args.html_dir):
+        if endpoint not in PARSERS:
+            continue
+        checked[endpoint] += 1
+        for parser_name in check_page(endpoint, html):
+            failed[parser_name] += 1
+            print(f"❌ {parser_name} differs on {name}")
+
+    print(f"Checked pages: {dict(checked)}")
+    if failed:
+        print(f"Mismatches: {dict(failed)}")
+        sys.exit(1)
+    print("✅ Both backends produce identical output")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,34 +3,47 @@ Post process the scraped data. Use gemini api to keep only relevant posts.
 Then use gemini api to generate a summary of the post. (sentiment, misinformation, topic_summary)
 
 Run using: python ./scrapers/reddit/post_process.py --input_file output/reddit/output.csv --output_file output/reddit/output_filtered.csv --keywords "keyword1,keyword2,keyword3"
+
+--input_file and --output_file can also be Parquet dataset directories (see
+columnar.py), e.g. --input_file output/reddit/output_parquet --output_file output/reddit/output_processed_parquet
 """
 
 import argparse
-import ast
-import json
+import asyncio
 import os
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import pandas as pd
+from checkpoint_log import CheckpointLog, checkpoint_path_for
+from columnar import (
+    COMMENT_COLUMNS,
+    SUMMARY_COLUMNS,
+    is_dataset,
+    parse_cell,
+    posts_schema,
+    read_comments,
+    read_posts,
+    split_posts,
+    top_comments,
+    write_dataset,
+)
 from dotenv import load_dotenv
-from functions import generate_comment_summary, generate_post_summary, is_post_relevant
+from functions import (
+    are_posts_relevant_async,
+    generate_row_summaries_async,
+    generate_separate_summaries_async,
+    post_content_hash,
+    relevance_batches,
+    set_gemini_scheduler,
+    set_llm_cache,
+    set_prompt_budget,
+)
+from gemini_scheduler import DEFAULT_RPM, DEFAULT_TPM, GeminiScheduler
 from google import genai
 from google.genai import types
-
-
-def check_relevance_concurrent(row_data, keywords_list):
-    """Check relevance for a single row using ThreadPoolExecutor"""
-    idx = row_data["index"]
-    row = row_data["row"]
-
-    try:
-        # Call the underlying is_post_relevant function directly
-        is_relevant = is_post_relevant(row["post_title"], keywords_list)
-        return {"index": idx, "is_relevant": is_relevant}
-    except Exception as e:
-        print(f"Error checking relevance for row {idx}: {e}")
-        return {"index": idx, "is_relevant": False}
+from keyword_filter import KeywordPrefilter
+from llm_cache import DEFAULT_MAX_AGE, DEFAULT_MAX_BYTES, LLMCache
+from prompt_budget import DEFAULT_COMMENT_TOKENS, DEFAULT_POST_BODY_TOKENS, PromptBudget
 
 
 load_dotenv()
@@ -40,9 +53,26 @@ client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
 
 # fmt:off
 parser = argparse.ArgumentParser(description="Post process the scraped data.")
-parser.add_argument("--input_file", type=str, required=True, help="The input file to process.")
-parser.add_argument("--output_file", type=str, required=True, help="The output file to save the filtered data.")
+parser.add_argument("--input_file", type=str, required=True, help="The input CSV or Parquet dataset directory to process.")
+parser.add_argument("--output_file", type=str, required=True, help="The output file to save the filtered data (.csv, otherwise a Parquet dataset directory).")
 parser.add_argument("--keywords", type=str, required=True, help="The keywords to filter the data by.")
+parser.add_argument("--relevance_concurrency", type=int, default=10, help="Relevance batches checked at once.")
+parser.add_argument("--summary_concurrency", type=int, default=10, help="Posts summarised at once.")
+parser.add_argument("--resume", action="store_true", help="Skip the posts already done in the checkpoint log.")
+parser.add_argument("--incremental", action="store_true", help="Only process posts that are new or changed since the existing --output_file, and merge them into it.")
+parser.add_argument("--checkpoint", type=str, help="Checkpoint log (default: <output_file>.checkpoint.jsonl).")
+parser.add_argument("--rpm", type=int, default=DEFAULT_RPM, help="Gemini requests per minute quota.")
+parser.add_argument("--tpm", type=int, default=DEFAULT_TPM, help="Gemini tokens per minute quota.")
+parser.add_argument("--separate_summaries", action="store_true", help="One Gemini call per post and per comment instead of one call per post.")
+parser.add_argument("--no_prefilter", action="store_true", help="Send every post to Gemini, without the local keyword pre-filter.")
+parser.add_argument("--llm_cache", type=str, default="./tmp/llm_cache.sqlite", help="Cache of Gemini responses reused across runs.")
+parser.add_argument("--no_llm_cache", action="store_true", help="Always call Gemini, without reading or writing the cache.")
+parser.add_argument("--llm_cache_max_mb", type=int, default=DEFAULT_MAX_BYTES // 1024**2, help="Size of cached responses before least recently used ones are evicted.")
+parser.add_argument("--llm_cache_max_days", type=float, default=DEFAULT_MAX_AGE / 86400, help="Age after which cached responses expire (0: never).")
+parser.add_argument("--post_body_tokens", type=int, default=DEFAULT_POST_BODY_TOKENS, help="Estimated tokens of a post body in a summary prompt; longer bodies are cut to their key sentences (0: no limit).")
+parser.add_argument("--comment_tokens", type=int, default=DEFAULT_COMMENT_TOKENS, help="Estimated tokens of each comment in a summary prompt (0: no limit).")
+parser.add_argument("--min_comment_score", type=int, help="Do not summarise comments with fewer upvotes.")
+parser.add_argument("--min_comment_chars", type=int, default=0, help="Do not summarise comments shorter than this.")
 args = parser.parse_args()
 # fmt:on
 
@@ -51,149 +81,314 @@ args = parser.parse_args()
 if not os.path.exists(args.input_file):
     raise FileNotFoundError(f"Input file {args.input_file} does not exist.")
 
+gemini_scheduler = GeminiScheduler(rpm=args.rpm, tpm=args.tpm)
+set_gemini_scheduler(gemini_scheduler)
+
+llm_cache = None
+if not args.no_llm_cache:
+    llm_cache = LLMCache(
+        args.llm_cache,
+        max_bytes=args.llm_cache_max_mb * 1024**2,
+        max_age=args.llm_cache_max_days * 86400,
+    )
+    set_llm_cache(llm_cache)
+    print(f"Using LLM response cache {args.llm_cache}")
+
+prompt_budget = PromptBudget(
+    post_body_tokens=args.post_body_tokens,
+    comment_tokens=args.comment_tokens,
+    min_comment_score=args.min_comment_score,
+    min_comment_chars=args.min_comment_chars,
+)
+set_prompt_budget(prompt_budget)
+
 
 # Filter out posts that are not relevant to the keywords
-df = pd.read_csv(args.input_file)
+input_is_dataset = is_dataset(args.input_file)
+if input_is_dataset:
+    # posts only; the top comments are read from the comments table below
+    df = read_posts(args.input_file)
+else:
+    df = pd.read_csv(args.input_file)
 print(f"Loaded {len(df)} posts from {args.input_file}")
 keywords_list = [kw.strip() for kw in args.keywords.split(",") if kw.strip()]
 
 rows_list = df.to_dict("records")
-rows_data = [{"index": idx, "row": row} for idx, row in enumerate(rows_list)]
-print(f"Starting relevance checking for {len(df)} posts...")
-start_time = time.time()
+titles = [str(row["post_title"]) for row in rows_list]
+if input_is_dataset:
+    # comment_1..comment_5 as dicts, with no repr strings to parse
+    comments_by_post = top_comments(args.input_file)
+    for row in rows_list:
+        post_comments = comments_by_post.get(row["post_id"], {})
+        for column in COMMENT_COLUMNS:
+            row[column] = post_comments.get(column)
 
-# Use ThreadPoolExecutor for concurrent relevance checking
-max_workers_relevance = 10  # Can use more workers for relevance checking
-with ThreadPoolExecutor(max_workers=max_workers_relevance) as executor:
-    # Submit all tasks
-    future_to_idx = {
-        executor.submit(check_relevance_concurrent, row_data, keywords_list): row_data[
-            "index"
-        ]
-        for row_data in rows_data
-    }
-    completed_count = 0
-    relevance_results = {}
-
-    for future in as_completed(future_to_idx):
-        try:
-            result = future.result()
-            relevance_results[result["index"]] = result["is_relevant"]
-            completed_count += 1
-            if completed_count % 50 == 0:
-                elapsed_time = time.time() - start_time
-                print(
-                    f"Checked relevance for {completed_count} posts... (Elapsed: {elapsed_time:.2f}s)"
-                )
-        except Exception as e:
-            print(f"Error processing relevance future: {e}")
+start_time = time.time()
+relevance_results = {}
+summary_results = {}
+
+# Every relevance decision and summary is appended to the checkpoint log as
+# soon as it is known, with the content hash of the post; --resume and
+# --incremental reuse the entries whose post did not change
+post_urls = [row["post_url"] for row in rows_list]
+content_hashes = [post_content_hash(row) for row in rows_list]
+checkpoint = CheckpointLog(
+    args.checkpoint or checkpoint_path_for(args.output_file),
+    keywords_list,
+    resume=args.resume or args.incremental,
+)
 
-relevant_indices = [
-    idx for idx, is_relevant in relevance_results.items() if is_relevant
+# --incremental: unchanged posts of the previous output keep their summaries
+previous_rows = {}
+if args.incremental and os.path.exists(args.output_file):
+    if is_dataset(args.output_file):
+        previous_df = read_posts(args.output_file)
+    else:
+        # a hex hash may look like a number (e.g. "123e4567...")
+        previous_df = pd.read_csv(args.output_file, dtype={"content_hash": str})
+    previous_rows = {row["post_url"]: row for row in previous_df.to_dict("records")}
+    print(f"Loaded {len(previous_rows)} processed posts from {args.output_file}")
+
+
+def previous_summaries(idx):
+    """Summaries of the post in the previous output, if its content is unchanged."""
+    previous = previous_rows.get(post_urls[idx])
+    if previous is None or previous.get("content_hash") != content_hashes[idx]:
+        return None
+    summaries = {column: parse_cell(previous.get(column)) for column in SUMMARY_COLUMNS}
+    # rows that failed last time hold "Error: ..." instead of a summary list
+    if not all(isinstance(value, list) for value in summaries.values()):
+        return None
+    return summaries
+
+
+undecided = []
+for idx, post_url in enumerate(post_urls):
+    summaries = previous_summaries(idx)
+    if summaries is not None:
+        relevance_results[idx] = True
+        summary_results[idx] = summaries
+        continue
+    relevant = checkpoint.relevance_for(post_url, content_hashes[idx])
+    if relevant is None:
+        undecided.append(idx)
+        continue
+    relevance_results[idx] = relevant
+    summaries = checkpoint.summaries_for(post_url, content_hashes[idx])
+    if summaries is not None:
+        summary_results[idx] = summaries
+if args.resume or args.incremental:
+    print(
+        f"{len(rows_list) - len(undecided)} posts already decided ({len(summary_results)} "
+        f"summarised), {len(undecided)} new or changed posts to process"
+    )
+
+# Decide the posts whose title has a keyword (or that have no keyword word at
+# all) locally; only the ambiguous ones are checked by Gemini
+if args.no_prefilter:
+    to_check = undecided
+else:
+    prefilter = KeywordPrefilter(keywords_list)
+    to_check = []
+    for idx in undecided:
+        row = rows_list[idx]
+        decision = prefilter.classify(row["post_title"], row.get("post_body"))
+        if decision is None:
+            to_check.append(idx)
+        else:
+            relevance_results[idx] = decision
+            checkpoint.record_relevance(post_urls[idx], content_hashes[idx], decision)
+    saved_calls = len(relevance_batches([titles[idx] for idx in undecided])) - len(
+        relevance_batches([titles[idx] for idx in to_check])
+    )
+    print(
+        f"Pre-filter: {prefilter.accepted} relevant, {prefilter.rejected} not relevant, "
+        f"{prefilter.ambiguous} left for Gemini (saved {len(undecided) - len(to_check)} "
+        f"posts, {saved_calls} Gemini calls)"
+    )
+
+batches = [
+    [to_check[i] for i in batch]
+    for batch in relevance_batches([titles[idx] for idx in to_check])
+]
+# relevant posts still to summarise
+accepted = [
+    idx
+    for idx, is_relevant in relevance_results.items()
+    if is_relevant and idx not in summary_results
 ]
-df = df.iloc[relevant_indices].reset_index(drop=True)
-
-elapsed_time = time.time() - start_time
-print(
-    f"Filtered {len(rows_list)} posts to {len(df)} relevant posts (Time: {elapsed_time:.2f}s)"
-)
 
 
 # Generate a summary of the post. and top 5 comments tree
 # 1. sentiment
 # 2. misinformation
 # 3. topic_summary
+#
+# Relevance batches and summaries run as one asyncio pipeline: a post is
+# summarised as soon as its batch is classified. Each stage has its own number
+# of concurrent requests, and the bounded queues between them hold back the
+# relevance stage when summaries fall behind.
+progress = {"checked": 0, "summarised": 0, "failed": 0}
 
-print(f"Starting summary generation for {len(df)} posts...")
-
-# Initialize the summary columns
-df["post_summary"] = ""
-df["comment_1_summary"] = ""
-df["comment_2_summary"] = ""
-df["comment_3_summary"] = ""
-df["comment_4_summary"] = ""
-df["comment_5_summary"] = ""
-
-# Convert DataFrame to list of dictionaries for easier processing
-rows_list = df.to_dict("records")
-
-
-def process_row_summaries(row_data):
-    """Process summaries for a single row using ThreadPoolExecutor"""
-    idx = row_data["index"]
-    row = row_data["row"]
 
+async def summarise_row(idx):
+    row = rows_list[idx]
     try:
-        post_summary = generate_post_summary(row)
-        comment_1_summary = generate_comment_summary(row, "comment_1")
-        comment_2_summary = generate_comment_summary(row, "comment_2")
-        comment_3_summary = generate_comment_summary(row, "comment_3")
-        comment_4_summary = generate_comment_summary(row, "comment_4")
-        comment_5_summary = generate_comment_summary(row, "comment_5")
-
-        return {
-            "index": idx,
-            "post_summary": post_summary,
-            "comment_1_summary": comment_1_summary,
-            "comment_2_summary": comment_2_summary,
-            "comment_3_summary": comment_3_summary,
-            "comment_4_summary": comment_4_summary,
-            "comment_5_summary": comment_5_summary,
-        }
+        if args.separate_summaries:
+            summaries = await generate_separate_summaries_async(row)
+        else:
+            summaries = await generate_row_summaries_async(row)
     except Exception as e:
+        # not checkpointed, so a resumed run tries the row again
         print(f"Error processing row {idx}: {e}")
-        return {
-            "index": idx,
-            "post_summary": f"Error: {e}",
-            "comment_1_summary": f"Error: {e}",
-            "comment_2_summary": f"Error: {e}",
-            "comment_3_summary": f"Error: {e}",
-            "comment_4_summary": f"Error: {e}",
-            "comment_5_summary": f"Error: {e}",
-        }
-
-
-# Prepare data for concurrent processing
-rows_data = [{"index": idx, "row": row} for idx, row in enumerate(rows_list)]
-
-# Use ThreadPoolExecutor for concurrent processing
-max_workers = 10  # Limit concurrent requests to avoid rate limiting
-start_time = time.time()
+        progress["failed"] += 1
+        return {column: f"Error: {e}" for column in SUMMARY_COLUMNS}
+    checkpoint.record_summaries(post_urls[idx], content_hashes[idx], summaries)
+    return summaries
 
-with ThreadPoolExecutor(max_workers=max_workers) as executor:
-    # Submit all tasks
-    future_to_idx = {
-        executor.submit(process_row_summaries, row_data): row_data["index"]
-        for row_data in rows_data
-    }
 
-    completed_count = 0
-    for future in as_completed(future_to_idx):
+async def relevance_worker(batch_queue, summary_queue):
+    while (batch := await batch_queue.get()) is not None:
         try:
-            result = future.result()
-            idx = result["index"]
-
-            # Update DataFrame with results
-            df.at[idx, "post_summary"] = result["post_summary"]
-            df.at[idx, "comment_1_summary"] = result["comment_1_summary"]
-            df.at[idx, "comment_2_summary"] = result["comment_2_summary"]
-            df.at[idx, "comment_3_summary"] = result["comment_3_summary"]
-            df.at[idx, "comment_4_summary"] = result["comment_4_summary"]
-            df.at[idx, "comment_5_summary"] = result["comment_5_summary"]
-
-            completed_count += 1
-            if completed_count % 30 == 0:
-                elapsed_time = time.time() - start_time
-                print(
-                    f"Generated summaries for {completed_count} posts... (Elapsed: {elapsed_time:.2f}s)"
+            results = await are_posts_relevant_async(
+                [titles[idx] for idx in batch], keywords_list
+            )
+        except Exception as e:
+            print(f"Error checking relevance for a batch of {len(batch)} posts: {e}")
+            progress["failed"] += len(batch)
+            for idx in batch:
+                relevance_results[idx] = False
+        else:
+            for idx, is_relevant in zip(batch, results):
+                if is_relevant is None:
+                    # undecided: left out of the checkpoint so the next run retries it
+                    progress["failed"] += 1
+                    relevance_results[idx] = False
+                    continue
+                relevance_results[idx] = is_relevant
+                checkpoint.record_relevance(
+                    post_urls[idx], content_hashes[idx], is_relevant
                 )
+        for idx in batch:
+            if relevance_results[idx]:
+                await summary_queue.put(idx)
+        progress["checked"] += len(batch)
+        elapsed_time = time.time() - start_time
+        print(
+            f"Checked relevance for {progress['checked']} posts... (Elapsed: {elapsed_time:.2f}s)"
+        )
+
+
+async def summary_worker(summary_queue):
+    while (idx := await summary_queue.get()) is not None:
+        summary_results[idx] = await summarise_row(idx)
+        progress["summarised"] += 1
+        if progress["summarised"] % 30 == 0:
+            elapsed_time = time.time() - start_time
+            print(
+                f"Generated summaries for {progress['summarised']} posts... (Elapsed: {elapsed_time:.2f}s)"
+            )
+
+
+async def run_pipeline():
+    batch_queue = asyncio.Queue(maxsize=args.relevance_concurrency)
+    summary_queue = asyncio.Queue(maxsize=2 * args.summary_concurrency)
+    relevance_tasks = [
+        asyncio.create_task(relevance_worker(batch_queue, summary_queue))
+        for _ in range(args.relevance_concurrency)
+    ]
+    summary_tasks = [
+        asyncio.create_task(summary_worker(summary_queue))
+        for _ in range(args.summary_concurrency)
+    ]
+
+    async def feed_batches():
+        for batch in batches:
+            await batch_queue.put(batch)
+        for _ in relevance_tasks:
+            await batch_queue.put(None)
+
+    async def feed_accepted():
+        for idx in accepted:
+            await summary_queue.put(idx)
+
+    await asyncio.gather(feed_batches(), feed_accepted(), *relevance_tasks)
+    for _ in summary_tasks:
+        await summary_queue.put(None)
+    await asyncio.gather(*summary_tasks)
 
-        except Exception as e:
-            print(f"Error processing future: {e}")
+
+print(
+    f"Starting relevance checking for {len(to_check)} posts in {len(batches)} batches "
+    f"and summary generation for the relevant ones..."
+)
+try:
+    asyncio.run(run_pipeline())
+finally:
+    checkpoint.close()
+
+relevant_indices = sorted(
+    idx for idx, is_relevant in relevance_results.items() if is_relevant
+)
+df = df.iloc[relevant_indices].reset_index(drop=True)
+for column in SUMMARY_COLUMNS:
+    df[column] = [summary_results[idx][column] for idx in relevant_indices]
+df["content_hash"] = [content_hashes[idx] for idx in relevant_indices]
 
 elapsed_time = time.time() - start_time
+print(f"Filtered {len(rows_list)} posts to {len(df)} relevant posts")
 print(
     f"Completed summary generation for all {len(df)} posts! (Total time: {elapsed_time:.2f}s)"
 )
 
-df.to_csv(args.output_file, index=False)
+# --incremental: keep the processed posts that are no longer in the input
+input_urls = set(post_urls)
+kept_rows = [row for url, row in previous_rows.items() if url not in input_urls]
+if kept_rows:
+    df = pd.concat([df, pd.DataFrame(kept_rows)], ignore_index=True)
+    print(f"Kept {len(kept_rows)} processed posts that are not in the input")
+
+stats = gemini_scheduler.stats()
+print(
+    f"Gemini: {stats['requests']} requests, {stats['throttled']} throttled, "
+    f"{stats['retries']} retries, {stats['waited']:.1f}s total wait for quota"
+)
+if progress["failed"]:
+    print(
+        f"⚠️ {progress['failed']} posts failed after {gemini_scheduler.max_retries} retries; "
+        "run again with --resume to retry only those"
+    )
+stats = prompt_budget.stats()
+print(
+    f"Prompt budget: trimmed {stats['trimmed']} texts, skipped {stats['skipped']} comments, "
+    f"saved ~{stats['saved']} of {stats['tokens_in']} tokens ({stats['saved_rate']:.0%})"
+)
+if llm_cache is not None:
+    stats = llm_cache.stats()
+    print(
+        f"LLM cache: {stats['hits']} hits, {stats['misses']} misses "
+        f"({stats['hit_rate']:.0%} hit rate)"
+    )
+    llm_cache.close()
+
+if args.output_file.endswith(".csv"):
+    df.to_csv(args.output_file, index=False)
+else:
+    # comments of the kept posts, or flattened from the CSV comment columns
+    comments = None
+    if input_is_dataset:
+        comments = read_comments(args.input_file)
+        comments = comments[comments["post_id"].isin(df["post_id"])]
+    if kept_rows and is_dataset(args.output_file):
+        # the kept posts' comments are only in the previous output
+        kept_ids = {row.get("post_id") for row in kept_rows}
+        previous_comments = read_comments(args.output_file)
+        previous_comments = previous_comments[previous_comments["post_id"].isin(kept_ids)]
+        if comments is None:
+            current = df[~df["post_url"].isin([row["post_url"] for row in kept_rows])]
+            comments = split_posts(current, posts_schema(current.columns))[1].to_pandas()
+        comments = pd.concat([comments, previous_comments], ignore_index=True)
+    posts_written, comments_written = write_dataset(df, args.output_file, comments)
+    print(
+        f"Wrote {posts_written} posts and {comments_written} comments to {args.output_file}"
+    )
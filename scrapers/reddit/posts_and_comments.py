@@ -5,28 +5,111 @@ Run using: python ./scrapers/reddit/posts_and_comments_spider.py --username abcd
 """
 
 import argparse
+import heapq
+import itertools
 import json
 import os
 import sys
+from collections import Counter
 from datetime import date, datetime
 from pathlib import Path
 from urllib.parse import urlparse
 
-import pandas as pd
 import scrapy
 from bs4 import BeautifulSoup
+from columnar import csv_to_dataset, dataset_dir_for
 from functions import (
     ensure_session,
-    get_cursor_token,
-    get_posts,
-    is_post_relevant,
-    parse_comments_structure,
-    parse_post_details,
+    merge_comment_fragment,
     retry_login_and_reload,
 )
+from parse_pool import (
+    ParsePool,
+    parse_comments,
+    parse_fragment,
+    parse_post,
+    parse_search,
+)
 from scrapy import signals
 from scrapy.crawler import CrawlerProcess
 from scrapy.exceptions import DontCloseSpider
+from scrapy.utils.defer import maybe_deferred_to_future
+from storage import OUTPUT_FIELDS, CrawlState, PostStore, to_int
+
+
+class SearchStopPolicy:
+    """
+    Decides when a search should stop scrolling and reports why.
+
+    A search stops when reddit returns no cursor for the next page, when
+    `patience` consecutive pages have a share of new posts below
+    `min_new_ratio`, when it has used up its request budget (search pages
+    plus the post/comment requests they spawned) or at the scroll limit.
+    """
+
+    NO_CURSOR = "no_cursor"
+    LOW_YIELD = "low_yield"
+    BUDGET = "request_budget"
+    SCROLL_LIMIT = "scroll_limit"
+
+    def __init__(self, scroll_limit, min_new_ratio=0.1, patience=3, request_budget=400):
+        self.scroll_limit = scroll_limit
+        self.min_new_ratio = min_new_ratio
+        self.patience = patience
+        self.request_budget = request_budget
+
+    def is_low_yield(self, posts_found, new_posts):
+        if not posts_found:
+            return True
+        return new_posts / posts_found < self.min_new_ratio
+
+    def stop_reason(self, cursor_token, scroll_count, low_yield_pages, requests_used):
+        """Returns the reason to stop, or None to fetch the next page."""
+        if not cursor_token:
+            return self.NO_CURSOR
+        if low_yield_pages >= self.patience:
+            return self.LOW_YIELD
+        if requests_used >= self.request_budget:
+            return self.BUDGET
+        if scroll_count >= self.scroll_limit:
+            return self.SCROLL_LIMIT
+        return None
+
+
+class RefreshPolicy:
+    """
+    Decides whether an already scraped post should be fetched again, by
+    comparing the upvotes/comments on its search card with the stored values.
+    A post is refreshed when either count moved by at least `min_change`
+    (relative) and `min_delta` (absolute), or when it is older than
+    `max_age_days`.
+    """
+
+    def __init__(self, min_change=0.1, min_delta=5, max_age_days=7):
+        self.min_change = min_change
+        self.min_delta = min_delta
+        self.max_age_days = max_age_days
+
+    def _changed(self, stored, seen):
+        if stored is None or seen is None:
+            return False
+        delta = abs(seen - stored)
+        return delta >= self.min_delta and delta >= self.min_change * max(stored, 1)
+
+    def refresh_reason(self, stored, post):
+        """Returns "engagement", "stale" or None."""
+        for field in ("post_upvotes", "total_comments"):
+            if self._changed(stored.get(field), to_int(post.get(field))):
+                return "engagement"
+        if self.max_age_days and stored.get("scraped_at"):
+            try:
+                scraped_at = datetime.fromisoformat(stored["scraped_at"])
+            except ValueError:
+                return None
+            age = datetime.now(scraped_at.tzinfo) - scraped_at
+            if age.total_seconds() > self.max_age_days * 86400:
+                return "stale"
+        return None
 
 
 class StandardSpider(scrapy.Spider):
@@ -36,10 +119,36 @@ class StandardSpider(scrapy.Spider):
     custom_settings = {
         "LOG_LEVEL": "ERROR",
         "ROBOTSTXT_OBEY": False,
-        "CLOSESPIDER_ERRORCOUNT": 1,
+        # throttled requests are retried by AdaptiveRateMiddleware, so only
+        # close on repeated callback errors
+        "CLOSESPIDER_ERRORCOUNT": 20,
         # — concurrency —
-        "CONCURRENT_REQUESTS": 20,
-        "CONCURRENT_REQUESTS_PER_DOMAIN": 20,
+        # upper bound only; the per-endpoint limits are set by AdaptiveRateMiddleware
+        "CONCURRENT_REQUESTS": 48,
+        "CONCURRENT_REQUESTS_PER_DOMAIN": 48,
+        # responses waiting for the parser pool count against this; past it
+        # Scrapy stops downloading until the parsers catch up
+        "SCRAPER_SLOT_MAX_ACTIVE_SIZE": 20_000_000,
+        # — adaptive rate control (AIMD per endpoint) —
+        "DOWNLOADER_MIDDLEWARES": {
+            "middlewares.AdaptiveRateMiddleware": 560,
+            # ahead of rate control so cache hits are not throttled; only
+            # active when HTTPCACHE_ENABLED is set (--http_cache)
+            "scrapy.downloadermiddlewares.httpcache.HttpCacheMiddleware": 555,
+        },
+        "RATECONTROL_ENDPOINTS": {
+            "search": {"rate": 1.0, "concurrency": 2, "max_concurrency": 8},
+            "post": {"rate": 2.0, "concurrency": 4, "max_concurrency": 20},
+            "comments": {"rate": 2.0, "concurrency": 4, "max_concurrency": 20},
+        },
+        "RATECONTROL_TARGET_LATENCY": 3.0,
+        # keeps a saturated endpoint's backlog in the scheduler
+        "SCHEDULER_PRIORITY_QUEUE": "middlewares.EndpointPriorityQueue",
+        "RATECONTROL_MAX_RETRIES": 8,
+        # 429/5xx are retried with backoff by AdaptiveRateMiddleware
+        "RETRY_HTTP_CODES": [408],
+        # keep output.csv columns stable across resumed runs
+        "FEED_EXPORT_FIELDS": OUTPUT_FIELDS,
         # # — fixed delay (with random jitter) —
         # "DOWNLOAD_DELAY": 1.0,  # at least 1 s between requests to the same host
         # "RANDOMIZE_DOWNLOAD_DELAY": True,  # scramble that 1 s to something between 0.5–1.5 s
@@ -53,6 +162,18 @@ class StandardSpider(scrapy.Spider):
     }
 
     SCROLL_LIMIT = 40
+    # stop a search once this many consecutive pages have < 10% new posts
+    MIN_NEW_RATIO = 0.1
+    LOW_YIELD_PATIENCE = 3
+    # max requests per search: search pages + requests for the posts found
+    SEARCH_REQUEST_BUDGET = 400
+    # comments kept per post (comment_1..comment_5)
+    TOP_COMMENTS = 5
+    # limits for following "more replies" partials within the kept comments
+    EXPAND_MAX_DEPTH = 4
+    EXPAND_MAX_COMMENTS = 200
+    # worker processes parsing pages off the reactor thread (0: parse inline)
+    PARSE_WORKERS = 2
     SEARCH_FILTERS = [
         "&type=posts&sort=relevance&t=year",
         "&type=posts&sort=hot",
@@ -71,40 +192,101 @@ class StandardSpider(scrapy.Spider):
         self.outdir = Path(kwargs.get("outdir"))
         self.outdir.mkdir(parents=True, exist_ok=True)
         self.output_csv_path = self.outdir / "output.csv"
+        # shards of one crawl share a single state db (see crawl_sharded.py)
+        self.state_db_path = Path(
+            kwargs.get("state_db") or self.outdir / "crawl_state.sqlite"
+        )
+        self.shard_index = int(kwargs.get("shard_index") or 0)
+        self.shard_count = int(kwargs.get("shard_count") or 1)
 
         storage_state = kwargs.get("storage_state")
         os.makedirs(Path(storage_state), exist_ok=True)
         self.session_file = Path(storage_state) / f"{self.username}.json"
         self._login_retried = False
-
-        # Load existing posts if CSV file exists
-        self.all_posts = []
-        if self.output_csv_path.exists():
+        # "record" or "replay" when the on-disk HTTP cache is enabled
+        self.http_cache = kwargs.get("http_cache")
+
+        # Only posts that are still being scraped are kept in memory; finished
+        # posts are streamed to output.csv and recorded in the crawl state db
+        self.all_posts = PostStore()
+        self.crawl_state = CrawlState(self.state_db_path)
+        if self.crawl_state.csv_imported(self.output_csv_path):
+            pass
+        elif self.output_csv_path.exists():
+            # retried on the next run if it fails: the csv is not marked imported
             try:
-                print(f"Loading existing posts from {self.output_csv_path}")
-                df = pd.read_csv(self.output_csv_path)
-                # Convert DataFrame to list of dictionaries
-                self.all_posts = df.to_dict("records")
-                print(f"Loaded {len(self.all_posts)} existing posts")
+                print(f"Indexing existing posts from {self.output_csv_path}")
+                imported = self.crawl_state.import_csv(self.output_csv_path)
+                print(f"Indexed {imported} existing posts")
             except Exception as e:
-                print(f"Error loading existing posts: {e}")
-                self.all_posts = []
+                print(f"Error indexing existing posts: {e}")
         else:
             print(
                 f"No existing posts file found at {self.output_csv_path}, starting fresh"
             )
+            self.crawl_state.mark_csv_imported(self.output_csv_path)
+        self.collected_count = self.crawl_state.count()
+        print(f"Resuming with {self.collected_count} already scraped posts")
+        # rows left over from a refresh that did not finish cleanly
+        dropped = self.crawl_state.compact_refreshed(self.output_csv_path)
+        if dropped:
+            print(f"Replaced {dropped} outdated rows in {self.output_csv_path}")
+
+        # Re-scrape known posts whose engagement changed (see RefreshPolicy)
+        self.refresh = bool(kwargs.get("refresh"))
+        min_change = kwargs.get("refresh_min_change")
+        max_age_days = kwargs.get("refresh_max_age_days")
+        self.refresh_policy = RefreshPolicy(
+            min_change=0.1 if min_change is None else float(min_change),
+            max_age_days=7 if max_age_days is None else float(max_age_days),
+        )
+        self.refresh_reasons = Counter()
+        self.refreshing = set()
+
+        # start this shard's searches from the first page again (see
+        # login_success_check: other shards keep their checkpoints)
+        self.restart_searches = bool(kwargs.get("restart_searches") or self.refresh)
 
         keywords_str = kwargs.get("keywords")
         self.keywords = (
             [kw.strip() for kw in keywords_str.split(",")] if keywords_str else []
         )
 
+        # Read the post body and comments from the post page in one request,
+        # fetching the comments partial only when the page has no usable tree
+        self.single_request_posts = not kwargs.get("two_request_posts")
+        self.requests_per_post = 1 if self.single_request_posts else 2
+        self.fallback_comment_requests = 0
+
+        # Follow "more replies" partials, best scored comments first, up to
+        # this many extra requests per post (0 disables expansion)
+        self.expand_max_requests = int(kwargs.get("expand_requests") or 0)
+        self.expansions = {}
+        self.expansion_requests = 0
+        self._expansion_order = itertools.count()
+
+        # Parse pages in worker processes while the reactor keeps downloading
+        parse_workers = kwargs.get("parse_workers")
+        parse_max_pending = kwargs.get("parse_max_pending")
+        self.parse_pool = ParsePool(
+            workers=self.PARSE_WORKERS if parse_workers is None else int(parse_workers),
+            max_pending=int(parse_max_pending) if parse_max_pending else None,
+        )
+
         # Track search completion
+        self.search_urls = []
         self.total_searches = 0
         self.completed_searches = 0
+        self.stop_policy = SearchStopPolicy(
+            self.SCROLL_LIMIT,
+            min_new_ratio=self.MIN_NEW_RATIO,
+            patience=self.LOW_YIELD_PATIENCE,
+            request_budget=self.SEARCH_REQUEST_BUDGET,
+        )
+        self.stop_reasons = Counter()
 
         # Track progress for printing
-        self.last_printed_count = len(self.all_posts)  # Start from current count
+        self.last_printed_count = self.collected_count  # Start from current count
 
     @classmethod
     def from_crawler(cls, crawler, *args, **kwargs):
@@ -115,10 +297,47 @@ class StandardSpider(scrapy.Spider):
             "FEEDS",{str(spider.output_csv_path): {"format": "csv","overwrite": False}},priority="spider")
         # "FEEDS",{str(spider.output_csv_path): {"format": "csv","overwrite": True}},priority="spider")
         # fmt:on
+        crawler.signals.connect(spider.item_scraped, signal=signals.item_scraped)
+        crawler.signals.connect(spider.spider_closed, signal=signals.spider_closed)
         return spider
 
+    def item_scraped(self, item, response, spider):
+        # the post has been handed to the feed exporter; remember it on disk
+        refreshed = item["post_url"] in self.refreshing
+        self.refreshing.discard(item["post_url"])
+        self.crawl_state.mark_scraped(
+            item, refreshed=refreshed, csv_path=self.output_csv_path
+        )
+
+    def spider_closed(self, spider, reason):
+        if reason == "finished" and self.search_urls:
+            if self.completed_searches >= self.total_searches:
+                # every search ran to its end: the next crawl starts them over
+                self.crawl_state.reset_checkpoints(self.search_urls)
+        if self.stop_reasons:
+            print(f"Search stop reasons: {dict(self.stop_reasons)}")
+        if self.refresh:
+            print(f"Refreshed posts: {dict(self.refresh_reasons)}")
+        if self.expand_max_requests:
+            print(f"Comment expansion requests: {self.expansion_requests}")
+        if self.single_request_posts:
+            print(
+                f"Posts that needed the comments partial: {self.fallback_comment_requests}"
+            )
+        if self.parse_pool.workers:
+            print(
+                f"Parsed {self.parse_pool.parsed} pages in {self.parse_pool.workers} worker processes "
+                f"(max {self.parse_pool.max_pending} at once, peak queue {self.parse_pool.peak_waiting})"
+            )
+        self.parse_pool.close()
+        self.crawl_state.close()
+
     def start_requests(self):
-        ensure_session(self)
+        if self.http_cache == "replay" and not self.session_file.exists():
+            # responses come from the cache, no need to log in
+            self.cookies, self.headers = {}, {}
+        else:
+            ensure_session(self)
         yield scrapy.Request(
             self.PROFILE_URL + self.username + "/",
             headers=self.headers,
@@ -152,24 +371,65 @@ class StandardSpider(scrapy.Spider):
                 for filter in self.SEARCH_FILTERS:
                     url = self.SEARCH_URL + keyword + filter
                     search_urls.append(url)
+            # keep this shard's share of the keyword x filter searches
+            search_urls = [
+                url
+                for i, url in enumerate(search_urls)
+                if i % self.shard_count == self.shard_index
+            ]
 
             # Calculate total number of searches to track completion
+            self.search_urls = search_urls
             self.total_searches = len(search_urls)
             print(f"Total searches to complete: {self.total_searches}")
+            if self.restart_searches:
+                self.crawl_state.reset_checkpoints(search_urls)
+                self.restart_searches = False
+
+            # posts of checkpointed pages that an interrupted crawl did not finish
+            pending = self.crawl_state.pending_posts(search_urls)
+            if pending:
+                print(f"Requeuing {len(pending)} posts left over from the last crawl")
+            for post, refresh in pending:
+                if not self.all_posts.add(post):
+                    continue
+                if refresh:
+                    self.refreshing.add(post["post_url"])
+                yield self._post_request(post)
 
             for url in search_urls:
+                # Restart each search from its last checkpoint
+                checkpoint = self.crawl_state.get_checkpoint(url)
+                if checkpoint and checkpoint["done"]:
+                    self.completed_searches += 1
+                    continue
+                cursor_token = checkpoint["cursor"] if checkpoint else None
+                scroll_count = checkpoint["scroll_count"] if checkpoint else 0
+                low_yield_pages = checkpoint["low_yield_pages"] if checkpoint else 0
+                requests_used = checkpoint["requests_used"] if checkpoint else 0
                 yield scrapy.Request(
-                    url,
+                    url + f"&cursor={cursor_token}" if cursor_token else url,
                     headers=self.headers,
                     cookies=self.cookies,
                     callback=self.parse_search_page,
                     meta={
                         "url": url,
-                        "scroll_count": 0,
+                        "cursor_token": cursor_token,
+                        "scroll_count": scroll_count,
+                        "low_yield_pages": low_yield_pages,
+                        "requests_used": requests_used,
                     },
                     dont_filter=True,
                 )
 
+            if self.completed_searches:
+                print(
+                    f"Skipping {self.completed_searches} searches completed in a previous run"
+                )
+
+        elif self.http_cache == "replay":
+            print("❌ Cached profile page is not logged in; nothing to replay.")
+
         else:
             print(f"❌ Login failed with status {response.status}. Re-logging in.")
             retry_login_and_reload(self)
@@ -181,39 +441,65 @@ class StandardSpider(scrapy.Spider):
                 dont_filter=True,
             )
 
-    def parse_search_page(self, response):
+    async def parse_search_page(self, response):
         url = response.meta.get("url")
         scroll_count = response.meta.get("scroll_count")
+        low_yield_pages = response.meta.get("low_yield_pages", 0)
+        requests_used = response.meta.get("requests_used", 0)
 
-        posts = get_posts(response.text)
-        # Filter out posts with duplicate titles
-        existing_urls = set(post["post_url"] for post in self.all_posts)
+        posts, cursor_token = await self._parse(parse_search, response.text)
+        # Filter out posts that were already scraped or are being scraped
+        unscraped_urls = self.crawl_state.filter_unscraped(
+            post["post_url"] for post in posts
+        )
         unique_posts = [
-            post for post in posts if post.get("post_url") not in existing_urls
+            post
+            for post in posts
+            if post["post_url"] in unscraped_urls and self.all_posts.add(post)
         ]
-        self.all_posts.extend(unique_posts)
-        cursor_token = get_cursor_token(response.text)
+        self.collected_count += len(unique_posts)
+        refresh_posts = self._posts_to_refresh(posts, unscraped_urls)
+
+        # Account for this page and the requests its new posts will need
+        fetched = len(unique_posts) + len(refresh_posts)
+        requests_used += 1 + fetched * self.requests_per_post
+        # a refresh compares every known post on the page with its stored
+        # counts, so unchanged posts are yield too and old posts keep being checked
+        checked = len(posts) if self.refresh else fetched
+        if self.stop_policy.is_low_yield(len(posts), checked):
+            low_yield_pages += 1
+        else:
+            low_yield_pages = 0
 
         # Print progress if at least 50 posts have been added since last print
-        current_count = len(self.all_posts)
+        current_count = self.collected_count
         if current_count - self.last_printed_count >= 50:
             print(f"Collected {current_count} posts so far")
             self.last_printed_count = current_count
 
+        # remember the posts until they are written: the checkpoint below
+        # moves past this page while they are still being fetched
+        self.crawl_state.add_pending(
+            url,
+            unique_posts + refresh_posts,
+            refresh_urls=(post["post_url"] for post in refresh_posts),
+        )
         # now fetch the comments for each post
-        for post in unique_posts:
-            yield scrapy.Request(
-                post["post_url"],
-                headers=self.headers,
-                cookies=self.cookies,
-                callback=self.parse_post_page,
-                meta={
-                    "post_url": post["post_url"],
-                },
-                dont_filter=True,
-            )
+        for post in unique_posts + refresh_posts:
+            yield self._post_request(post)
 
-        if scroll_count < self.SCROLL_LIMIT:
+        stop_reason = self.stop_policy.stop_reason(
+            cursor_token, scroll_count, low_yield_pages, requests_used
+        )
+        if stop_reason is None:
+            # checkpoint the next page before requesting it
+            self.crawl_state.save_checkpoint(
+                url,
+                cursor_token,
+                scroll_count + 1,
+                low_yield_pages=low_yield_pages,
+                requests_used=requests_used,
+            )
             yield scrapy.Request(
                 url + f"&cursor={cursor_token}",
                 headers=self.headers,
@@ -223,11 +509,26 @@ class StandardSpider(scrapy.Spider):
                     "url": url,
                     "cursor_token": cursor_token,
                     "scroll_count": scroll_count + 1,
+                    "low_yield_pages": low_yield_pages,
+                    "requests_used": requests_used,
                 },
                 dont_filter=True,
             )
         else:
-            print(f"Total posts found for {url}: {len(self.all_posts)}")
+            self.crawl_state.save_checkpoint(
+                url,
+                cursor_token,
+                scroll_count,
+                done=True,
+                low_yield_pages=low_yield_pages,
+                requests_used=requests_used,
+                stop_reason=stop_reason,
+            )
+            self.stop_reasons[stop_reason] += 1
+            print(
+                f"Stopped search {url} after {scroll_count + 1} pages ({stop_reason})"
+            )
+            print(f"Total posts found for {url}: {self.collected_count}")
             # Mark this search as completed
             self.completed_searches += 1
             print(
@@ -239,21 +540,81 @@ class StandardSpider(scrapy.Spider):
         #     print("All searches completed! Proceeding to next step...")
         #     print(f"Total posts collected across all searches: {len(self.all_posts)}")
 
-    def parse_post_page(self, response):
+    def _posts_to_refresh(self, posts, unscraped_urls):
+        """Already scraped posts on a search page that need re-scraping."""
+        if not self.refresh:
+            return []
+        known = [
+            post
+            for post in posts
+            if post["post_url"] not in unscraped_urls
+            and post["post_url"] not in self.all_posts
+        ]
+        engagement = self.crawl_state.get_engagement(
+            post["post_url"] for post in known
+        )
+        refresh_posts = []
+        for post in known:
+            stored = engagement.get(post["post_url"])
+            if stored is None:
+                continue
+            reason = self.refresh_policy.refresh_reason(stored, post)
+            if reason and self.all_posts.add(post):
+                self.refresh_reasons[reason] += 1
+                self.refreshing.add(post["post_url"])
+                refresh_posts.append(post)
+            elif stored["post_upvotes"] is None or stored["total_comments"] is None:
+                # no baseline yet (indexed before engagement was stored)
+                self.crawl_state.update_engagement(
+                    post["post_url"], post["post_upvotes"], post["total_comments"]
+                )
+        return refresh_posts
+
+    def _post_request(self, post):
+        return scrapy.Request(
+            post["post_url"],
+            headers=self.headers,
+            cookies=self.cookies,
+            callback=self.parse_post_page,
+            errback=self.handle_post_error,
+            meta={
+                "post_url": post["post_url"],
+            },
+            dont_filter=True,
+        )
+
+    def _parse(self, parser, *args):
+        """Run a parse_pool parser off the reactor thread; await the result."""
+        return maybe_deferred_to_future(self.parse_pool.submit(parser, *args))
+
+    async def parse_post_page(self, response):
         post_url = response.meta.get("post_url")
 
         # Extract post data
-        upvote, comment_count, post_body = parse_post_details(response.text)
+        upvote, comment_count, post_body, comments_data, continuations = (
+            await self._parse(
+                parse_post,
+                response.text,
+                self.single_request_posts,
+                self.expand_max_requests > 0,
+            )
+        )
+
+        # Update the matching post in self.all_posts
+        self.all_posts.update(post_url, post_body=post_body)
 
-        # Find the post in self.all_posts with matching href and update its fields
-        for post_data in self.all_posts:
-            if post_data.get("post_url") == post_url:
-                # post_data["upvote"] = upvote
-                # post_data["comment_count"] = comment_count
-                post_data["post_body"] = post_body
-                # post_data["scraped_at"] = datetime.now().isoformat()
+        if comments_data is not None and self._has_enough_comments(
+            comments_data, comment_count
+        ):
+            for item in self.expand_comments(
+                response, post_url, comments_data, continuations
+            ):
+                yield item
+            return
 
         # now fetch the comments for this post
+        if self.single_request_posts:
+            self.fallback_comment_requests += 1
         parsed = urlparse(response.url)
         parts = parsed.path.strip("/").split("/")
         subreddit = parts[1]  # 'subreddit'
@@ -265,30 +626,157 @@ class StandardSpider(scrapy.Spider):
             headers=self.headers,
             cookies=self.cookies,
             callback=self.parse_comments_page,
+            errback=self.handle_post_error,
             meta={
                 "post_url": post_url,
             },
             dont_filter=True,
         )
 
-    def parse_comments_page(self, response):
+    def handle_post_error(self, failure):
+        # drop the in-flight post so failed requests do not pin it in memory
+        post_url = failure.request.meta.get("post_url")
+        print(f"Request failed for {post_url}: {failure.value}")
+        self.all_posts.pop(post_url)
+        self.refreshing.discard(post_url)
+        self.crawl_state.remove_pending(post_url)
+
+    def _has_enough_comments(self, comments_data, comment_count):
+        """Whether the comment tree embedded in the post page can be used as is."""
+        if comment_count == 0:
+            return True
+        roots = comments_data.get("comments") or []
+        if len(roots) >= self.TOP_COMMENTS:
+            return True
+        # fewer roots than we keep: fine only if the page holds every comment
+        loaded = sum(_count_comments(comment) for comment in roots)
+        return bool(roots) and comment_count is not None and loaded >= comment_count
+
+    async def parse_comments_page(self, response):
         post_url = response.meta.get("post_url")
 
         # Parse comments from the HTML response
-        comments_data = parse_comments_structure(response.text)
-
-        # Find the post in self.all_posts and add comments data
-        for post_data in self.all_posts:
-            if post_data.get("post_url") == post_url:
-                # fmt:off
-                post_data["comment_1"] = comments_data['comments'][0] if comments_data.get('comments') and len(comments_data['comments']) > 0 else None
-                post_data["comment_2"] = comments_data['comments'][1] if comments_data.get('comments') and len(comments_data['comments']) > 1 else None
-                post_data["comment_3"] = comments_data['comments'][2] if comments_data.get('comments') and len(comments_data['comments']) > 2 else None
-                post_data["comment_4"] = comments_data['comments'][3] if comments_data.get('comments') and len(comments_data['comments']) > 3 else None
-                post_data["comment_5"] = comments_data['comments'][4] if comments_data.get('comments') and len(comments_data['comments']) > 4 else None
-                post_data["scraped_at"] = datetime.now().isoformat()
-                # fmt:on
-                yield post_data
+        comments_data, continuations = await self._parse(
+            parse_comments, response.text, self.expand_max_requests > 0
+        )
+        for item in self.expand_comments(
+            response, post_url, comments_data, continuations
+        ):
+            yield item
+
+    # ────────────────────────────────────────────────────────────────
+    # Comment expansion
+    # ────────────────────────────────────────────────────────────────
+    def expand_comments(self, response, post_url, comments_data, continuations):
+        """Queue the continuation partials of a comments page, then follow them."""
+        if self.expand_max_requests <= 0:
+            yield from self.complete_post(post_url, comments_data)
+            return
+        state = {
+            "comments_data": comments_data,
+            "queue": [],
+            "requests": 0,
+            "count": sum(_count_comments(c) for c in comments_data.get("comments", [])),
+        }
+        self.expansions[post_url] = state
+        self._queue_continuations(state, response, continuations)
+        yield from self._next_expansion(post_url)
+
+    def _queue_continuations(self, state, response, continuations):
+        for continuation in continuations:
+            continuation["url"] = response.urljoin(continuation["src"])
+            # top-level "more comments" only matter while we have < TOP_COMMENTS
+            score = continuation["parent_score"]
+            priority = float("inf") if score is None else score
+            heapq.heappush(
+                state["queue"],
+                (-priority, next(self._expansion_order), continuation),
+            )
+
+    def _should_expand(self, state, continuation):
+        roots = state["comments_data"].get("comments", [])
+        if continuation["parent_depth"] < 0:
+            return len(roots) < self.TOP_COMMENTS
+        if continuation["parent_depth"] >= self.EXPAND_MAX_DEPTH:
+            return False
+        # only expand threads that end up in comment_1..comment_5
+        kept_ids = set()
+        stack = list(roots[: self.TOP_COMMENTS])
+        while stack:
+            comment = stack.pop()
+            kept_ids.add(comment["comment_id"])
+            stack.extend(comment.get("replies", []))
+        return continuation["parent_id"] in kept_ids
+
+    def _next_expansion(self, post_url):
+        state = self.expansions[post_url]
+        while (
+            state["queue"]
+            and state["requests"] < self.expand_max_requests
+            and state["count"] < self.EXPAND_MAX_COMMENTS
+        ):
+            _, _, continuation = heapq.heappop(state["queue"])
+            if not self._should_expand(state, continuation):
+                continue
+            state["requests"] += 1
+            self.expansion_requests += 1
+            request_cls = (
+                scrapy.FormRequest if continuation["method"] == "POST" else scrapy.Request
+            )
+            kwargs = (
+                {"formdata": continuation["formdata"]}
+                if continuation["method"] == "POST"
+                else {}
+            )
+            yield request_cls(
+                continuation["url"],
+                headers=self.headers,
+                cookies=self.cookies,
+                callback=self.parse_more_comments,
+                errback=self.handle_expansion_error,
+                meta={"post_url": post_url},
+                dont_filter=True,
+                **kwargs,
+            )
+            return
+
+        del self.expansions[post_url]
+        yield from self.complete_post(post_url, state["comments_data"])
+
+    async def parse_more_comments(self, response):
+        post_url = response.meta.get("post_url")
+        fragment = await self._parse(parse_fragment, response.text)
+        state = self.expansions[post_url]
+        state["count"] += merge_comment_fragment(
+            state["comments_data"], fragment["comments"]
+        )
+        self._queue_continuations(state, response, fragment["continuations"])
+        for item in self._next_expansion(post_url):
+            yield item
+
+    def handle_expansion_error(self, failure):
+        # keep what was already loaded and move on to the next continuation
+        post_url = failure.request.meta.get("post_url")
+        print(f"Comment expansion failed for {post_url}: {failure.value}")
+        yield from self._next_expansion(post_url)
+
+    def complete_post(self, post_url, comments_data):
+        # The post is complete once its comments are added; stop tracking it
+        post_data = self.all_posts.pop(post_url)
+        if post_data is not None:
+            # fmt:off
+            post_data["comment_1"] = comments_data['comments'][0] if comments_data.get('comments') and len(comments_data['comments']) > 0 else None
+            post_data["comment_2"] = comments_data['comments'][1] if comments_data.get('comments') and len(comments_data['comments']) > 1 else None
+            post_data["comment_3"] = comments_data['comments'][2] if comments_data.get('comments') and len(comments_data['comments']) > 2 else None
+            post_data["comment_4"] = comments_data['comments'][3] if comments_data.get('comments') and len(comments_data['comments']) > 3 else None
+            post_data["comment_5"] = comments_data['comments'][4] if comments_data.get('comments') and len(comments_data['comments']) > 4 else None
+            post_data["scraped_at"] = datetime.now().isoformat()
+            # fmt:on
+            yield post_data
+
+
+def _count_comments(comment):
+    return 1 + sum(_count_comments(reply) for reply in comment.get("replies", []))
 
 
 # Entry point
@@ -303,9 +791,85 @@ if __name__ == "__main__":
         required=True,
         help="Keywords separated by comma to search in reddit",
     )
+    p.add_argument(
+        "--restart_searches",
+        action="store_true",
+        help="Ignore search checkpoints and paginate every search from the first page",
+    )
+    p.add_argument(
+        "--two_request_posts",
+        action="store_true",
+        help="Always fetch comments from the svc/shreddit/comments partial instead of the post page",
+    )
+    p.add_argument(
+        "--expand_requests",
+        type=int,
+        default=0,
+        help="Extra requests per post to follow 'more replies' in the top comments, best scored first (default: 0, off)",
+    )
+    p.add_argument(
+        "--refresh",
+        action="store_true",
+        help="Re-scrape already scraped posts whose upvotes/comments changed or that are older than --refresh_max_age_days, replacing their rows in output.csv",
+    )
+    p.add_argument(
+        "--refresh_min_change",
+        type=float,
+        default=0.1,
+        help="Relative change in upvotes or comments that triggers a refresh",
+    )
+    p.add_argument(
+        "--refresh_max_age_days",
+        type=float,
+        default=7,
+        help="Refresh posts scraped longer ago than this (0 disables)",
+    )
+    p.add_argument(
+        "--shard_index", type=int, default=0, help="Shard to run (see crawl_sharded.py)"
+    )
+    p.add_argument("--shard_count", type=int, default=1, help="Total number of shards")
+    p.add_argument(
+        "--state_db",
+        help="Crawl state db shared by all shards (default: <outdir>/crawl_state.sqlite)",
+    )
+    p.add_argument(
+        "--http_cache",
+        choices=["record", "replay"],
+        help="record: cache responses on disk and reuse fresh ones; replay: serve every response from the cache with no network",
+    )
+    p.add_argument(
+        "--cache_dir", default="./tmp/http_cache", help="HTTP cache directory"
+    )
+    p.add_argument(
+        "--parquet",
+        action="store_true",
+        help="After the crawl, also write output.csv as a Parquet dataset (posts and comments tables) to <outdir>/output_parquet/",
+    )
+    p.add_argument(
+        "--parse_workers",
+        type=int,
+        default=StandardSpider.PARSE_WORKERS,
+        help="Worker processes that parse pages off the download thread (0: parse inline)",
+    )
+    p.add_argument(
+        "--parse_max_pending",
+        type=int,
+        help="Pages parsed at once; others wait and pause downloads once SCRAPER_SLOT_MAX_ACTIVE_SIZE is reached (default: 2 per worker)",
+    )
     args = p.parse_args()
 
-    proc = CrawlerProcess()
+    settings = {}
+    if args.http_cache:
+        settings = {
+            "HTTPCACHE_ENABLED": True,
+            "HTTPCACHE_STORAGE": "http_cache.RedditCacheStorage",
+            "HTTPCACHE_DIR": str(Path(args.cache_dir).resolve()),
+            "HTTPCACHE_IGNORE_MISSING": args.http_cache == "replay",
+            # never cache throttled or failed responses
+            "HTTPCACHE_IGNORE_HTTP_CODES": [429, 500, 502, 503, 504, 522, 524],
+        }
+
+    proc = CrawlerProcess(settings)
     crawler = proc.create_crawler(StandardSpider)
 
     proc.crawl(
@@ -315,5 +879,31 @@ if __name__ == "__main__":
         storage_state=args.storage_state,
         outdir=args.outdir,
         keywords=args.keywords,
+        restart_searches=args.restart_searches,
+        two_request_posts=args.two_request_posts,
+        http_cache=args.http_cache,
+        expand_requests=args.expand_requests,
+        refresh=args.refresh,
+        refresh_min_change=args.refresh_min_change,
+        refresh_max_age_days=args.refresh_max_age_days,
+        shard_index=args.shard_index,
+        shard_count=args.shard_count,
+        state_db=args.state_db,
+        parse_workers=args.parse_workers,
+        parse_max_pending=args.parse_max_pending,
     )
     proc.start()
+
+    # the feed export is closed now; replace the rows of refreshed posts
+    state = CrawlState(args.state_db or Path(args.outdir) / "crawl_state.sqlite")
+    dropped = state.compact_refreshed(Path(args.outdir) / "output.csv")
+    state.close()
+    if dropped:
+        print(f"Replaced {dropped} outdated rows with refreshed posts")
+
+    output_csv = Path(args.outdir) / "output.csv"
+    if args.parquet and output_csv.exists():
+        posts, comments = csv_to_dataset(output_csv)
+        print(
+            f"Wrote {posts} posts and {comments} comments to {dataset_dir_for(output_csv)}"
+        )
@@ -0,0 +1,167 @@
+"""
+Token budgets for the post and comment text put into Gemini prompts.
+
+A post body or comment longer than its budget is cut down to its key
+sentences: the opening sentence, then the sentences sharing the most words
+with the rest of the text, kept in their original order and joined with " … ".
+A single sentence longer than the budget is truncated at a word boundary.
+Comments under a minimum score or length can be left out of the summaries.
+Tokens are estimated like the quota scheduler does (gemini_scheduler.py).
+"""
+
+import re
+from collections import Counter
+
+from gemini_scheduler import estimate_tokens
+
+# tokens of a post body / of each comment in a prompt (0: no limit)
+DEFAULT_POST_BODY_TOKENS = 1500
+DEFAULT_COMMENT_TOKENS = 400
+
+ELLIPSIS = " … "
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+|\n+")
+_WORD = re.compile(r"\w{3,}")
+
+
+def split_sentences(text):
+    return [sentence.strip() for sentence in _SENTENCE_END.split(text) if sentence.strip()]
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Text cut at the last word boundary that fits in max_tokens."""
+    max_chars = max(0, (max_tokens - 1) * 4)
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars]
+    if " " in cut:
+        cut = cut[: cut.rindex(" ")]
+    return cut.rstrip() + " …"
+
+
+def key_sentences(text, max_tokens):
+    """
+    Shorten text to the sentences that say the most about it.
+
+    Args:
+        text (str): post body or comment
+        max_tokens (int): estimated tokens the result may have
+
+    Returns:
+        str: text itself if it fits, otherwise its key sentences
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    sentences = split_sentences(text)
+    if len(sentences) < 2:
+        return truncate_to_tokens(text, max_tokens)
+
+    # a sentence scores the average frequency of its words in the whole text
+    words = [_WORD.findall(sentence.lower()) for sentence in sentences]
+    frequency = Counter(word for sentence_words in words for word in sentence_words)
+
+    def score(index):
+        return sum(frequency[word] for word in words[index]) / (len(words[index]) or 1)
+
+    ranked = [0] + sorted(range(1, len(sentences)), key=score, reverse=True)
+    chosen = []
+    used = 0
+    for index in ranked:
+        tokens = estimate_tokens(sentences[index] + ELLIPSIS)
+        if used + tokens <= max_tokens:
+            chosen.append(index)
+            used += tokens
+    if not chosen:
+        return truncate_to_tokens(sentences[0], max_tokens)
+
+    chosen.sort()
+    parts = []
+    for position, index in enumerate(chosen):
+        # mark where sentences were left out
+        if position and index != chosen[position - 1] + 1:
+            parts.append("…")
+        parts.append(sentences[index])
+    if chosen[-1] != len(sentences) - 1:
+        parts.append("…")
+    return " ".join(parts)
+
+
+class PromptBudget:
+    """
+    Attributes:
+        tokens_in, tokens_sent (int): estimated tokens of the texts before and
+            after trimming, over the requests sent to Gemini (see record)
+        trimmed (int): texts shortened to fit their budget
+        skipped (int): comments left out for their score or length
+    """
+
+    def __init__(
+        self,
+        post_body_tokens=DEFAULT_POST_BODY_TOKENS,
+        comment_tokens=DEFAULT_COMMENT_TOKENS,
+        min_comment_score=None,
+        min_comment_chars=0,
+    ):
+        self.post_body_tokens = post_body_tokens
+        self.comment_tokens = comment_tokens
+        self.min_comment_score = min_comment_score
+        self.min_comment_chars = min_comment_chars
+        self.tokens_in = 0
+        self.tokens_sent = 0
+        self.trimmed = 0
+        self.skipped = 0
+
+    def _fit(self, text, max_tokens):
+        text = str(text)
+        return key_sentences(text, max_tokens) if max_tokens > 0 else text
+
+    def post_body(self, text):
+        """The post body to put into a prompt."""
+        return self._fit(text, self.post_body_tokens)
+
+    def comment_body(self, text):
+        """A comment to put into a prompt."""
+        return self._fit(text, self.comment_tokens)
+
+    def record(self, texts):
+        """
+        Count the texts of a request sent to Gemini; prompts answered from the
+        LLM cache are not recorded, so they do not count as tokens saved.
+
+        Args:
+            texts (list): (original text, text put into the prompt) pairs
+        """
+        for text, fitted in texts:
+            self.tokens_in += estimate_tokens(str(text))
+            self.tokens_sent += estimate_tokens(fitted)
+            self.trimmed += fitted != str(text)
+
+    def keep_comment(self, comment):
+        """
+        Args:
+            comment (dict): comment data with "upvote" and "comment_body"
+
+        Returns:
+            bool: False if the comment is below the score or length limits
+        """
+        score = comment.get("upvote")
+        too_low = (
+            self.min_comment_score is not None
+            and isinstance(score, (int, float))
+            and score < self.min_comment_score
+        )
+        too_short = len(str(comment.get("comment_body", "")).strip()) < self.min_comment_chars
+        if too_low or too_short:
+            self.skipped += 1
+            return False
+        return True
+
+    def stats(self):
+        saved = self.tokens_in - self.tokens_sent
+        return {
+            "tokens_in": self.tokens_in,
+            "tokens_sent": self.tokens_sent,
+            "saved": saved,
+            "saved_rate": saved / self.tokens_in if self.tokens_in else 0.0,
+            "trimmed": self.trimmed,
+            "skipped": self.skipped,
+        }
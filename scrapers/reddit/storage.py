@@ -0,0 +1,712 @@
+"""
+Storage helpers for the reddit spider: in-memory index of in-flight posts,
+the on-disk crawl state (scraped urls, search checkpoints, output row offsets)
+used to resume, and in-place or streaming rewrites of output.csv.
+"""
+
+import csv
+import json
+import os
+import sqlite3
+import sys
+from datetime import datetime
+from pathlib import Path
+from urllib.parse import urlparse
+
+import pandas as pd
+
+# Column order of the spider's output.csv
+OUTPUT_FIELDS = [
+    "post_title",
+    "post_url",
+    "subreddit",
+    "post_date",
+    "post_upvotes",
+    "total_comments",
+    "post_body",
+    "comment_1",
+    "comment_2",
+    "comment_3",
+    "comment_4",
+    "comment_5",
+    "scraped_at",
+]
+
+
+def get_post_id(post_url):
+    """
+    Extract the reddit post id from a post url.
+
+    Args:
+        post_url (str): e.g. https://www.reddit.com/r/sub/comments/1eubo5z/some_title/
+
+    Returns:
+        str: post id ('1eubo5z') or None if the url is not a post url
+    """
+    if not isinstance(post_url, str):
+        return None
+    parts = urlparse(post_url).path.strip("/").split("/")
+    # path format: r/<subreddit>/comments/<post_id>/<slug>
+    if len(parts) >= 4 and parts[2] == "comments":
+        return parts[3]
+    return None
+
+
+class PostStore:
+    """
+    Posts keyed by post_url, with a secondary index on post id.
+
+    Lookup, membership and update are O(1) so the spider callbacks never
+    have to scan every collected post.
+    """
+
+    def __init__(self, posts=None):
+        self._by_url = {}
+        self._url_by_id = {}
+        for post in posts or []:
+            self.add(post)
+
+    def __len__(self):
+        return len(self._by_url)
+
+    def __contains__(self, post_url):
+        return post_url in self._by_url
+
+    def __iter__(self):
+        return iter(self._by_url.values())
+
+    def add(self, post):
+        """Add a post dict. Returns False if its post_url is already stored."""
+        post_url = post.get("post_url")
+        if not isinstance(post_url, str) or post_url in self._by_url:
+            return False
+        self._by_url[post_url] = post
+        post_id = get_post_id(post_url)
+        if post_id:
+            self._url_by_id[post_id] = post_url
+        return True
+
+    def get(self, post_url):
+        return self._by_url.get(post_url)
+
+    def get_by_id(self, post_id):
+        post_url = self._url_by_id.get(post_id)
+        return self._by_url.get(post_url) if post_url else None
+
+    def pop(self, post_url):
+        """Remove and return a post, or None if unknown."""
+        post = self._by_url.pop(post_url, None)
+        if post is not None:
+            post_id = get_post_id(post_url)
+            if self._url_by_id.get(post_id) == post_url:
+                del self._url_by_id[post_id]
+        return post
+
+    def update(self, post_url, **fields):
+        """Update fields of a stored post. Returns the post, or None if unknown."""
+        post = self._by_url.get(post_url)
+        if post is not None:
+            post.update(fields)
+        return post
+
+
+class CrawlState:
+    """
+    SQLite file holding the urls of posts that were already written to the
+    output, so a resumed crawl can skip them without loading output.csv, a
+    checkpoint per search so pagination restarts where it left off, and the
+    posts scheduled from a checkpointed page that were not written yet.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(str(db_path), timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS scraped_posts (
+                post_url TEXT PRIMARY KEY,
+                post_id TEXT,
+                scraped_at TEXT
+            )
+            """
+        )
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS search_checkpoints (
+                search_url TEXT PRIMARY KEY,
+                cursor TEXT,
+                scroll_count INTEGER NOT NULL DEFAULT 0,
+                done INTEGER NOT NULL DEFAULT 0,
+                updated_at TEXT
+            )
+            """
+        )
+        self._add_missing_columns(
+            "scraped_posts",
+            {"post_upvotes": "INTEGER", "total_comments": "INTEGER"},
+        )
+        # posts found on a search page whose rows are not in the output yet;
+        # a resumed crawl requests them again as the checkpoint is past their page
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS pending_posts (
+                post_url TEXT PRIMARY KEY,
+                search_url TEXT,
+                post TEXT,
+                refresh INTEGER NOT NULL DEFAULT 0
+            )
+            """
+        )
+        # posts re-scraped by a refresh whose older output rows still need dropping
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS refreshed_posts (post_url TEXT PRIMARY KEY)"
+        )
+        # the output csv holding the new row; shards sharing this db each
+        # compact only their own output
+        self._add_missing_columns("refreshed_posts", {"csv_path": "TEXT"})
+        # byte range of every row of an output csv, so outdated rows can be
+        # blanked in place; output_index records how far each file was indexed
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS output_rows (
+                csv_path TEXT,
+                offset INTEGER,
+                length INTEGER,
+                post_url TEXT,
+                PRIMARY KEY (csv_path, offset)
+            )
+            """
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS output_rows_url ON output_rows (csv_path, post_url)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS output_index (csv_path TEXT PRIMARY KEY, indexed_to INTEGER)"
+        )
+        # output csvs whose rows are in scraped_posts (see import_csv)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS imported_csvs (csv_path TEXT PRIMARY KEY)"
+        )
+        self._add_missing_columns(
+            "search_checkpoints",
+            {
+                "low_yield_pages": "INTEGER NOT NULL DEFAULT 0",
+                "requests_used": "INTEGER NOT NULL DEFAULT 0",
+                "stop_reason": "TEXT",
+            },
+        )
+        self.conn.commit()
+
+    def _add_missing_columns(self, table, columns):
+        """Add columns introduced after a state db was first created."""
+        existing = {row[1] for row in self.conn.execute(f"PRAGMA table_info({table})")}
+        for name, definition in columns.items():
+            if name not in existing:
+                self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+
+    def count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM scraped_posts").fetchone()[0]
+
+    def is_scraped(self, post_url):
+        row = self.conn.execute(
+            "SELECT 1 FROM scraped_posts WHERE post_url = ?", (post_url,)
+        ).fetchone()
+        return row is not None
+
+    def filter_unscraped(self, post_urls):
+        """Return the subset of post_urls that are not in the index yet."""
+        post_urls = list(post_urls)
+        if not post_urls:
+            return set()
+        placeholders = ",".join("?" * len(post_urls))
+        rows = self.conn.execute(
+            f"SELECT post_url FROM scraped_posts WHERE post_url IN ({placeholders})",
+            post_urls,
+        ).fetchall()
+        return set(post_urls) - {row[0] for row in rows}
+
+    def mark_scraped(self, post, refreshed=False, csv_path=None):
+        post_url = post.get("post_url")
+        self.conn.execute(
+            "INSERT OR REPLACE INTO scraped_posts (post_url, post_id, scraped_at, post_upvotes, total_comments) VALUES (?, ?, ?, ?, ?)",
+            (
+                post_url,
+                get_post_id(post_url),
+                post.get("scraped_at") or datetime.now().isoformat(),
+                to_int(post.get("post_upvotes")),
+                to_int(post.get("total_comments")),
+            ),
+        )
+        if refreshed:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO refreshed_posts (post_url, csv_path) VALUES (?, ?)",
+                (post_url, _path_key(csv_path) if csv_path else None),
+            )
+        self.conn.execute("DELETE FROM pending_posts WHERE post_url = ?", (post_url,))
+        self.conn.commit()
+
+    def add_pending(self, search_url, posts, refresh_urls=()):
+        """Record the posts scheduled from a search page until they are written."""
+        refresh_urls = set(refresh_urls)
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO pending_posts (post_url, search_url, post, refresh) VALUES (?, ?, ?, ?)",
+            [
+                (
+                    post["post_url"],
+                    search_url,
+                    json.dumps(post, ensure_ascii=False, default=str),
+                    int(post["post_url"] in refresh_urls),
+                )
+                for post in posts
+            ],
+        )
+        self.conn.commit()
+
+    def remove_pending(self, post_url):
+        self.conn.execute("DELETE FROM pending_posts WHERE post_url = ?", (post_url,))
+        self.conn.commit()
+
+    def pending_posts(self, search_urls):
+        """
+        Returns:
+            list: (post dict, refresh flag) of the posts pending for these searches
+        """
+        search_urls = list(search_urls)
+        if not search_urls:
+            return []
+        placeholders = ",".join("?" * len(search_urls))
+        rows = self.conn.execute(
+            f"SELECT post, refresh FROM pending_posts WHERE search_url IN ({placeholders})",
+            search_urls,
+        ).fetchall()
+        return [(json.loads(row[0]), bool(row[1])) for row in rows]
+
+    def get_engagement(self, post_urls):
+        """
+        Returns:
+            dict: post_url -> {"post_upvotes", "total_comments", "scraped_at"}
+                for the urls that are in the index
+        """
+        post_urls = list(post_urls)
+        if not post_urls:
+            return {}
+        placeholders = ",".join("?" * len(post_urls))
+        rows = self.conn.execute(
+            f"SELECT post_url, post_upvotes, total_comments, scraped_at FROM scraped_posts WHERE post_url IN ({placeholders})",
+            post_urls,
+        ).fetchall()
+        return {
+            row[0]: {
+                "post_upvotes": row[1],
+                "total_comments": row[2],
+                "scraped_at": row[3],
+            }
+            for row in rows
+        }
+
+    def update_engagement(self, post_url, post_upvotes, total_comments):
+        """Record engagement seen on a search card without re-scraping the post."""
+        self.conn.execute(
+            "UPDATE scraped_posts SET post_upvotes = ?, total_comments = ? WHERE post_url = ?",
+            (to_int(post_upvotes), to_int(total_comments), post_url),
+        )
+        self.conn.commit()
+
+    def pending_refreshed_urls(self, csv_path):
+        """Refreshed posts whose new row is in csv_path (or in an unknown output)."""
+        rows = self.conn.execute(
+            "SELECT post_url FROM refreshed_posts WHERE csv_path = ? OR csv_path IS NULL",
+            (_path_key(csv_path),),
+        ).fetchall()
+        return {row[0] for row in rows}
+
+    def compact_refreshed(self, csv_path):
+        """
+        Drop the older output rows of refreshed posts so their new rows
+        replace them. Only safe while no feed export has csv_path open.
+
+        Returns:
+            int: number of rows dropped
+        """
+        refreshed = self.pending_refreshed_urls(csv_path)
+        if not refreshed:
+            return 0
+        try:
+            dropped = self.blank_outdated_rows(csv_path, refreshed)
+        except OutputIndexError as e:
+            print(f"⚠️ {e}; rewriting {csv_path}")
+            dropped = compact_output(csv_path, refreshed)
+            self._reset_output_index(csv_path)
+        self.conn.executemany(
+            "DELETE FROM refreshed_posts WHERE post_url = ? AND (csv_path = ? OR csv_path IS NULL)",
+            [(post_url, _path_key(csv_path)) for post_url in refreshed],
+        )
+        self.conn.commit()
+        return dropped
+
+    def _reset_output_index(self, csv_path):
+        key = _path_key(csv_path)
+        self.conn.execute("DELETE FROM output_rows WHERE csv_path = ?", (key,))
+        self.conn.execute("DELETE FROM output_index WHERE csv_path = ?", (key,))
+        self.conn.commit()
+
+    def index_output(self, csv_path):
+        """
+        Record the byte range of the rows appended to csv_path since it was
+        last indexed (the whole file the first time).
+
+        Returns:
+            int: number of rows indexed
+        """
+        key = _path_key(csv_path)
+        if not os.path.exists(csv_path):
+            return 0
+        row = self.conn.execute(
+            "SELECT indexed_to FROM output_index WHERE csv_path = ?", (key,)
+        ).fetchone()
+        start = row[0] if row else 0
+        if start > os.path.getsize(csv_path):
+            # the file was replaced or truncated since
+            self._reset_output_index(csv_path)
+            start = 0
+
+        rows = []
+        with open(csv_path, "rb") as f:
+            header = next(csv.reader([f.readline().decode("utf-8")]), [])
+            if "post_url" not in header:
+                return 0
+            url_idx = header.index("post_url")
+            f.seek(max(start, f.tell()))
+            for offset, record in iter_csv_records(f):
+                fields = next(csv.reader([record.decode("utf-8")]), [])
+                if fields == header or len(fields) <= url_idx:
+                    continue
+                rows.append((key, offset, len(record), fields[url_idx]))
+            end = f.tell()
+
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO output_rows (csv_path, offset, length, post_url) VALUES (?, ?, ?, ?)",
+            rows,
+        )
+        self.conn.execute(
+            "INSERT OR REPLACE INTO output_index (csv_path, indexed_to) VALUES (?, ?)",
+            (key, end),
+        )
+        self.conn.commit()
+        return len(rows)
+
+    def blank_outdated_rows(self, csv_path, post_urls):
+        """
+        Overwrite every row of post_urls but the last one with spaces, in place,
+        so only the outdated rows are written. Readers skip the blank lines
+        (pandas does by default, compact_output/merge_outputs drop them).
+
+        Returns:
+            int: number of rows blanked
+
+        Raises:
+            OutputIndexError: when a row is not where the index says
+        """
+        self.index_output(csv_path)
+        key = _path_key(csv_path)
+        outdated = []
+        for post_url in post_urls:
+            rows = self.conn.execute(
+                "SELECT offset, length FROM output_rows WHERE csv_path = ? AND post_url = ? ORDER BY offset",
+                (key, post_url),
+            ).fetchall()
+            outdated += [(post_url, offset, length) for offset, length in rows[:-1]]
+        if not outdated:
+            return 0
+
+        with open(csv_path, "r+b") as f:
+            # check every row first, so a stale index changes nothing
+            for post_url, offset, length in outdated:
+                f.seek(offset)
+                record = f.read(length).decode("utf-8", errors="replace")
+                if post_url not in next(csv.reader([record]), []):
+                    raise OutputIndexError(
+                        f"Row index of {csv_path} is out of date at byte {offset}"
+                    )
+            for post_url, offset, length in outdated:
+                f.seek(offset)
+                f.write(b" " * (length - 1) + b"\n")
+        self.conn.executemany(
+            "DELETE FROM output_rows WHERE csv_path = ? AND offset = ?",
+            [(key, offset) for _, offset, _ in outdated],
+        )
+        self.conn.commit()
+        return len(outdated)
+
+    def csv_imported(self, csv_path):
+        """Whether the rows of this output csv are already in the index."""
+        row = self.conn.execute(
+            "SELECT 1 FROM imported_csvs WHERE csv_path = ?", (_path_key(csv_path),)
+        ).fetchone()
+        return row is not None
+
+    def mark_csv_imported(self, csv_path):
+        """Record an output csv (e.g. one the crawl is about to create) as indexed."""
+        self.conn.execute(
+            "INSERT OR IGNORE INTO imported_csvs (csv_path) VALUES (?)",
+            (_path_key(csv_path),),
+        )
+        self.conn.commit()
+
+    def import_csv(self, csv_path, chunksize=10_000):
+        """
+        Build the index from an existing output.csv, reading only the url
+        columns in chunks so memory stays flat regardless of file size.
+        Runs in one transaction: if reading the csv fails nothing is
+        imported, and the csv is not marked as imported (see csv_imported).
+
+        Returns:
+            int: number of urls added to the index (urls already in it and
+                repeated rows are not counted)
+        """
+        changes_before = self.conn.total_changes
+        try:
+            for chunk in pd.read_csv(
+                csv_path,
+                usecols=["post_url", "scraped_at", "post_upvotes", "total_comments"],
+                dtype=str,
+                chunksize=chunksize,
+            ):
+                # skip header lines repeated by appending feed exports
+                chunk = chunk[chunk["post_url"] != "post_url"].dropna(
+                    subset=["post_url"]
+                )
+                rows = [
+                    (
+                        url,
+                        get_post_id(url),
+                        None if pd.isna(ts) else ts,
+                        to_int(upvotes),
+                        to_int(comments),
+                    )
+                    for url, ts, upvotes, comments in zip(
+                        chunk["post_url"],
+                        chunk["scraped_at"],
+                        chunk["post_upvotes"],
+                        chunk["total_comments"],
+                    )
+                ]
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO scraped_posts (post_url, post_id, scraped_at, post_upvotes, total_comments) VALUES (?, ?, ?, ?, ?)",
+                    rows,
+                )
+        except Exception:
+            self.conn.rollback()
+            raise
+        imported = self.conn.total_changes - changes_before
+        self.mark_csv_imported(csv_path)
+        return imported
+
+    def get_checkpoint(self, search_url):
+        """
+        Returns:
+            dict: {"cursor", "scroll_count", "done", "low_yield_pages",
+                "requests_used", "stop_reason"} or None if the search never ran
+        """
+        row = self.conn.execute(
+            "SELECT cursor, scroll_count, done, low_yield_pages, requests_used, stop_reason FROM search_checkpoints WHERE search_url = ?",
+            (search_url,),
+        ).fetchone()
+        if row is None:
+            return None
+        return {
+            "cursor": row[0],
+            "scroll_count": row[1],
+            "done": bool(row[2]),
+            "low_yield_pages": row[3],
+            "requests_used": row[4],
+            "stop_reason": row[5],
+        }
+
+    def save_checkpoint(
+        self,
+        search_url,
+        cursor,
+        scroll_count,
+        done=False,
+        low_yield_pages=0,
+        requests_used=0,
+        stop_reason=None,
+    ):
+        """Record the next page to fetch for a search (or why it finished)."""
+        self.conn.execute(
+            "INSERT OR REPLACE INTO search_checkpoints (search_url, cursor, scroll_count, done, low_yield_pages, requests_used, stop_reason, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                search_url,
+                cursor,
+                scroll_count,
+                int(done),
+                low_yield_pages,
+                requests_used,
+                stop_reason,
+                datetime.now().isoformat(),
+            ),
+        )
+        self.conn.commit()
+
+    def reset_checkpoints(self, search_urls=None):
+        """Forget the checkpoints of these searches (default: all of them)."""
+        if search_urls is None:
+            self.conn.execute("DELETE FROM search_checkpoints")
+        else:
+            self.conn.executemany(
+                "DELETE FROM search_checkpoints WHERE search_url = ?",
+                [(url,) for url in search_urls],
+            )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+def _path_key(csv_path):
+    """The same output file is stored under one path, however it was given."""
+    return str(Path(csv_path).resolve())
+
+
+class OutputIndexError(Exception):
+    """The output row index no longer matches the csv file."""
+
+
+def iter_csv_records(f):
+    """
+    Split a binary csv stream into records (a quoted field may hold newlines).
+
+    Yields:
+        tuple: (byte offset, record bytes including its line ending)
+    """
+    offset = f.tell()
+    lines = []
+    quotes = 0
+    for line in iter(f.readline, b""):
+        lines.append(line)
+        quotes += line.count(b'"')
+        # a record ends where its quotes are balanced ("" escapes count twice)
+        if quotes % 2 == 0:
+            record = b"".join(lines)
+            if record.strip():
+                yield offset, record
+            offset += len(record)
+            lines = []
+            quotes = 0
+
+
+def is_blank_row(row):
+    """Rows blanked by CrawlState.blank_outdated_rows read as a single spaces cell."""
+    return not any(cell.strip() for cell in row)
+
+
+def to_int(value):
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def compact_output(csv_path, post_urls):
+    """
+    Rewrite output.csv so each of post_urls keeps only its last (newest) row,
+    dropping header lines repeated by appended runs and blanked rows. Streams
+    the file twice; memory is proportional to len(post_urls), not the file
+    size. CrawlState.compact_refreshed only falls back to it when its row
+    index no longer matches the file.
+
+    Returns:
+        int: number of rows dropped
+    """
+    csv.field_size_limit(sys.maxsize)
+    post_urls = set(post_urls)
+    if not post_urls or not os.path.exists(csv_path):
+        return 0
+
+    # first pass: position of the last row of every refreshed post
+    last_row = {}
+    with open(csv_path, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return 0
+        url_idx = header.index("post_url")
+        for i, row in enumerate(reader):
+            if len(row) > url_idx and row[url_idx] in post_urls:
+                last_row[row[url_idx]] = i
+
+    dropped = 0
+    tmp_path = f"{csv_path}.tmp"
+    with open(csv_path, newline="", encoding="utf-8") as src, open(
+        tmp_path, "w", newline="", encoding="utf-8"
+    ) as dst:
+        reader = csv.reader(src)
+        writer = csv.writer(dst)
+        writer.writerow(next(reader))
+        for i, row in enumerate(reader):
+            if row == header or is_blank_row(row):
+                continue
+            url = row[url_idx] if len(row) > url_idx else None
+            if url in last_row and last_row[url] != i:
+                dropped += 1
+                continue
+            writer.writerow(row)
+    os.replace(tmp_path, csv_path)
+    return dropped
+
+
+def merge_outputs(input_paths, dest_path):
+    """
+    Merge spider output CSVs into dest_path, keeping one row per post_url
+    (the one with the newest scraped_at; later inputs win ties). dest_path
+    itself is included as the first input if it exists.
+
+    Returns:
+        int: number of rows written
+    """
+    csv.field_size_limit(sys.maxsize)
+    paths = [p for p in [dest_path, *input_paths] if os.path.exists(p)]
+    if not paths:
+        return 0
+
+    with open(paths[0], newline="", encoding="utf-8") as f:
+        fieldnames = next(csv.reader(f), None)
+    fieldnames = fieldnames or []
+    fieldnames += [field for field in OUTPUT_FIELDS if field not in fieldnames]
+
+    def iter_rows():
+        for file_idx, path in enumerate(paths):
+            with open(path, newline="", encoding="utf-8") as f:
+                reader = csv.DictReader(f)
+                for row_idx, row in enumerate(reader):
+                    # header lines repeated by appending feed exports
+                    if row.get("post_url") == "post_url":
+                        continue
+                    yield (file_idx, row_idx), row
+
+    # first pass: newest row per post
+    best = {}
+    for position, row in iter_rows():
+        url = row.get("post_url")
+        if not url:
+            continue
+        key = (row.get("scraped_at") or "", position)
+        if url not in best or key >= best[url]:
+            best[url] = key
+
+    # second pass: write the winning rows
+    keep = {key[1] for key in best.values()}
+    del best
+    written = 0
+    tmp_path = f"{dest_path}.tmp"
+    with open(tmp_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction="ignore")
+        writer.writeheader()
+        for position, row in iter_rows():
+            if position in keep:
+                writer.writerow(row)
+                written += 1
+    os.replace(tmp_path, dest_path)
+    return written
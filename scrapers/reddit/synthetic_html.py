@@ -0,0 +1,131 @@
+"""
+Generator of Reddit-shaped HTML for benchmarking the page parsers: search
+result pages, post pages and comments partials with the same elements and
+attributes the parsers in functions.py read. Pages are deterministic for a
+given seed.
+"""
+
+import random
+
+WORDS = (
+    "digital rupee cbdc rbi upi bank wallet offline payment pilot retail "
+    "privacy adoption merchant cash token interest india launch"
+).split()
+
+
+def _sentence(rng, min_words=5, max_words=30):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(min_words, max_words)))
+
+
+def search_card(rng, index):
+    post_id = f"p{index:06d}"
+    title = _sentence(rng, 4, 14).capitalize()
+    return (
+        '<search-telemetry-tracker data-testid="search-sdui-post" view-events="search/view/post">'
+        '<div class="flex justify-between">'
+        f'<a data-testid="post-title" href="/r/india/comments/{post_id}/{title[:20].replace(" ", "_")}/" '
+        f'aria-label="{title}" class="absolute inset-0">{title}</a>'
+        '<div class="flex items-center"><faceplate-hovercard>'
+        '<span class="text-12 truncate">r/india</span></faceplate-hovercard>'
+        '<span class="mx-2xs">·</span>'
+        f'<faceplate-timeago ts="2025-0{rng.randint(1, 9)}-1{rng.randint(0, 9)}T10:00:00.000+0000">'
+        "<time>3 mo. ago</time></faceplate-timeago></div></div>"
+        '<div data-testid="search-counter-row" class="text-12">'
+        f'<span><faceplate-number number="{rng.randint(0, 5000)}">1.2k</faceplate-number> votes</span>'
+        "<span>·</span>"
+        f'<span><faceplate-number number="{rng.randint(0, 900)}">300</faceplate-number> comments</span>'
+        "</div></search-telemetry-tracker>"
+    )
+
+
+def search_page(posts=25, seed=0, cursor="c0ffee"):
+    """Search results page with `posts` search-telemetry-tracker cards."""
+    rng = random.Random(seed)
+    cards = "".join(search_card(rng, i) for i in range(posts))
+    partial = (
+        f'<faceplate-partial loading="lazy" src="/svc/shreddit/search?q=x&amp;cursor={cursor}">'
+        "</faceplate-partial>"
+    )
+    return _document(f"<main>{cards}{partial}</main>")
+
+
+def comment(rng, comment_id, parent_id, depth, breadth, max_depth, counter):
+    """One shreddit-comment with `breadth` replies per level down to max_depth."""
+    counter[0] += 1
+    replies = ""
+    if depth + 1 < max_depth:
+        replies = "".join(
+            comment(
+                rng,
+                f"{comment_id}_{i}",
+                comment_id,
+                depth + 1,
+                breadth,
+                max_depth,
+                counter,
+            )
+            for i in range(breadth)
+        )
+    paragraphs = "".join(f"<p>{_sentence(rng)}</p>" for _ in range(rng.randint(1, 3)))
+    return (
+        f'<shreddit-comment thingid="{comment_id}" author="user{counter[0]}" '
+        f'score="{rng.randint(-10, 2000)}" depth="{depth}" postid="t3_p000001" '
+        f'permalink="/r/india/comments/p000001/c/{comment_id}/" parentid="{parent_id}">'
+        '<div slot="commentMeta"><faceplate-timeago ts="2025-01-01T00:00:00.000Z">'
+        '<time datetime="2025-01-01T00:00:00.000Z">2mo ago</time></faceplate-timeago></div>'
+        f'<div class="md text-14-scalable" slot="comment"><div id="{comment_id}-post-rtjson-content" '
+        'class="py-0 xs:mx-xs mx-2xs inline-block max-w-full scalable-text" style="--emote-size: 20px">'
+        f"{paragraphs}</div></div>"
+        '<shreddit-comment-action-row slot="actionRow"></shreddit-comment-action-row>'
+        f"{replies}</shreddit-comment>"
+    )
+
+
+def comments_page(roots=10, breadth=2, depth=3, seed=0):
+    """
+    svc/shreddit/comments partial with `roots` top-level comments, each with
+    `breadth` replies per level down to `depth` levels.
+
+    Returns:
+        tuple: (html, number of comments)
+    """
+    rng = random.Random(seed)
+    counter = [0]
+    comments = "".join(
+        comment(rng, f"t1_{i:04d}", "", 0, breadth, depth, counter) for i in range(roots)
+    )
+    html = (
+        f'<shreddit-comment-tree totalComments="{counter[0]}" post-id="t3_p000001">'
+        f"{comments}</shreddit-comment-tree>"
+    )
+    return html, counter[0]
+
+
+def post_page(roots=10, breadth=2, depth=3, body_paragraphs=5, seed=0):
+    """
+    Post page with a shreddit-post, its text body and an embedded comment tree.
+
+    Returns:
+        tuple: (html, number of comments)
+    """
+    rng = random.Random(seed)
+    tree, count = comments_page(roots, breadth, depth, seed)
+    body = "".join(f"<p>{_sentence(rng, 20, 60)}</p>" for _ in range(body_paragraphs))
+    post = (
+        f'<shreddit-post id="t3_p000001" score="{rng.randint(0, 5000)}" comment-count="{count}" '
+        'post-title="Synthetic post" subreddit-prefixed-name="r/india">'
+        f'<div class="text-neutral-content" slot="text-body"><div class="md text-14-scalable">{body}</div></div>'
+        "</shreddit-post>"
+    )
+    return _document(f"<main>{post}{tree}</main>"), count
+
+
+def _document(main):
+    # the head and script noise every reddit page carries
+    head = (
+        "<head><title>reddit</title>"
+        + "".join(f'<script src="/static/{i}.js"></script>' for i in range(10))
+        + '<script type="application/json">{"config": {"flags": [1, 2, 3]}}</script>'
+        "<style>.md p{margin:0}</style></head>"
+    )
+    return f"<!DOCTYPE html><html>{head}<body><shreddit-app>{main}</shreddit-app></body></html>"
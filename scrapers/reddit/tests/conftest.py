@@ -0,0 +1,8 @@
+import os
+import sys
+from pathlib import Path
+
+# the scraper modules import each other as top-level modules
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+# functions.py creates its Gemini client at import; no request is ever sent
+os.environ.setdefault("GEMINI_API_KEY", "test")
@@ -0,0 +1,20 @@
+from http_cache import ResponseCache
+
+URL = "https://www.reddit.com/r/india/comments/p000001/"
+
+
+def test_put_same_body_twice(tmp_path):
+    cache = ResponseCache(tmp_path)
+    cache.put(URL, 200, {}, b"hello")
+    cache.put(URL, 200, {}, b"hello")
+    assert cache.get(URL)["body"] == b"hello"
+    refs = cache.conn.execute("SELECT refs FROM blobs").fetchall()
+    assert refs == [(1,)]
+
+
+def test_put_new_body_releases_old_blob(tmp_path):
+    cache = ResponseCache(tmp_path)
+    cache.put(URL, 200, {}, b"hello")
+    cache.put(URL, 200, {}, b"bye")
+    assert cache.get(URL)["body"] == b"bye"
+    assert cache.conn.execute("SELECT COUNT(*) FROM blobs").fetchone()[0] == 1
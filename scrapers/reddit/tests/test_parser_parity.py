@@ -0,0 +1,138 @@
+"""
+The lxml and BeautifulSoup backends must produce identical output on the
+synthetic pages of synthetic_html.py (see parser_parity.py for recorded pages).
+"""
+
+import pytest
+
+pytest.importorskip("lxml")
+
+import functions
+import lxml_parsers
+import parse_pool
+import synthetic_html
+from parser_parity import check_page
+
+# (roots, breadth, depth) of the generated comment trees
+TREE_SHAPES = [(0, 0, 1), (1, 1, 1), (3, 2, 3), (10, 3, 2), (2, 1, 8)]
+
+MORE_REPLIES = (
+    '<shreddit-comment-tree totalComments="3" post-id="t3_p000001">'
+    '<shreddit-comment thingid="t1_a" score="12" depth="0" parentid="" '
+    'permalink="/r/india/comments/p000001/c/t1_a/">'
+    '<div slot="comment"><p>Top comment with <a href="/x">a link</a> &amp; entities</p></div>'
+    '<shreddit-comment thingid="t1_b" score="-3" depth="1" parentid="t1_a" '
+    'permalink="/r/india/comments/p000001/c/t1_b/">'
+    '<div slot="comment"><p>First line</p><p>Second   line</p></div>'
+    "</shreddit-comment>"
+    '<faceplate-partial loading="action" method="POST" '
+    'src="/svc/shreddit/more-comments/india/t3_p000001?top-level=0">'
+    '<input type="hidden" name="cursor" value="abc"></faceplate-partial>'
+    "</shreddit-comment>"
+    '<shreddit-comment thingid="t1_c" score="x" depth="0" parentid="" permalink="">'
+    '<div slot="comment"></div></shreddit-comment>'
+    "</shreddit-comment-tree>"
+)
+
+# a reply before its parent, a reply whose parent is missing and a bad depth
+OUT_OF_ORDER = (
+    '<shreddit-comment-tree totalComments="5">'
+    '<shreddit-comment thingid="t1_b" score="1" depth="1" parentid="t1_a" permalink="">'
+    '<div slot="comment"><p>Reply first</p></div></shreddit-comment>'
+    '<shreddit-comment thingid="t1_a" score="2" depth="0" parentid="" permalink="">'
+    '<div slot="comment"><p>Parent</p></div></shreddit-comment>'
+    '<shreddit-comment thingid="t1_x" score="3" depth="1" parentid="t1_gone" permalink="">'
+    '<shreddit-comment thingid="t1_y" score="4" depth="2" parentid="t1_x" permalink="">'
+    "</shreddit-comment></shreddit-comment>"
+    '<shreddit-comment thingid="t1_n" score="5" depth="-1" parentid="" permalink="">'
+    "</shreddit-comment>"
+    '<shreddit-comment thingid="t1_c" score="6" depth="1" parentid="t1_a" permalink="">'
+    "</shreddit-comment>"
+    "</shreddit-comment-tree>"
+)
+
+
+def run_backends(monkeypatch, parser, *args):
+    """Results of parser under each backend, as {backend: result}."""
+    results = {}
+    for name in ("bs4", "lxml"):
+        monkeypatch.setattr(functions, "PARSER_BACKEND", name)
+        results[name] = parser(*args)
+    return results
+
+
+@pytest.mark.parametrize("posts", [0, 1, 25])
+def test_parse_search(monkeypatch, posts):
+    html = synthetic_html.search_page(posts=posts, seed=posts)
+    results = run_backends(monkeypatch, parse_pool.parse_search, html)
+    assert results["bs4"] == results["lxml"]
+    found, cursor = results["lxml"]
+    assert len(found) == posts
+    assert cursor == "c0ffee"
+
+
+@pytest.mark.parametrize("shape", TREE_SHAPES)
+@pytest.mark.parametrize("with_comments", [False, True])
+def test_parse_post(monkeypatch, shape, with_comments):
+    html, count = synthetic_html.post_page(*shape, seed=sum(shape))
+    results = run_backends(monkeypatch, parse_pool.parse_post, html, with_comments, True)
+    assert results["bs4"] == results["lxml"]
+    assert results["lxml"][1] == count
+
+
+@pytest.mark.parametrize("shape", TREE_SHAPES)
+def test_parse_comments(monkeypatch, shape):
+    html, count = synthetic_html.comments_page(*shape, seed=sum(shape))
+    results = run_backends(monkeypatch, parse_pool.parse_comments, html, True)
+    assert results["bs4"] == results["lxml"]
+    comments_data, _ = results["lxml"]
+    assert len(comments_data["comments"]) == shape[0]
+
+
+@pytest.mark.parametrize("shape", TREE_SHAPES)
+def test_parse_comment_forest(shape):
+    html, count = synthetic_html.comments_page(*shape, seed=sum(shape))
+    bs4_forest = functions.parse_comment_forest(html, backend="bs4")
+    lxml_forest = functions.parse_comment_forest(html, backend="lxml")
+    assert bs4_forest.to_comments() == lxml_forest.to_comments()
+    assert len(lxml_forest) == count
+    # the forest holds the same comments as the dict tree
+    tree = functions.parse_comments_structure(html, backend="lxml")
+    assert lxml_forest.to_comments() == tree
+
+
+def test_hand_written_comments_page():
+    for parser in (functions.parse_comments_structure, functions.parse_comment_forest):
+        bs4_result = parser(MORE_REPLIES, backend="bs4")
+        lxml_result = parser(MORE_REPLIES, backend="lxml")
+        if parser is functions.parse_comment_forest:
+            bs4_result, lxml_result = bs4_result.to_comments(), lxml_result.to_comments()
+        assert bs4_result == lxml_result
+
+
+@pytest.mark.parametrize("backend", ["bs4", "lxml"])
+def test_comment_forest_out_of_order(backend):
+    forest = functions.parse_comment_forest(OUT_OF_ORDER, backend=backend)
+    assert forest.to_comments() == functions.parse_comments_structure(
+        OUT_OF_ORDER, backend=backend
+    )
+    assert [forest.ids[i] for i in range(len(forest))] == ["t1_a", "t1_b", "t1_c"]
+    assert forest.parent.tolist() == [-1, 0, 0]
+
+
+def test_lxml_error_falls_back_to_bs4(monkeypatch):
+    html, _ = synthetic_html.post_page(3, 2, 2)
+    expected = functions.parse_post_page_with_comments(html, backend="bs4")
+
+    def broken(root):
+        raise ValueError("broken extractor")
+
+    monkeypatch.setattr(lxml_parsers, "parse_post_details", broken)
+    assert functions.parse_post_page_with_comments(html, backend="lxml") == expected
+    assert functions.parse_post_details(html, backend="lxml") == expected[:3]
+
+
+def test_check_page_on_synthetic_pages():
+    assert check_page("search", synthetic_html.search_page(posts=5)) == []
+    assert check_page("post", synthetic_html.post_page(3, 2, 2)[0]) == []
+    assert check_page("comments", synthetic_html.comments_page(3, 2, 2)[0]) == []